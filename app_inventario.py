@@ -1,14 +1,17 @@
 import streamlit as st
 import pandas as pd
 import db_manager
-from qrcode import QRCode
-import io
 import os
-import time
-from fpdf import FPDF
 from datetime import datetime
-import cloudinary
-import cloudinary.uploader
+import caricamento_foto
+import esportazione
+import importazione
+import etichette
+import indice_foto
+import mappa_magazzino
+import stoccaggio
+import strumentazione
+import uuid
 from streamlit_qrcode_scanner import qrcode_scanner
 
 # --- CONFIGURAZIONE PERCORSI ASSETS ---
@@ -43,30 +46,7 @@ LOGHI = {
     "🖨️ Stampa": PATH_STAMPA
 }
 
-# --- CONFIGURAZIONE CLOUDINARY ---
-try:
-    if "CLOUDINARY_CLOUD_NAME" in st.secrets:
-        cloudinary.config(
-            cloud_name = st.secrets["CLOUDINARY_CLOUD_NAME"],
-            api_key = st.secrets["CLOUDINARY_API_KEY"],
-            api_secret = st.secrets["CLOUDINARY_API_SECRET"],
-            secure = True
-        )
-except:
-    pass
-
-# --- ESTETICA PROFESSIONALE (FIX DARK MODE & CONTRASTO) ---
-# --- CONFIGURAZIONE CLOUDINARY ---
-try:
-    if "CLOUDINARY_CLOUD_NAME" in st.secrets:
-        cloudinary.config(
-            cloud_name = st.secrets["CLOUDINARY_CLOUD_NAME"],
-            api_key = st.secrets["CLOUDINARY_API_KEY"],
-            api_secret = st.secrets["CLOUDINARY_API_SECRET"],
-            secure = True
-        )
-except:
-    pass
+# --- CONFIGURAZIONE CLOUDINARY: fatta una volta sola in db_manager ---
 
 # --- ESTETICA PROFESSIONALE (ALTO CONTRASTO CIANO NEON) ---
 # --- ESTETICA PROFESSIONALE (FORZA TEMA CHIARO & CONTRASTO) ---
@@ -122,6 +102,7 @@ st.markdown("""
 # --- INIZIALIZZAZIONE DATABASE ---
 db = db_manager.InventarioDB()
 utenti = ["Victor", "Evelyn", "Daniel", "Carly", "Rebby"]
+AGGIORNAMENTO_HOME = 5  # secondi tra un ridisegno e l'altro di contatori e mappa (flusso attivo)
 
 # Dizionario Emoji per i proprietari
 EMOJI_PROPRIETARI = {
@@ -137,20 +118,48 @@ EMOJI_PROPRIETARI = {
 # --- GESTIONE MENU UNICO (PULITO) ---
 # Usiamo solo questo, così i loghi funzionano sempre
 scelta = st.sidebar.selectbox("Inventario Casa Hernandez", list(LOGHI.keys()))
+# Misure di prestazione per sessione e pagina (attive solo con STRUMENTAZIONE nei secrets o VHD_STRUMENTAZIONE=1)
+id_sessione = st.session_state.setdefault("_id_sessione", uuid.uuid4().hex[:8])
+strumentazione.inizia_rerun(scelta, id_sessione)
 st.image(LOGHI[scelta], width=180) 
 
+# --- NOTIFICHE (messaggi che sopravvivono a st.rerun, senza sleep) ---
+def notifica(messaggio, tipo="success", festa=False):
+    """Da chiamare prima di st.rerun(): il messaggio compare all'inizio del rerun successivo."""
+    st.session_state.setdefault("_notifiche", []).append((tipo, messaggio, festa))
+
+def mostra_notifiche():
+    for tipo, messaggio, festa in st.session_state.pop("_notifiche", []):
+        getattr(st, tipo)(messaggio)
+        if festa:
+            st.balloons()
+
+mostra_notifiche()
+
 # --- FUNZIONE UPLOAD FOTO ---
+def upload_foto_multiple(foto, nome):
+    """Carica in parallelo {tipo: file} e restituisce {tipo: url} ("" se manca o fallisce)."""
+    prefisso = (nome[:3].upper()) if len(nome) >= 3 else "BOX"
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    richieste = {
+        tipo: (file, {"folder": "VHD_Inventario", "public_id": f"{prefisso}_{tipo}_{timestamp}"})
+        for tipo, file in foto.items() if file
+    }
+    esiti = caricamento_foto.carica_foto(richieste, impronta=indice_foto.hash_percettivo)
+    for tipo, esito in esiti.items():
+        if esito.errore:
+            st.error(f"Errore upload foto {tipo.capitalize()}: {esito.errore}")
+    db.registra_impronte(esiti.values())
+    return {tipo: (esiti[tipo].url or "") if tipo in esiti else "" for tipo in foto}
+
 def upload_foto(file, nome, tipo):
-    if file:
-        try:
-            prefisso = (nome[:3].upper()) if len(nome) >= 3 else "BOX"
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            nome_unico = f"{prefisso}_{tipo}_{timestamp}"
-            ris = cloudinary.uploader.upload(file, folder="VHD_Inventario", public_id=nome_unico)
-            return ris['secure_url']
-        except:
-            return ""
-    return ""
+    return upload_foto_multiple({tipo: file}, nome)[tipo]
+
+def foto(url, alta_risoluzione=False):
+    """Anteprima leggera per gli elenchi; l'originale solo quando richiesto."""
+    if not url:
+        return NO_PHOTO
+    return url if alta_risoluzione else caricamento_foto.url_miniatura(url)
 
 
 # --- 🏠 HOME ---
@@ -158,10 +167,13 @@ def upload_foto(file, nome, tipo):
 if scelta == "🏠 Home":
     st.title("📊 Inventario Casa Hernandez")
     
+    # Con il flusso delle modifiche attivo contatori e mappa si ridisegnano da soli,
+    # leggendo lo snapshot condiviso: le scatole spostate da altri compaiono senza ricaricare
+    aggiornamento = AGGIORNAMENTO_HOME if db.modifiche_in_diretta() else None
+
     # --- RECUPERO DATI ---
-    inv_data = db.visualizza_inventario()
-    pos = db.visualizza_posizioni()
-    df = pd.DataFrame(inv_data) if inv_data else pd.DataFrame()
+    # Tutto in parallelo al primo disegno; i frammenti poi rileggono dalla cache o dallo snapshot
+    stats, _, _ = db.carica_bundle("statistiche", "posizioni", "occupazione")
 
     # --- BOTTONE SVEGLIA DB (In alto a destra) ---
     col_testo, col_bottone = st.columns([2, 1])
@@ -173,52 +185,66 @@ if scelta == "🏠 Home":
                     st.toast("Connesso!", icon="✅")
                     st.rerun()
 
-    # --- 1. METRICHE (In alto) ---
-    c1, c2, c3, c4 = st.columns(4)
-    tot_scatole = len(inv_data)
-    c1.metric("📦 Scatole", tot_scatole)
-    
-    zone_uniche = len(set([p.get('zona') for p in pos if p.get('zona')])) if pos else 0
-    c2.metric("📍 Zone", zone_uniche)
-    c3.metric("📌 Ubicazioni", len(pos))
+    # Modalità offline-first: quante modifiche aspettano ancora di arrivare al cloud
+    stato_sync = db.stato_sincronizzazione()
+    if stato_sync:
+        with col_testo:
+            if stato_sync["in_attesa"]:
+                st.caption(f"🛰️ {stato_sync['in_attesa']} modifiche salvate sul dispositivo, in attesa del cloud")
+            else:
+                st.caption("🛰️ Dati locali allineati con il cloud")
+            if stato_sync["conflitti"]:
+                st.caption(f"⚠️ {stato_sync['conflitti']} modifiche scartate per conflitto (vedi tabella 'conflitti')")
 
-    count_da_allocare = 0
-    if inv_data:
-        count_da_allocare = len([s for s in inv_data if not s.get('ubi') or str(s.get('ubi')).strip().upper() in ["", "NON ALLOCATA"]])
-    
-    c4.metric("🚚 In Giro", count_da_allocare, delta=f"{count_da_allocare} da sistemare", delta_color="inverse")
+    @st.fragment(run_every=aggiornamento)
+    @strumentazione.frammento(f"{scelta} · contatori_home", id_sessione)
+    def contatori_home():
+        # Contatori già aggregati (dal database, o dallo snapshot in memoria con il flusso attivo)
+        stats = db.statistiche_magazzino()
 
-    st.write("---")
+        # --- 1. METRICHE (In alto) ---
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric("📦 Scatole", stats["scatole"])
+        c2.metric("📍 Zone", stats["zone"])
+        c3.metric("📌 Ubicazioni", stats["ubicazioni"])
 
-    # --- 2. ULTIME SCATOLE REGISTRATE (Seconda posizione) ---
-    if inv_data:
-        st.subheader("🕒 Ultime Scatole Registrate")
-        mappa_nomi = {"nome": "Nome", "zon": "Zona", "ubi": "Ubicazione", "proprietario": "Proprietario"}
-        cols_esistenti = [c for c in mappa_nomi.keys() if c in df.columns]
-        st.dataframe(df[cols_esistenti].tail(5).rename(columns=mappa_nomi), use_container_width=True, hide_index=True)
-        st.write("---")
+        count_da_allocare = stats["da_allocare"]
+        c4.metric("🚚 In Giro", count_da_allocare, delta=f"{count_da_allocare} da sistemare", delta_color="inverse")
 
-    # --- 3. GRAFICA (COLORI AZZURRO E VERDE) ---
-    if not df.empty:
-        col_g1, col_g2 = st.columns(2)
-        
-        with col_g1:
-            st.subheader("👥 Carico Proprietari")
-            if 'proprietario' in df.columns:
-                prop_counts = df['proprietario'].value_counts()
-                # Colore Azzurro come richiesto
-                st.bar_chart(prop_counts, color="#00BFFF") 
-                st.caption("Distribuzione del carico per ogni proprietario.")
-        
-        with col_g2:
-            st.subheader("📍 Saturazione Zone")
-            if 'zon' in df.columns:
-                zona_counts = df['zon'].value_counts()
-                # Colore Verde come richiesto
-                st.bar_chart(zona_counts, color="#28A745")
-                st.caption("Occupazione delle diverse zone del magazzino.")
         st.write("---")
 
+        # --- 2. ULTIME SCATOLE REGISTRATE (Seconda posizione) ---
+        if stats["ultime"]:
+            st.subheader("🕒 Ultime Scatole Registrate")
+            mappa_nomi = {"nome": "Nome", "zon": "Zona", "ubi": "Ubicazione", "proprietario": "Proprietario"}
+            df_ultime = pd.DataFrame(stats["ultime"])
+            cols_esistenti = [c for c in mappa_nomi.keys() if c in df_ultime.columns]
+            st.dataframe(df_ultime[cols_esistenti].rename(columns=mappa_nomi), use_container_width=True, hide_index=True)
+            st.write("---")
+
+        # --- 3. GRAFICA (COLORI AZZURRO E VERDE) ---
+        if stats["scatole"]:
+            col_g1, col_g2 = st.columns(2)
+        
+            with col_g1:
+                st.subheader("👥 Carico Proprietari")
+                if stats["per_proprietario"]:
+                    prop_counts = pd.Series(stats["per_proprietario"], name="count")
+                    # Colore Azzurro come richiesto
+                    st.bar_chart(prop_counts, color="#00BFFF") 
+                    st.caption("Distribuzione del carico per ogni proprietario.")
+        
+            with col_g2:
+                st.subheader("📍 Saturazione Zone")
+                if stats["per_zona"]:
+                    zona_counts = pd.Series(stats["per_zona"], name="count")
+                    # Colore Verde come richiesto
+                    st.bar_chart(zona_counts, color="#28A745")
+                    st.caption("Occupazione delle diverse zone del magazzino.")
+            st.write("---")
+
+    contatori_home()
+
     # --- 4. IL RESTO (Glossario, Export e Mappa) ---
     
     # Glossario e Consigli
@@ -232,59 +258,72 @@ if scelta == "🏠 Home":
             </div>
         """, unsafe_allow_html=True)
 
-    # Tasto Export Excel
-    if inv_data:
-        import io
-        df_exp = df.copy()
-        buffer = io.BytesIO()
-        with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
-            df_exp.to_excel(writer, index=False)
-        
+    # Tasto Export: il file si prepara solo su richiesta (e resta in cache finché i dati non cambiano)
+    if stats["scatole"]:
         st.write("")
-        st.download_button(
-            label="📥 Esporta Inventario Completo (Excel)",
-            data=buffer,
-            file_name="inventario_hernandez.xlsx",
-            mime="application/vnd.ms-excel",
-            use_container_width=True
-        )
+        col_formato, col_export = st.columns([1, 2])
+        formato = col_formato.selectbox("Formato export", list(esportazione.FORMATI),
+                                        format_func=lambda f: esportazione.FORMATI[f][0], label_visibility="collapsed")
+        if col_export.button("📥 Esporta Inventario Completo", use_container_width=True):
+            st.session_state["export_richiesto"] = formato
+        # La richiesta vale per un solo giro: alla prossima interazione il file non si ricalcola
+        if st.session_state.pop("export_richiesto", None) == formato:
+            with st.spinner("Preparazione export..."):
+                file_export = db.esporta_inventario(formato)
+            if file_export:
+                st.download_button(
+                    label=f"💾 Scarica inventario ({esportazione.FORMATI[formato][0]})",
+                    data=file_export,
+                    file_name=f"inventario_hernandez.{formato}",
+                    mime=esportazione.FORMATI[formato][1],
+                    on_click="ignore",  # scaricare non fa ripartire la pagina: il tasto resta fino alla prossima azione
+                    use_container_width=True
+                )
 
     # Mappa Stato Scaffalatura con TOOLTIP RIPRISTINATO
     st.write("---")
     st.subheader("🗺️ Mappa Stato Occupazione Magazzino")
-    if pos:
-        # Mappa Ubicazione -> Nome Contenuto
-        mappa_occupazione = {
-            str(s.get('ubi', '')).strip().upper(): s.get('nome', 'Senza Nome') 
-            for s in inv_data if s.get('ubi') and str(s.get('ubi')).upper() != "NON ALLOCATA"
-        }
-        
-        cols_per_row = 12
-        for i in range(0, len(pos), cols_per_row):
-            batch = pos[i:i + cols_per_row]
-            cols = st.columns(cols_per_row)
-            for j, p in enumerate(batch):
-                id_u_raw = p.get('id_ubicazione') or p.get('id')
-                id_u = str(id_u_raw).strip().upper() if id_u_raw else "N/D"
-                
-                piena = id_u in mappa_occupazione
-                nome_contenuto = mappa_occupazione.get(id_u, "Libera")
-                
-                color = "#FF4B4B" if piena else "#28A745" # Rosso se piena, Verde se libera
-                icon = "📦" if piena else "✅"
-                
-                with cols[j]:
-                    # Tooltip ripristinato tramite l'attributo 'title'
-                    st.markdown(f'''
-                        <div title="Ubicazione: {id_u}&#10;Contenuto: {nome_contenuto}" 
-                             style="background-color:{color}; color:white !important; padding:5px; 
-                             border-radius:3px; text-align:center; font-size:8px; line-height:1.2;
-                             min-height:45px; border: 1px solid rgba(255,255,255,0.2); cursor:help;">
-                        <span style="color: white !important;">{icon}</span><br>
-                        <span style="color: white !important; font-weight: bold; font-size: 7px;">{id_u}</span>
-                        </div>''', unsafe_allow_html=True)
-    else:
-        st.warning("⚠️ Nessuna ubicazione trovata. Configura le posizioni nel database.")
+
+    @st.fragment(run_every=aggiornamento)
+    @strumentazione.frammento(f"{scelta} · mappa_home", id_sessione)
+    def mappa_home():
+        # Per la mappa bastano nome e ubicazione delle scatole
+        pos, occupazione = db.carica_bundle("posizioni", "occupazione")
+        if pos:
+            # Unione ubicazioni/inventario con un solo merge e griglia in un unico blocco HTML per zona
+            mappa = mappa_magazzino.calcola_occupazione(occupazione, pos)
+            st.markdown(mappa_magazzino.html_mappa(mappa), unsafe_allow_html=True)
+        else:
+            st.warning("⚠️ Nessuna ubicazione trovata. Configura le posizioni nel database.")
+
+    mappa_home()
+
+    # Zona -> corsia -> ripiano dai codici delle etichette (GAR.1.3): letture sull'indice, non sulle tabelle
+    zone_mag = db.zone_magazzino()
+    if zone_mag:
+        with st.expander("🔎 Esplora ubicazioni"):
+            col_z, col_c = st.columns(2)
+            zona_es = col_z.selectbox("Zona", zone_mag, key="esplora_zona")
+            corsie = db.corsie_zona(zona_es)
+            corsia_es = col_c.selectbox("Corsia", ["Tutte"] + corsie, key="esplora_corsia")
+            corsia_es = None if corsia_es == "Tutte" else corsia_es
+
+            tab_dentro, tab_liberi = st.tabs(["📦 Cosa c'è", "✅ Posti liberi"])
+            with tab_dentro:
+                contenuto = db.scatole_in(zona_es, corsia_es)
+                if not contenuto:
+                    st.info("Nessuna scatola qui.")
+                for posto, scatole in contenuto:
+                    nomi = ", ".join(f"**{s.get('nome')}** ({s.get('proprietario', 'N/D')})" for s in scatole)
+                    st.markdown(f"📍 `{posto['codice']}` · {posto['occupati']}/{posto['capienza']} — {nomi}")
+            with tab_liberi:
+                liberi = db.posti_liberi(zona_es, corsia_es)
+                st.caption(f"{sum(p['liberi'] for p in liberi)} posti liberi in {len(liberi)} ubicazioni")
+                if liberi:
+                    st.dataframe(pd.DataFrame(liberi)[["codice", "corsia", "ripiano", "capienza", "liberi"]].rename(
+                        columns={"codice": "Ubicazione", "corsia": "Corsia", "ripiano": "Ripiano",
+                                 "capienza": "Capienza", "liberi": "Liberi"}),
+                        use_container_width=True, hide_index=True)
         
 
 
@@ -294,65 +333,160 @@ if scelta == "🏠 Home":
 elif scelta == "🔍 Cerca ed Elimina":
     st.title("Ricerca e Gestione")
     
-    chiave = st.text_input("🔍 Cosa stai cercando?", placeholder="Viti, Garage, Victor...", help="Scrivi qui per filtrare i risultati")
+    with st.expander("📷 Cerca per foto"):
+        foto_cercata = st.file_uploader("Fotografa la scatola: trovo quelle che le somigliano", type=['png', 'jpg', 'jpeg'], key="cerca_foto")
+        if foto_cercata:
+            simili = db.scatole_simili(foto_cercata)
+            if not simili:
+                st.info("Nessuna scatola con foto simili.")
+            for s_simile, distanza, url_simile in simili:
+                col_img, col_txt = st.columns([1, 3])
+                col_img.image(foto(url_simile), use_container_width=True)
+                col_txt.write(f"📦 **{s_simile.get('nome')}** · 📍 {s_simile.get('zon')} - {s_simile.get('ubi')} · "
+                              f"somiglianza {100 - distanza * 100 // 64}%")
     
-    with st.spinner("Ricerca in corso..."):
-        ris = db.cerca_scatola(chiave) if chiave else db.visualizza_inventario()
+    MIN_CARATTERI_RICERCA = 2  # con una lettera sola quasi tutto corrisponde: si aspetta la seconda
     
-    if ris:
-        st.write(f"✅ Trovate {len(ris)} scatole")
-        for r in ris:
-            id_db = r.get('id')
-            nome = r.get('nome', 'Senza Nome')
-            desc = r.get('descrizione', '-')
-            zona = r.get('zon', 'N/D')
-            ubi = r.get('ubi', 'N/D')
-            prop = r.get('proprietario', 'N/D')
-            data_reg = r.get('data_inserimento', 'Data non disp.')
+    # Callback dei pulsanti: girano prima del rerun del frammento, che si ridisegna
+    # una volta sola con la lista in memoria già aggiornata (niente ricarica completa)
+    def elimina_dalla_lista(id_db, stato):
+        if db.elimina_scatola(id_db):
+            stato["eliminate"].add(id_db)
+            stato["versione"] = db.versione_dati()
+    
+    def salva_modifica(r, stato):
+        id_db = r.get('id')
+        nome, desc, prop = (st.session_state[f"mod_{campo}_{id_db}"] for campo in ("nome", "desc", "prop"))
+        if db.aggiorna_dati_scatola(id_db, nome, desc, prop, r.get('cima_testo'), r.get('centro_testo'), r.get('fondo_testo')):
+            # Si rilegge solo questa scatola e la si sostituisce nella lista
+            nuova = db.leggi_scatola(id_db) or dict(r, nome=nome, descrizione=desc, proprietario=prop)
+            stato["righe"] = [nuova if x.get('id') == id_db else x for x in stato["righe"]]
+            stato["versione"] = db.versione_dati()
+            st.session_state[f"mod_{id_db}"] = False
+    
+    def carica_altre(stato):
+        if stato["resto"]:
+            stato["righe"].extend(stato["resto"][:db_manager.DIMENSIONE_PAGINA])
+            stato["resto"] = stato["resto"][db_manager.DIMENSIONE_PAGINA:]
+        else:
+            righe, cursore = db.pagina_inventario("*", dopo_id=stato["cursore"])
+            stato["righe"].extend(righe)
+            stato["cursore"] = cursore
+    
+    @st.fragment
+    @strumentazione.frammento(f"{scelta} · scheda_scatola", id_sessione)
+    def scheda_scatola(r, stato):
+        """Una scatola: eliminazione, modifica e foto HD rieseguono solo questo frammento."""
+        id_db = r.get('id')
+        if id_db in stato["eliminate"]:
+            st.caption(f"🗑️ Scatola '{r.get('nome')}' rimossa.")
+            return
+        nome = r.get('nome', 'Senza Nome')
+        desc = r.get('descrizione', '-')
+        zona = r.get('zon', 'N/D')
+        ubi = r.get('ubi', 'N/D')
+        prop = r.get('proprietario', 'N/D')
+        data_reg = r.get('data_inserimento', 'Data non disp.')
+        
+        # --- LOGICA EMOJI PERSONALIZZATA ---
+        # Cerchiamo l'emoji nel dizionario, se non esiste usiamo 👤
+        emoji_p = EMOJI_PROPRIETARI.get(prop, "👤")
+        
+        # Titolo dell'expander con l'emoji corretta
+        with st.expander(f"📦 {nome} | 📍 {zona} - {ubi} | {emoji_p} {prop}"):
+            st.markdown(f"<p style='color: #ADB5BD; font-size: 0.8rem;'>📅 Registrata il: {data_reg}</p>", unsafe_allow_html=True)
             
-            # --- LOGICA EMOJI PERSONALIZZATA ---
-            # Cerchiamo l'emoji nel dizionario, se non esiste usiamo 👤
-            emoji_p = EMOJI_PROPRIETARI.get(prop, "👤")
+            # Di base solo miniature: le foto originali si scaricano su richiesta
+            hd = st.toggle("🔎 Foto in alta risoluzione", key=f"hd_{id_db}")
+            f_main = foto(r.get('foto_main'), hd)
+            f_cima = foto(r.get('cima_foto'), hd)
+            f_cent = foto(r.get('centro_foto'), hd)
+            f_fond = foto(r.get('fondo_foto'), hd)
             
-            f_main = r.get('foto_main') if r.get('foto_main') else NO_PHOTO
-            f_cima = r.get('cima_foto') if r.get('cima_foto') else NO_PHOTO
-            f_cent = r.get('centro_foto') if r.get('centro_foto') else NO_PHOTO
-            f_fond = r.get('fondo_foto') if r.get('fondo_foto') else NO_PHOTO
-
-            # Titolo dell'expander con l'emoji corretta
-            with st.expander(f"📦 {nome} | 📍 {zona} - {ubi} | {emoji_p} {prop}"):
-                st.markdown(f"<p style='color: #ADB5BD; font-size: 0.8rem;'>📅 Registrata il: {data_reg}</p>", unsafe_allow_html=True)
-                
-                col1, col2 = st.columns([1, 2])
-                with col1:
-                    st.image(f_main, use_container_width=True, caption="Vista Esterna")
-                
-                with col2:
-                    st.write(f"**📝 Descrizione:** {desc}")
-                    # Mostriamo il proprietario con l'emoji anche nei dettagli
-                    st.write(f"**{emoji_p} Proprietario:** {prop}")
-                    st.markdown("---")
-                    st.subheader("🔍 Contenuto Interno")
-                    
-                    i1, i2, i3 = st.columns(3)
-                    with i1:
-                        st.image(f_cima, use_container_width=True)
-                        st.caption(f"🔼 {r.get('cima_testo', 'Cima')}")
-                    with i2:
-                        st.image(f_cent, use_container_width=True)
-                        st.caption(f"↔️ {r.get('centro_testo', 'Centro')}")
-                    with i3:
-                        st.image(f_fond, use_container_width=True)
-                        st.caption(f"🔽 {r.get('fondo_testo', 'Fondo')}")
+            col1, col2 = st.columns([1, 2])
+            with col1:
+                st.image(f_main, use_container_width=True, caption="Vista Esterna")
+            
+            with col2:
+                st.write(f"**📝 Descrizione:** {desc}")
+                # Mostriamo il proprietario con l'emoji anche nei dettagli
+                st.write(f"**{emoji_p} Proprietario:** {prop}")
+                st.markdown("---")
+                st.subheader("🔍 Contenuto Interno")
                 
-                st.write("")
-                if st.button(f"🗑️ ELIMINA: {nome}", key=f"del_{id_db}", use_container_width=True):
-                    if db.elimina_scatola(id_db):
-                        st.warning(f"Scatola '{nome}' rimossa.")
-                        time.sleep(1)
-                        st.rerun()
-    else:
-        st.info("Nessuna scatola trovata.")
+                i1, i2, i3 = st.columns(3)
+                with i1:
+                    st.image(f_cima, use_container_width=True)
+                    st.caption(f"🔼 {r.get('cima_testo', 'Cima')}")
+                with i2:
+                    st.image(f_cent, use_container_width=True)
+                    st.caption(f"↔️ {r.get('centro_testo', 'Centro')}")
+                with i3:
+                    st.image(f_fond, use_container_width=True)
+                    st.caption(f"🔽 {r.get('fondo_testo', 'Fondo')}")
+            
+            if st.toggle("🧩 Scatole simili", key=f"simili_{id_db}"):
+                simili = db.scatole_simili_a(r, limite=4)
+                if not simili:
+                    st.caption("Nessuna scatola con foto simili.")
+                for s_simile, distanza, url_simile in simili:
+                    col_img, col_txt = st.columns([1, 3])
+                    col_img.image(foto(url_simile), use_container_width=True)
+                    col_txt.write(f"📦 **{s_simile.get('nome')}** · 📍 {s_simile.get('zon')} - {s_simile.get('ubi')} · "
+                                  f"somiglianza {100 - distanza * 100 // 64}%")
+            
+            if st.toggle("✏️ Modifica rapida", key=f"mod_{id_db}"):
+                with st.form(f"form_mod_{id_db}"):
+                    st.text_input("Nome", value=nome, key=f"mod_nome_{id_db}")
+                    st.text_area("Descrizione", value=desc or "", key=f"mod_desc_{id_db}")
+                    st.selectbox("Proprietario", utenti, index=utenti.index(prop) if prop in utenti else 0,
+                                 key=f"mod_prop_{id_db}")
+                    st.form_submit_button("💾 Salva", on_click=salva_modifica, args=(r, stato))
+            
+            st.write("")
+            st.button(f"🗑️ ELIMINA: {nome}", key=f"del_{id_db}", use_container_width=True,
+                      on_click=elimina_dalla_lista, args=(id_db, stato))
+    
+    @st.fragment
+    @strumentazione.frammento(f"{scelta} · risultati_ricerca", id_sessione)
+    def risultati_ricerca():
+        # Digitare e caricare altre pagine riesegue solo questo frammento, non tutta la pagina
+        chiave = st.text_input("🔍 Cosa stai cercando?", placeholder="Viti, Garage, Victor...", help="Scrivi qui per filtrare i risultati")
+        chiave = chiave.strip()
+        if 0 < len(chiave) < MIN_CARATTERI_RICERCA:
+            st.caption(f"Scrivi almeno {MIN_CARATTERI_RICERCA} caratteri per cercare.")
+            return
+        
+        # Risultati caricati a pagine: si riparte da capo solo se cambia la ricerca o i dati
+        stato = st.session_state.get("cerca_pagine")
+        if not stato or stato["chiave"] != chiave or stato["versione"] != db.versione_dati():
+            with st.spinner("Ricerca in corso..."):
+                versione = db.versione_dati()
+                if chiave:
+                    # Ricerca sull'indice locale: già ordinata per rilevanza, si pagina in memoria
+                    trovate = db.cerca_scatola(chiave)
+                    righe, resto, cursore = trovate[:db_manager.DIMENSIONE_PAGINA], trovate[db_manager.DIMENSIONE_PAGINA:], None
+                else:
+                    righe, cursore = db.pagina_inventario("*")
+                    resto = []
+            stato = {"chiave": chiave, "versione": versione, "righe": righe, "resto": resto, "cursore": cursore,
+                     "eliminate": set()}
+            st.session_state["cerca_pagine"] = stato
+        ris = stato["righe"]
+        
+        if ris:
+            ci_sono_altre = stato["cursore"] is not None or bool(stato["resto"])
+            altre = " (scorri in fondo per caricarne altre)" if ci_sono_altre else ""
+            st.write(f"✅ Mostrate {len(ris)} scatole{altre}")
+            for r in ris:
+                scheda_scatola(r, stato)
+            
+            if ci_sono_altre:
+                st.button("⬇️ Carica altre scatole", use_container_width=True, on_click=carica_altre, args=(stato,))
+        else:
+            st.info("Nessuna scatola trovata.")
+    
+    risultati_ricerca()
 
 
 # --- ➕ NUOVA SCATOLA ---
@@ -391,17 +525,28 @@ elif scelta == "➕ Nuova Scatola":
         
         submit = st.form_submit_button("🚀 SALVA SCATOLA NEL CLOUD")
         
-        if submit:
+        # Stessa foto esterna di una scatola già registrata? Si avvisa e si salva solo al secondo invio
+        doppioni = []
+        if submit and nome and f_main:
+            id_file = getattr(f_main, "file_id", f_main.name)
+            if st.session_state.get("doppione_confermato") != id_file:
+                doppioni = db.possibili_doppioni(f_main)
+                if doppioni:
+                    st.session_state["doppione_confermato"] = id_file
+                    st.warning("⚠️ Questa foto somiglia molto a scatole già registrate. "
+                               "Premi di nuovo SALVA per registrarla comunque.")
+                    for s_simile, distanza, url_simile in doppioni:
+                        col_img, col_txt = st.columns([1, 3])
+                        col_img.image(foto(url_simile), use_container_width=True)
+                        col_txt.write(f"📦 **{s_simile.get('nome')}** · 📍 {s_simile.get('ubi')} · "
+                                      f"somiglianza {100 - distanza * 100 // 64}%")
+        
+        if submit and not doppioni:
             if nome:
                 with st.spinner("Caricamento immagini in corso..."):
-                    # Esecuzione Upload
-                    u_main = upload_foto(f_main, nome, "main")
-                    u_cima = upload_foto(f_cima, nome, "cima")
-                    u_cent = upload_foto(f_cent, nome, "centro")
-                    u_fond = upload_foto(f_fond, nome, "fondo")
-                    
-                    # Log di controllo (visibile solo se qualcosa fallisce)
-                    if not u_cima and f_cima: st.error("Errore upload foto Cima")
+                    # Esecuzione Upload (le 4 foto partono insieme; gli errori sono segnalati per file)
+                    urls = upload_foto_multiple({"main": f_main, "cima": f_cima, "centro": f_cent, "fondo": f_fond}, nome)
+                    u_main, u_cima, u_cent, u_fond = urls["main"], urls["cima"], urls["centro"], urls["fondo"]
                     
                     if db.aggiungi_scatola(
                         nome=nome, desc=desc, f_m=u_main, 
@@ -410,9 +555,7 @@ elif scelta == "➕ Nuova Scatola":
                         bt=t_fond, bf=u_fond, 
                         prop=prop
                     ):
-                        st.balloons()
-                        st.success(f"✅ Scatola {nome} registrata con tutte le foto!")
-                        time.sleep(2)
+                        notifica(f"✅ Scatola {nome} registrata con tutte le foto!", festa=True)
                         st.rerun()
                     else:
                         st.error("❌ Errore nel salvataggio dei dati nel database.")
@@ -424,7 +567,8 @@ elif scelta == "➕ Nuova Scatola":
 elif scelta == "📝 Modifica Scatola":
     st.title("Modifica e Aggiornamento Scatola")
     
-    inv_data = db.visualizza_inventario()
+    # Per il menu bastano id e nome; la scheda completa si legge solo per la scatola scelta
+    inv_data = db.elenco_scatole()
     
     if inv_data:
         # Selezione scatola per ID e Nome
@@ -432,7 +576,7 @@ elif scelta == "📝 Modifica Scatola":
         scelta_box = st.selectbox("Scegli la scatola da aggiornare", nomi_scatole)
         
         id_sel = int(scelta_box.split(" - ")[0])
-        s = next(item for item in inv_data if item.get('id') == id_sel)
+        s = db.leggi_scatola(id_sel) or next(item for item in inv_data if item.get('id') == id_sel)
         
         with st.form("form_modifica"):
             st.warning(f"🛠️ Stai modificando la scatola ID: {id_sel}")
@@ -465,11 +609,12 @@ elif scelta == "📝 Modifica Scatola":
 
             if st.form_submit_button("✅ SALVA TUTTE LE MODIFICHE"):
                 with st.spinner("Aggiornamento immagini su Cloudinary..."):
-                    # Caricamento intelligente: nuova foto o mantiene URL esistente
-                    url_m = upload_foto(f_main_new, nuovo_nome, "main") if f_main_new else s.get('foto_main')
-                    url_ci = upload_foto(f_cima_new, nuovo_nome, "cima") if f_cima_new else s.get('cima_foto')
-                    url_ce = upload_foto(f_cent_new, nuovo_nome, "centro") if f_cent_new else s.get('centro_foto')
-                    url_fo = upload_foto(f_fond_new, nuovo_nome, "fondo") if f_fond_new else s.get('fondo_foto')
+                    # Caricamento intelligente: nuove foto in parallelo, altrimenti si tiene l'URL esistente
+                    urls = upload_foto_multiple({"main": f_main_new, "cima": f_cima_new, "centro": f_cent_new, "fondo": f_fond_new}, nuovo_nome)
+                    url_m = urls["main"] if f_main_new else s.get('foto_main')
+                    url_ci = urls["cima"] if f_cima_new else s.get('cima_foto')
+                    url_ce = urls["centro"] if f_cent_new else s.get('centro_foto')
+                    url_fo = urls["fondo"] if f_fond_new else s.get('fondo_foto')
                     
                     # CHIAMATA AL DB: Parametri allineati al nuovo db_manager.py
                     if db.aggiorna_dati_scatola(
@@ -485,8 +630,7 @@ elif scelta == "📝 Modifica Scatola":
                         f_cent=url_ce,
                         f_fond=url_fo
                     ):
-                        st.success("✨ Modifiche salvate correttamente!")
-                        time.sleep(1.5)
+                        notifica("✨ Modifiche salvate correttamente!")
                         st.rerun()
                     else:
                         st.error("Errore durante il salvataggio. Controlla il log nel db_manager.")
@@ -509,12 +653,10 @@ elif scelta == "📸 Scanner QR":
         # Pulizia del codice ricevuto
         codice_pulito = str(codice_scansionato).strip().upper()
         
-        # Cerchiamo nel database
-        inv_data = db.visualizza_inventario()
-        risultato = [s for s in inv_data if str(s.get('nome', '')).strip().upper() == codice_pulito]
+        # Cerchiamo nel database (accesso diretto per codice, senza scorrere l'inventario)
+        r = db.trova_per_codice(codice_pulito)
         
-        if risultato:
-            r = risultato[0]
+        if r:
             
             # --- LOGICA EMOJI PERSONALIZZATA ---
             prop_nome = r.get('proprietario', 'N/D')
@@ -525,7 +667,8 @@ elif scelta == "📸 Scanner QR":
             
             col_imm, col_info = st.columns([1, 1.5])
             with col_imm:
-                st.image(r.get('foto_main') or NO_PHOTO, use_container_width=True)
+                hd = st.toggle("🔎 Foto in alta risoluzione", key="hd_scanner")
+                st.image(foto(r.get('foto_main'), hd), use_container_width=True)
             
             with col_info:
                 st.subheader(f"📦 {r.get('nome')}")
@@ -551,10 +694,95 @@ elif scelta == "🔄 Alloca/Sposta":
     from streamlit_qrcode_scanner import qrcode_scanner
     
     # Recupero dati
-    inv = db.visualizza_inventario()
-    pos = db.visualizza_posizioni()
+    inv, pos = db.carica_bundle("inventario", "posizioni")
+    modalita = st.radio("Modalità", ["📦 Una scatola", "🗂️ Più scatole insieme", "⚡ Stoccaggio continuo"], horizontal=True)
+    
+    if inv and pos and modalita == "🗂️ Più scatole insieme":
+        st.info("💡 Scegli le scatole, indica per ognuna la nuova ubicazione e conferma: un solo salvataggio per tutte.")
+        codici_ubi = [db_manager.NON_ALLOCATA] + sorted(str(p.get('id_ubicazione') or p.get('id')) for p in pos)
+        
+        zone_attuali = sorted({str(s.get('zon') or db_manager.ZONA_DA_DEFINIRE) for s in inv})
+        zona_filtro = st.selectbox("Filtra per zona attuale", ["Tutte"] + zone_attuali)
+        candidate = [s for s in inv if zona_filtro == "Tutte" or str(s.get('zon') or db_manager.ZONA_DA_DEFINIRE) == zona_filtro]
+        etichette_s = {f"{s.get('id')} | {s.get('nome')}": s for s in candidate}
+        scelte = st.multiselect("📦 Scatole da spostare", list(etichette_s.keys()))
+        
+        if scelte:
+            destinazione_comune = st.selectbox("📍 Stessa destinazione per tutte (facoltativo)", ["—"] + codici_ubi)
+            tabella = pd.DataFrame([{
+                "id": etichette_s[k].get('id'),
+                "Scatola": etichette_s[k].get('nome'),
+                "Ubicazione attuale": etichette_s[k].get('ubi'),
+                "Nuova ubicazione": destinazione_comune if destinazione_comune != "—" else etichette_s[k].get('ubi'),
+            } for k in scelte])
+            modificata = st.data_editor(
+                tabella, hide_index=True, use_container_width=True,
+                disabled=["id", "Scatola", "Ubicazione attuale"],
+                column_config={"Nuova ubicazione": st.column_config.SelectboxColumn(options=codici_ubi, required=True)},
+                key=f"editor_sposta_{destinazione_comune}")
+            
+            if st.button("🚀 CONFERMA SPOSTAMENTI", use_container_width=True):
+                # La zona la decide l'ubicazione di destinazione
+                spostamenti = [(r["id"], None, r["Nuova ubicazione"]) for r in modificata.to_dict("records")
+                               if r["Nuova ubicazione"] != r["Ubicazione attuale"]]
+                with st.spinner("Aggiornamento posizioni..."):
+                    spostate, errori = db.sposta_scatole(spostamenti)
+                for errore in errori:
+                    notifica(f"⚠️ {errore}", "warning")
+                if spostate:
+                    notifica(f"✅ Spostate {spostate} scatole!", festa=True)
+                if errori or spostate:
+                    st.rerun()
+                elif not errori:
+                    st.info("Nessuna ubicazione cambiata.")
+    
+    elif inv and pos and modalita == "⚡ Stoccaggio continuo":
+        # Una sessione per utente: la coda di salvataggio sopravvive ai rerun; il thread
+        # usa l'InventarioDB di processo, non quello (e la cache) di questo rerun
+        if "stoccaggio" not in st.session_state:
+            st.session_state["stoccaggio"] = stoccaggio.SessioneStoccaggio(db_manager.db_condiviso().sposta_scatole)
+        sessione = st.session_state["stoccaggio"]
+        st.info("💡 Inquadra una scatola, poi la sua ubicazione, poi la scatola successiva: "
+                "ogni coppia viene salvata da sola in background.")
+        
+        codice = qrcode_scanner(key="scan_stoccaggio")
+        if codice and sessione.codice_nuovo(codice):
+            scatola = db.trova_per_codice(codice)
+            posizione = db.trova_posizione(codice) if not scatola else None
+            if scatola:
+                # Anche a metà coppia: una nuova scatola sostituisce quella in attesa
+                sessione.scegli_scatola(scatola)
+                st.toast(f"📦 {scatola.get('nome')}: ora l'ubicazione", icon="📦")
+            elif posizione and sessione.scatola:
+                voce = sessione.conferma(posizione.get('id_ubicazione'))
+                st.toast(f"✅ {voce['nome']} → {voce['ubi']}", icon="✅")
+            elif posizione:
+                st.toast(f"Ubicazione {posizione.get('id_ubicazione')}: scansiona prima una scatola", icon="⚠️")
+            else:
+                st.toast(f"Codice '{codice}' sconosciuto", icon="❌")
+        
+        if sessione.scatola:
+            st.success(f"📦 **{sessione.scatola.get('nome')}** → scansiona l'**UBICAZIONE**")
+        else:
+            st.warning("📦 Scansiona la prossima **SCATOLA**")
+        
+        @st.fragment(run_every=2)
+        @strumentazione.frammento(f"{scelta} · registro_stoccaggio", id_sessione)
+        def registro_stoccaggio():
+            # Si aggiorna da solo: gli esiti dei salvataggi arrivano dal thread in background
+            voci = sessione.voci()
+            salvate = sum(v["stato"] == "salvato" for v in voci)
+            errori = sum(v["stato"] == "errore" for v in voci)
+            st.caption(f"Sessione: {salvate} salvate · {sessione.in_coda()} in coda · {errori} errori")
+            if errori and st.button("🔁 Riprova gli spostamenti falliti"):
+                sessione.riprova_errori()
+            icone = {"in coda": "⏳", "salvato": "✅", "errore": "❌"}
+            for v in voci[:30]:
+                riga = f"{icone[v['stato']]} {v['ora']} · **{v['nome']}** → {v['ubi']}"
+                st.markdown(riga + (f" — {v['errore']}" if v["errore"] else ""))
+        registro_stoccaggio()
     
-    if inv and pos:
+    elif inv and pos:
         st.info("💡 Puoi selezionare Scatola e Destinazione manualmente o usando il QR Code.")
 
         # --- 📦 FASE 1: SELEZIONE SCATOLA ---
@@ -569,10 +797,10 @@ elif scelta == "🔄 Alloca/Sposta":
         if usa_scan_box:
             res_box = qrcode_scanner(key="scan_box_move")
             if res_box:
-                # Cerchiamo l'ID corrispondente al nome scansionato
-                match = [k for k in s_options.keys() if res_box.strip().upper() in k.upper()]
-                if match:
-                    s_sel_key = match[0]
+                # Cerchiamo la scatola corrispondente al nome scansionato
+                trovata = db.trova_per_codice(res_box)
+                if trovata:
+                    s_sel_key = f"{trovata.get('id')} | {trovata.get('nome')}"
                     st.success(f"Scatola rilevata: {s_sel_key}")
                 else:
                     st.error(f"Codice '{res_box}' non trovato in inventario.")
@@ -584,7 +812,7 @@ elif scelta == "🔄 Alloca/Sposta":
         st.divider()
         st.subheader("2. Seleziona Nuova Destinazione")
         
-        # Preparazione lista posizioni per il menu
+        # Preparazione lista posizioni per il menu: l'etichetta serve solo a mostrarla, il dato è la riga
         p_options = {f"{p.get('zona', 'N/D')} | {p.get('id_ubicazione') or p.get('id')}": p for p in pos}
         
         col_p1, col_p2 = st.columns([1, 2])
@@ -596,35 +824,29 @@ elif scelta == "🔄 Alloca/Sposta":
             res_loc = qrcode_scanner(key="scan_loc_move")
             if res_loc:
                 # Cerchiamo la posizione che corrisponde al QR (es. "SCAFFALE 1")
-                match_p = [k for k in p_options.keys() if res_loc.strip().upper() in k.upper()]
-                if match_p:
-                    p_sel = match_p[0]
-                    st.success(f"Ubicazione rilevata: {p_sel}")
+                pos_trovata = db.trova_posizione(res_loc)
+                if pos_trovata:
+                    p_sel = pos_trovata
+                    st.success(f"Ubicazione rilevata: {pos_trovata.get('zona', 'N/D')} | {pos_trovata.get('id_ubicazione')}")
                 else:
                     st.warning(f"QR '{res_loc}' non trovato nelle zone configurate. Verrà usato come testo libero.")
                     # Se il QR non esiste tra le zone, lo creiamo al volo come nuova destinazione
-                    p_sel = f"SCAN | {res_loc.strip().upper()}"
+                    p_sel = {"zona": "SCAN", "id_ubicazione": res_loc.strip().upper()}
 
         if not p_sel:
-            p_sel = st.selectbox("📍 Scegli destinazione dalla lista", options=list(p_options.keys()))
+            p_sel = p_options[st.selectbox("📍 Scegli destinazione dalla lista", options=list(p_options.keys()))]
 
         # --- 🚀 FASE 3: CONFERMA ---
         st.divider()
         if st.button("🚀 CONFERMA SPOSTAMENTO", use_container_width=True):
             try:
-                id_scatola = int(s_sel_key.split(" | ")[0])
-                
-                # Logica per estrarre zona e ubi dal QR o dalla lista
-                if " | " in p_sel:
-                    nuova_zona, nuova_ubi = p_sel.split(" | ")
-                else:
-                    nuova_zona, nuova_ubi = "VARIE", p_sel
+                id_scatola = s_options[s_sel_key].get('id')
+                nuova_zona = p_sel.get('zona') or "VARIE"
+                nuova_ubi = p_sel.get('id_ubicazione') or p_sel.get('id')
                 
                 with st.spinner("Aggiornamento posizione..."):
                     if db.aggiorna_posizione_scatola(id_scatola, nuova_zona, nuova_ubi):
-                        st.success(f"✅ Spostato con successo in {nuova_zona} - {nuova_ubi}!")
-                        st.balloons()
-                        time.sleep(2)
+                        notifica(f"✅ Spostato con successo in {nuova_zona} - {nuova_ubi}!", festa=True)
                         st.rerun()
             except Exception as e:
                 st.error(f"Errore: {e}")
@@ -657,45 +879,59 @@ elif scelta == "⚙️ Configura Magazzino":
     with t1:
         st.subheader("Registra un nuovo spazio")
         with st.form("p_new", clear_on_submit=True):
-            col_id, col_zon = st.columns(2)
-            s_id = col_id.text_input("🆔 ID Ubicazione", placeholder="es: A1-01")
+            col_id, col_zon, col_cap = st.columns([2, 2, 1])
+            s_id = col_id.text_input("🆔 ID Ubicazione", placeholder="es: GAR.1.1 (zona.corsia.ripiano)")
             z_id = col_zon.text_input("📍 Nome Zona", placeholder="es: Garage")
+            capienza = col_cap.number_input("📦 Capienza", min_value=1, value=1, help="Quante scatole ci stanno")
             
             if st.form_submit_button("➕ SALVA POSIZIONE", use_container_width=True):
                 if s_id and z_id:
                     id_pulito = str(s_id).strip().upper()
                     zona_pulita = str(z_id).strip()
                     
-                    if db.aggiungi_posizione(id_pulito, zona_pulita):
-                        st.success(f"✅ Ubicazione {id_pulito} creata con successo!")
-                        time.sleep(1)
+                    if db.aggiungi_posizione(id_pulito, zona_pulita, capienza):
+                        notifica(f"✅ Ubicazione {id_pulito} creata con successo!")
                         st.rerun()
                 else:
                     st.error("⚠️ Inserisci sia l'ID che la Zona.")
     
     with t2:
-        st.subheader("Caricamento da file Excel")
-        st.markdown("""
-        💡 **Istruzioni:** Il file deve avere le colonne denominate esattamente **id** e **zona**.
-        """)
-        file_ex = st.file_uploader("Trascina qui il file .xlsx", type=['xlsx'])
+        st.subheader("Caricamento da file Excel o CSV")
+        tipo_import = st.radio("Cosa vuoi importare?", ["📍 Ubicazioni", "📦 Scatole"], horizontal=True)
+        if tipo_import == "📍 Ubicazioni":
+            st.markdown("""
+            💡 **Istruzioni:** Il file deve avere le colonne denominate esattamente **id** e **zona**.
+            """)
+        else:
+            st.markdown("""
+            💡 **Istruzioni:** Colonna obbligatoria **nome**; facoltative **descrizione**, **proprietario**,
+            **cima**, **centro**, **fondo**, **zona**, **ubicazione**. Le scatole con un nome già presente vengono aggiornate.
+            """)
+        file_ex = st.file_uploader("Trascina qui il file .xlsx o .csv", type=['xlsx', 'csv'])
         
         if file_ex:
             try:
-                df_pos = pd.read_excel(file_ex)
-                df_pos.columns = [c.lower().strip() for c in df_pos.columns]
-                
+                # Solo le prime righe: il file intero viene letto a blocchi durante l'import
                 st.write("🔍 Anteprima dati:")
-                st.dataframe(df_pos.head(10), use_container_width=True)
+                st.dataframe(importazione.anteprima(file_ex, 10), use_container_width=True)
                 
                 if st.button("🚀 AVVIA IMPORTAZIONE", use_container_width=True):
-                    with st.spinner("Sincronizzazione database..."):
-                        ok, count = db.import_posizioni_da_df(df_pos)
-                        if ok:
-                            st.balloons()
-                            st.success(f"📥 Ottimo! Caricate {count} nuove posizioni.")
-                            time.sleep(2)
-                            st.rerun()
+                    barra = st.progress(0.0, text="Importazione in corso...")
+                    totale = importazione.conta_righe(file_ex)
+                    def avanzamento(righe, blocchi):
+                        quota = min(0.99, righe / totale) if totale else 0.5
+                        barra.progress(quota, text=f"{righe} righe scritte ({blocchi} blocchi)")
+                    if tipo_import == "📍 Ubicazioni":
+                        esito = db.importa_posizioni(file_ex, progresso=avanzamento)
+                    else:
+                        esito = db.importa_scatole(file_ex, progresso=avanzamento)
+                    barra.progress(1.0, text="Importazione completata")
+                    if esito:
+                        for errore in esito.errori:
+                            notifica(f"⚠️ {errore}", "warning")
+                        if esito.righe:
+                            notifica(f"📥 Ottimo! Caricate {esito.righe} righe in {esito.blocchi_ok} blocchi.", festa=True)
+                        st.rerun()
             except Exception as e:
                 st.error(f"Errore tecnico: {e}")
 
@@ -703,7 +939,22 @@ elif scelta == "⚙️ Configura Magazzino":
         st.subheader("🛡️ Sicurezza e Manutenzione")
         pos_attuali = db.visualizza_posizioni()
         st.info(f"Il magazzino Hernandez ha attualmente **{len(pos_attuali)}** ubicazioni attive.")
-        
+
+        # Efficacia della cache letture (quante query al cloud abbiamo risparmiato)
+        stat_cache = db.statistiche_cache()
+        st.caption(f"⚡ Cache letture: {stat_cache['hit']} hit / {stat_cache['miss']} miss "
+                   f"({stat_cache['hit_ratio']:.0%} servite dalla memoria)")
+
+        # Le foto caricate prima della ricerca per immagine non hanno ancora un'impronta
+        if st.button("🖼️ Calcola impronte delle foto già caricate", use_container_width=True,
+                     help="Serve una volta sola: dopo, ogni nuova foto riceve l'impronta al caricamento"):
+            barra = st.progress(0.0, text="Calcolo impronte...")
+            def avanzamento_impronte(fatte, totale):
+                barra.progress(fatte / totale, text=f"{fatte} di {totale} foto")
+            calcolate, fallite = db.calcola_impronte_mancanti(progresso=avanzamento_impronte)
+            barra.progress(1.0, text="Calcolo completato")
+            st.success(f"🖼️ Impronte calcolate: {calcolate}" + (f" (foto non leggibili: {fallite})" if fallite else ""))
+
         st.write("---")
         # Inserimento password per sbloccare i tasti di reset
         pwd = st.text_input("🔑 Inserisci Password Master per le azioni pericolose", type="password")
@@ -717,17 +968,34 @@ elif scelta == "⚙️ Configura Magazzino":
                 if st.button("🔥 RESET TOTALE INVENTARIO", use_container_width=True):
                     with st.spinner("Cancellazione scatole..."):
                         if db.reset_totale_inventario():
-                            st.success("Inventario completamente svuotato.")
-                            time.sleep(1.5)
+                            notifica("Inventario completamente svuotato.")
                             st.rerun()
             
             with col_r2:
                 if st.button("🗑️ RESET TOTALE POSIZIONI", use_container_width=True):
                     with st.spinner("Cancellazione mappa..."):
                         if db.reset_totale_posizioni():
-                            st.success("Mappa delle posizioni azzerata.")
-                            time.sleep(1.5)
+                            notifica("Mappa delle posizioni azzerata.")
                             st.rerun()
+
+            # --- PANNELLO PRESTAZIONI ---
+            st.write("---")
+            st.subheader("📈 Prestazioni")
+            if not strumentazione.ATTIVA:
+                st.info("Misure disattivate: imposta STRUMENTAZIONE = true nei secrets (o VHD_STRUMENTAZIONE=1) e riavvia l'app.")
+            else:
+                st.caption("Ultimi rerun di questa sessione: tempo diviso tra database, upload foto e resto (rendering Streamlit).")
+                st.dataframe(strumentazione.ultimi_rerun(st.session_state["_id_sessione"]), use_container_width=True, hide_index=True)
+                raggruppa = st.radio("Raggruppa per", ["Pagina e operazione", "Operazione"], horizontal=True)
+                per = ("pagina", "tipo", "operazione") if raggruppa == "Pagina e operazione" else ("tipo", "operazione")
+                st.dataframe(strumentazione.riepilogo(per), use_container_width=True, hide_index=True)
+                st.caption("risparmiati: byte tolti dalla ricompressione delle foto prima dell'upload (prepara_foto).")
+                col_m1, col_m2 = st.columns(2)
+                col_m1.download_button("💾 Scarica misure (JSONL)", strumentazione.esporta_jsonl(),
+                                       "misure_prestazioni.jsonl", "application/x-ndjson", use_container_width=True)
+                if col_m2.button("🧹 Azzera misure", use_container_width=True):
+                    strumentazione.svuota()
+                    st.rerun()
         elif pwd:
             st.error("❌ Password Errata")
 
@@ -737,8 +1005,7 @@ elif scelta == "⚙️ Configura Magazzino":
 elif scelta == "🖨️ Stampa":
     st.title("Centro Stampa Etichette Hernandez")
     
-    inv_totale = db.visualizza_inventario()
-    pos_totale = db.visualizza_posizioni()
+    inv_totale, pos_totale = db.carica_bundle("elenco_scatole", "posizioni")
     
     st.info("💡 Cerca le scatole o le zone, selezionale con la spunta e genera il PDF pronto per la stampa.")
     filtro_st = st.text_input("🔍 Cerca per Nome, Proprietario o Zona", placeholder="Es: Victor, Garage...")
@@ -759,33 +1026,9 @@ elif scelta == "🖨️ Stampa":
                         sel_s.append(s)
                 
                 if sel_s and st.button("📥 GENERA PDF SCATOLE", use_container_width=True):
-                    pdf = FPDF()
-                    # Elaborazione a coppie di 2 per pagina
-                    for i in range(0, len(sel_s), 2):
-                        pdf.add_page()
-                        batch_s = sel_s[i:i+2]
-                        for idx, s in enumerate(batch_s):
-                            # Coordinate ricalibrate: idx 0 (sopra), idx 1 (sotto)
-                            y_start = 10 if idx == 0 else 145
-                            nome_e = str(s.get('nome', 'N/A'))
-                            prop_e = str(s.get('proprietario', 'N/A')).upper()
-                            data_e = str(s.get('data_inserimento') or datetime.now().strftime("%d/%m/%Y"))
-                            
-                            # Disegno Etichetta
-                            pdf.rect(10, y_start, 190, 125)
-                            pdf.set_font("Arial", 'B', 40); pdf.set_xy(15, y_start + 15); pdf.cell(110, 20, prop_e)
-                            pdf.set_font("Arial", 'B', 25); pdf.set_xy(15, y_start + 45); pdf.multi_cell(110, 12, nome_e)
-                            pdf.set_font("Arial", '', 10); pdf.set_xy(15, y_start + 115); pdf.cell(100, 10, f"Data: {data_e}")
-                            
-                            # Generazione QR Code temporaneo
-                            qr = QRCode(box_size=5); qr.add_data(nome_e); qr.make()
-                            img = qr.make_image(); t_img = f"qr_s_{i}_{idx}.png"; img.save(t_img)
-                            pdf.image(t_img, x=125, y=y_start + 25, w=60)
-                            
-                            # Pulizia file temporaneo
-                            if os.path.exists(t_img): os.remove(t_img)
-                    
-                    pdf_output = pdf.output(dest='S').encode('latin-1')
+                    # Righe complete (data compresa) solo per le scatole selezionate
+                    sel_s = db.leggi_scatole([s.get('id') for s in sel_s]) or sel_s
+                    pdf_output = etichette.pdf_etichette_scatole(sel_s)
                     st.download_button("💾 Scarica PDF Scatole", pdf_output, "etichette_scatole.pdf")
 
         # --- TAB UBICAZIONI (16 PER FOGLIO A4 - 4x4) ---
@@ -801,30 +1044,8 @@ elif scelta == "🖨️ Stampa":
                         sel_p.append(p)
                 
                 if sel_p and st.button("📥 GENERA PDF UBICAZIONI", use_container_width=True):
-                    pdf_u = FPDF()
-                    cols, rows = 4, 4
-                    w_area, h_area = 48, 68 # Spazio per cella
-                    
-                    for i in range(0, len(sel_p), 16):
-                        pdf_u.add_page()
-                        batch_p = sel_p[i:i+16]
-                        for idx, p in enumerate(batch_p):
-                            c = idx % cols
-                            r = (idx // cols) % rows
-                            x_off = 10 + (c * w_area)
-                            y_off = 10 + (r * h_area)
-                            
-                            codice_u = str(p.get('id_ubicazione') or p.get('id'))
-                            pdf_u.rect(x_off, y_off, 42, 60) 
-                            
-                            qr_u = QRCode(box_size=2); qr_u.add_data(codice_u); qr_u.make()
-                            img_u = qr_u.make_image(); t_u = f"qr_u_{i}_{idx}.png"; img_u.save(t_u)
-                            pdf_u.image(t_u, x_off + 6, y_off + 5, w=30)
-                            
-                            pdf_u.set_font("Arial", 'B', 12); pdf_u.set_xy(x_off, y_off + 38); pdf_u.cell(42, 10, codice_u, align='C')
-                            pdf_u.set_font("Arial", '', 7); pdf_u.set_xy(x_off, y_off + 48); pdf_u.cell(42, 5, str(p.get('zona')).upper(), align='C')
-                            
-                            if os.path.exists(t_u): os.remove(t_u)
-                            
-                    pdf_u_out = pdf_u.output(dest='S').encode('latin-1')
-                    st.download_button("💾 Scarica PDF Ubicazioni", pdf_u_out, "etichette_ubicazioni.pdf")
\ No newline at end of file
+                    pdf_u_out = etichette.pdf_etichette_ubicazioni(sel_p)
+                    st.download_button("💾 Scarica PDF Ubicazioni", pdf_u_out, "etichette_ubicazioni.pdf")
+
+# Fine dello script: il tempo non speso in database e upload è rendering
+strumentazione.fine_rerun()
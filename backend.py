@@ -0,0 +1,321 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# --- SCHEMA (stesse colonne delle tabelle Supabase) ---
+COLONNE = {
+    "inventario": ("id", "nome", "descrizione", "foto_main", "cima_testo", "cima_foto",
+                   "centro_testo", "centro_foto", "fondo_testo", "fondo_foto",
+                   "proprietario", "zon", "ubi", "data_inserimento"),
+    "posizioni": ("id_ubicazione", "zona", "capienza"),  # capienza: scatole per ripiano (facoltativa)
+    "foto_hash": ("url", "hash"),  # impronte percettive delle foto (indice_foto)
+}
+CHIAVI = {"inventario": "id", "posizioni": "id_ubicazione", "foto_hash": "url"}
+# Valori che non esistono mai: "cancella tutto" su Supabase richiede comunque un filtro
+VALORE_ASSENTE = {"inventario": -1, "posizioni": "NONE_XYZ", "foto_hash": "NONE_XYZ"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS inventario (
+    id INTEGER PRIMARY KEY,
+    nome TEXT, descrizione TEXT, foto_main TEXT,
+    cima_testo TEXT, cima_foto TEXT,
+    centro_testo TEXT, centro_foto TEXT,
+    fondo_testo TEXT, fondo_foto TEXT,
+    proprietario TEXT, zon TEXT, ubi TEXT,
+    data_inserimento TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%S+00:00', 'now'))
+);
+CREATE INDEX IF NOT EXISTS idx_inventario_nome ON inventario (nome);
+CREATE INDEX IF NOT EXISTS idx_inventario_ubi ON inventario (ubi);
+CREATE INDEX IF NOT EXISTS idx_inventario_zon ON inventario (zon);
+CREATE TABLE IF NOT EXISTS posizioni (
+    id_ubicazione TEXT PRIMARY KEY,
+    zona TEXT,
+    capienza INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_posizioni_zona ON posizioni (zona);
+CREATE TABLE IF NOT EXISTS foto_hash (
+    url TEXT PRIMARY KEY,
+    hash INTEGER NOT NULL
+);
+"""
+
+
+def _adesso():
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+_OPERATORI = {"eq": "= ?", "neq": "!= ?", "gt": "> ?", "ilike": "LIKE ? ESCAPE '\\'"}
+
+
+def applica_filtri(query, filtri):
+    """Traduce i filtri [(colonna, operatore, valore)] nel query builder di Supabase."""
+    for colonna, op, valore in filtri or ():
+        if op == "in":
+            query = query.in_(colonna, list(valore))
+        else:
+            query = getattr(query, op)(colonna, valore)
+    return query
+
+
+# --- INTERFACCIA ---
+class BackendArchivio:
+    """Dove vivono le tabelle `inventario` e `posizioni`.
+
+    InventarioDB parla solo con questi metodi; i filtri sono liste di
+    (colonna, operatore, valore) con operatore tra eq, neq, gt, in, ilike.
+    Le scritture restituiscono le righe come sono state salvate."""
+
+    def seleziona(self, tabella, colonne="*", filtri=(), ordine=None, limite=None):
+        raise NotImplementedError
+
+    def inserisci(self, tabella, righe):
+        raise NotImplementedError
+
+    def aggiorna(self, tabella, dati, filtri):
+        raise NotImplementedError
+
+    def elimina(self, tabella, filtri):
+        raise NotImplementedError
+
+    def upsert(self, tabella, righe, on_conflict=None):
+        raise NotImplementedError
+
+    def svuota(self, tabella):
+        raise NotImplementedError
+
+    def rpc(self, funzione, parametri=None):
+        """Funzione lato database (vedi sql/), es. gli aggregati della Home."""
+        raise NotImplementedError
+
+    def sveglia(self):
+        """Verifica (o ristabilisce) il collegamento: restituisce (ok, messaggio)."""
+        return True, "Online"
+
+    def stato(self):
+        """Informazioni di sincronizzazione, None se il backend non ne ha."""
+        return None
+
+
+# --- BACKEND SUPABASE ---
+class BackendSupabase(BackendArchivio):
+    def __init__(self, client):
+        self.client = client
+
+    def seleziona(self, tabella, colonne="*", filtri=(), ordine=None, limite=None):
+        q = applica_filtri(self.client.table(tabella).select(colonne), filtri)
+        if ordine:
+            q = q.order(ordine)
+        if limite:
+            q = q.limit(limite)
+        return q.execute().data
+
+    def inserisci(self, tabella, righe):
+        return self.client.table(tabella).insert(righe).execute().data
+
+    def aggiorna(self, tabella, dati, filtri):
+        return applica_filtri(self.client.table(tabella).update(dati), filtri).execute().data
+
+    def elimina(self, tabella, filtri):
+        return applica_filtri(self.client.table(tabella).delete(), filtri).execute().data
+
+    def upsert(self, tabella, righe, on_conflict=None):
+        return self.client.table(tabella).upsert(righe, on_conflict=on_conflict or "").execute().data
+
+    def svuota(self, tabella):
+        return self.client.table(tabella).delete().neq(CHIAVI[tabella], VALORE_ASSENTE[tabella]).execute().data
+
+    def rpc(self, funzione, parametri=None):
+        return self.client.rpc(funzione, parametri or {}).execute().data
+
+    def sveglia(self):
+        try:
+            self.client.table("inventario").select("id").limit(1).execute()
+            return True, "Online"
+        except Exception:
+            return False, "Offline"
+
+
+# --- BACKEND SQLITE ---
+class BackendSQLite(BackendArchivio):
+    """Le tabelle in un file SQLite locale: nessuna rete, query sotto il millisecondo.
+
+    WAL per letture e scritture contemporanee, indici su nome, ubi, zon e
+    zona, parametri sempre passati con '?' (le istruzioni preparate restano
+    nella cache di sqlite3 e vengono riusate)."""
+
+    def __init__(self, percorso):
+        self.percorso = percorso
+        self._lock = threading.RLock()
+        self._profondita = 0
+        # isolation_level=None: le transazioni le apriamo noi con BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(percorso, check_same_thread=False, isolation_level=None,
+                                     cached_statements=256)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+            self._aggiungi_colonne_mancanti()
+
+    def _aggiungi_colonne_mancanti(self):
+        # File creati prima che lo schema avesse tutte le colonne (es. posizioni.capienza)
+        for tabella, colonne in COLONNE.items():
+            presenti = {r["name"] for r in self._conn.execute(f"PRAGMA table_info({tabella})")}
+            for colonna in colonne:
+                if colonna not in presenti:
+                    self._conn.execute(f"ALTER TABLE {tabella} ADD COLUMN {colonna}")
+
+    @contextmanager
+    def _transazione(self):
+        with self._lock:
+            if self._profondita == 0:
+                self._conn.execute("BEGIN IMMEDIATE")
+            self._profondita += 1
+            try:
+                yield self._conn
+            except BaseException:
+                self._profondita -= 1
+                if self._profondita == 0:
+                    self._conn.execute("ROLLBACK")
+                raise
+            self._profondita -= 1
+            if self._profondita == 0:
+                self._conn.execute("COMMIT")
+
+    def _colonna(self, tabella, colonna):
+        colonna = colonna.strip()
+        if colonna not in COLONNE[tabella]:
+            raise ValueError(f"Colonna sconosciuta: {tabella}.{colonna}")
+        return colonna
+
+    def _where(self, tabella, filtri):
+        condizioni, parametri = [], []
+        for colonna, op, valore in filtri or ():
+            colonna = self._colonna(tabella, colonna)
+            if op == "in":
+                valori = list(valore)
+                condizioni.append(f"{colonna} IN ({', '.join('?' * len(valori))})" if valori else "0")
+                parametri.extend(valori)
+            else:
+                condizioni.append(f"{colonna} {_OPERATORI[op]}")
+                parametri.append(valore)
+        return (" WHERE " + " AND ".join(condizioni) if condizioni else ""), parametri
+
+    def _righe_valide(self, tabella, righe):
+        if isinstance(righe, dict):
+            righe = [righe]
+        return [{c: v for c, v in r.items() if c in COLONNE[tabella]} for r in righe]
+
+    def seleziona(self, tabella, colonne="*", filtri=(), ordine=None, limite=None):
+        if colonne == "*":
+            campi = "*"
+        else:
+            campi = ", ".join(self._colonna(tabella, c) for c in colonne.split(","))
+        where, parametri = self._where(tabella, filtri)
+        sql = f"SELECT {campi} FROM {tabella}{where}"
+        if ordine:
+            sql += f" ORDER BY {self._colonna(tabella, ordine)}"
+        if limite:
+            sql += " LIMIT ?"
+            parametri.append(limite)
+        with self._lock:
+            return [dict(r) for r in self._conn.execute(sql, parametri)]
+
+    def _inserisci_righe(self, conn, tabella, righe):
+        chiave = CHIAVI[tabella]
+        inserite = []
+        for r in righe:
+            if tabella == "inventario" and r.get("data_inserimento") is None:
+                # Come il default di Supabase; serve anche ai file creati prima del DEFAULT nello schema
+                r = dict(r, data_inserimento=_adesso())
+            campi = list(r)
+            cur = conn.execute(
+                f"INSERT INTO {tabella} ({', '.join(campi)}) VALUES ({', '.join('?' * len(campi))})",
+                [r[c] for c in campi])
+            valore = r[chiave] if r.get(chiave) is not None else cur.lastrowid
+            inserite.extend(self.seleziona(tabella, filtri=[(chiave, "eq", valore)]))
+        return inserite
+
+    def inserisci(self, tabella, righe):
+        righe = self._righe_valide(tabella, righe)
+        with self._transazione() as conn:
+            return self._inserisci_righe(conn, tabella, righe)
+
+    def aggiorna(self, tabella, dati, filtri):
+        dati = self._righe_valide(tabella, dati)[0]
+        chiave = CHIAVI[tabella]
+        with self._transazione() as conn:
+            chiavi = [r[chiave] for r in self.seleziona(tabella, chiave, filtri)]
+            if not chiavi or not dati:
+                return []
+            where, parametri = self._where(tabella, [(chiave, "in", chiavi)])
+            conn.execute(f"UPDATE {tabella} SET {', '.join(f'{c} = ?' for c in dati)}{where}",
+                         list(dati.values()) + parametri)
+            return self.seleziona(tabella, filtri=[(chiave, "in", chiavi)])
+
+    def elimina(self, tabella, filtri):
+        where, parametri = self._where(tabella, filtri)
+        with self._transazione() as conn:
+            return conn.execute(f"DELETE FROM {tabella}{where}", parametri).rowcount
+
+    def upsert(self, tabella, righe, on_conflict=None):
+        righe = self._righe_valide(tabella, righe)
+        if not righe:
+            return []
+        chiave = on_conflict or CHIAVI[tabella]
+        campi = list(righe[0])
+        aggiornamenti = ", ".join(f"{c} = excluded.{c}" for c in campi if c != chiave) or f"{chiave} = excluded.{chiave}"
+        sql = (f"INSERT INTO {tabella} ({', '.join(campi)}) VALUES ({', '.join('?' * len(campi))}) "
+               f"ON CONFLICT({chiave}) DO UPDATE SET {aggiornamenti}")
+        with self._transazione() as conn:
+            # Stessa istruzione per tutte le righe: SQLite la prepara una volta sola
+            conn.executemany(sql, [[r.get(c) for c in campi] for r in righe])
+        return righe
+
+    def svuota(self, tabella):
+        with self._transazione() as conn:
+            conn.execute(f"DELETE FROM {tabella}")
+
+    def rpc(self, funzione, parametri=None):
+        # Le stesse funzioni di sql/, scritte per SQLite
+        metodo = getattr(self, f"_rpc_{funzione}", None)
+        if metodo is None:
+            raise ValueError(f"Funzione sconosciuta: {funzione}")
+        return metodo(**(parametri or {}))
+
+    def _rpc_statistiche_magazzino(self):
+        with self._lock:
+            c = self._conn
+            conteggi = lambda campo: {k: n for k, n in c.execute(
+                f"SELECT {campo}, COUNT(*) AS n FROM inventario WHERE {campo} IS NOT NULL "
+                f"GROUP BY {campo} ORDER BY n DESC")}
+            return {
+                "scatole": c.execute("SELECT COUNT(*) FROM inventario").fetchone()[0],
+                "zone": c.execute("SELECT COUNT(DISTINCT zona) FROM posizioni WHERE COALESCE(zona, '') <> ''").fetchone()[0],
+                "ubicazioni": c.execute("SELECT COUNT(*) FROM posizioni").fetchone()[0],
+                "da_allocare": c.execute("SELECT COUNT(*) FROM inventario WHERE UPPER(TRIM(COALESCE(ubi, ''))) "
+                                         "IN ('', 'NON ALLOCATA')").fetchone()[0],
+                "per_proprietario": conteggi("proprietario"),
+                "per_zona": conteggi("zon"),
+                "ultime": [dict(r) for r in c.execute(
+                    "SELECT * FROM (SELECT id, nome, zon, ubi, proprietario FROM inventario "
+                    "ORDER BY id DESC LIMIT 5) ORDER BY id")],
+            }
+
+    def sostituisci(self, tabella, righe):
+        """Rimpiazza l'intera tabella; restituisce True se il contenuto è cambiato."""
+        chiave = CHIAVI[tabella]
+        nuove = sorted(self._righe_valide(tabella, righe), key=lambda r: str(r.get(chiave)))
+        with self._transazione() as conn:
+            attuali = [{c: v for c, v in r.items() if v is not None or c == chiave}
+                       for r in self.seleziona(tabella, ordine=chiave)]
+            confronto = [{c: v for c, v in r.items() if v is not None or c == chiave} for r in nuove]
+            if sorted(attuali, key=lambda r: str(r.get(chiave))) == confronto:
+                return False
+            conn.execute(f"DELETE FROM {tabella}")
+            campi = COLONNE[tabella]
+            conn.executemany(
+                f"INSERT INTO {tabella} ({', '.join(campi)}) VALUES ({', '.join('?' * len(campi))})",
+                [[r.get(c) for c in campi] for r in nuove])
+        return True
@@ -0,0 +1,188 @@
+"""Benchmark di InventarioDB e dei percorsi delle pagine su un magazzino sintetico.
+
+Gira tutto in locale su BackendSQLite (nessuna chiamata a Supabase o Cloudinary):
+
+    python benchmark.py --scatole 5000 --ubicazioni 1000 --ripetizioni 20
+    python benchmark.py --json risultati.json   # anche in JSON, per confrontare due versioni
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+import pandas as pd
+
+from ubicazioni import NON_ALLOCATA, ZONA_DA_DEFINIRE
+
+# --- DATI SINTETICI ---
+ZONE = {"GAR": "Garage", "CANT": "Cantina", "SOFF": "Soffitta", "RIP": "Ripostiglio"}
+PROPRIETARI = ["Victor", "Evelyn", "Daniel", "Carly", "Rebby"]
+OGGETTI = ["viti", "cacciavite", "trapano", "cavi", "lampadine", "libri", "quaderni", "giocattoli",
+           "lego", "piatti", "bicchieri", "tovaglie", "maglioni", "scarpe", "coperte", "addobbi",
+           "natale", "documenti", "fatture", "fotografie", "attrezzi", "colla", "nastro", "pennelli"]
+
+
+def genera_posizioni(n, rng):
+    """n ubicazioni con codici zona.corsia.ripiano (es. GAR.3.4), 6 ripiani per corsia."""
+    sigle = list(ZONE)
+    posizioni = []
+    for i in range(n):
+        sigla = sigle[i % len(sigle)]
+        k = i // len(sigle)
+        posizioni.append({"id_ubicazione": f"{sigla}.{k // 6 + 1}.{k % 6 + 1}", "zona": ZONE[sigla]})
+    rng.shuffle(posizioni)
+    return posizioni
+
+
+def genera_scatole(n, posizioni, rng, quota_allocate=0.8):
+    scatole = []
+    for i in range(n):
+        allocata = posizioni and rng.random() < quota_allocate
+        p = rng.choice(posizioni) if allocata else None
+        testo = lambda: " ".join(rng.sample(OGGETTI, 3))
+        scatole.append({
+            "nome": f"BOX-{i + 1:05d}",
+            "descrizione": testo(),
+            "proprietario": rng.choice(PROPRIETARI),
+            "cima_testo": testo(), "centro_testo": testo(), "fondo_testo": testo(),
+            "foto_main": f"https://res.cloudinary.com/demo/image/upload/v1/vhd/BOX-{i + 1:05d}_main.jpg",
+            "zon": p["zona"] if p else ZONA_DA_DEFINIRE,
+            "ubi": p["id_ubicazione"] if p else NON_ALLOCATA,
+            "data_inserimento": f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        })
+    return scatole
+
+
+def _silenzia_streamlit():
+    # Fuori da `streamlit run` gli avvisi sul contesto mancante sono solo rumore
+    for nome in list(logging.root.manager.loggerDict):
+        if nome.startswith("streamlit"):
+            logging.getLogger(nome).setLevel(logging.ERROR)
+
+
+# --- MISURA ---
+def misura(nome, funzione, ripetizioni, elementi=1, prima=None):
+    """Esegue `funzione` più volte; `prima` (non cronometrata) prepara ogni ripetizione."""
+    tempi = []
+    for _ in range(ripetizioni):
+        if prima:
+            prima()
+        inizio = time.perf_counter()
+        funzione()
+        tempi.append(time.perf_counter() - inizio)
+    tempi.sort()
+    p95 = tempi[min(len(tempi) - 1, int(round(0.95 * (len(tempi) - 1))))]
+    mediana = statistics.median(tempi)
+    return {
+        "caso": nome,
+        "ripetizioni": ripetizioni,
+        "p50_ms": round(mediana * 1000, 3),
+        "p95_ms": round(p95 * 1000, 3),
+        "elementi_al_secondo": round(elementi / mediana, 1) if mediana else None,
+    }
+
+
+def esegui(n_scatole, n_ubicazioni, ripetizioni, seme=42, percorso=None):
+    # Import qui: `--help` risponde senza caricare Streamlit, pandas e compagnia
+    import db_manager
+    import esportazione
+    import etichette
+    import mappa_magazzino
+    from backend import BackendSQLite
+    _silenzia_streamlit()
+
+    rng = random.Random(seme)
+    cartella = tempfile.mkdtemp(prefix="vhd_bench_")
+    backend = BackendSQLite(percorso or os.path.join(cartella, "bench.db"))
+    backend.svuota("inventario")
+    backend.svuota("posizioni")
+    posizioni = genera_posizioni(n_ubicazioni, rng)
+    backend.upsert("posizioni", posizioni)
+    backend.inserisci("inventario", genera_scatole(n_scatole, posizioni, rng))
+    db = db_manager.InventarioDB(backend)
+
+    inventario = db.visualizza_inventario()
+
+    def svuota_memoria():
+        db.cache.invalida()
+        db_manager._snapshot.invalida()
+    termini = [rng.choice(OGGETTI) for _ in range(50)] + ["box-01", "garage", "victor cavi"]
+    df_posizioni = pd.DataFrame({"id": [p["id_ubicazione"] for p in posizioni],
+                                 "zona": [p["zona"] for p in posizioni]})
+    xlsx_posizioni = io.BytesIO()
+    df_posizioni.to_excel(xlsx_posizioni, index=False)
+    xlsx_posizioni.name = "posizioni.xlsx"
+    mappa = mappa_magazzino.calcola_occupazione(inventario, posizioni)
+
+    risultati = [
+        misura("visualizza_inventario (senza cache)", db.visualizza_inventario, ripetizioni, n_scatole,
+               prima=svuota_memoria),
+        misura("visualizza_inventario (in cache)", db.visualizza_inventario, ripetizioni, n_scatole),
+        misura("indice di ricerca (ricostruzione)", lambda: db_manager._indice_ricerca.ricostruisci(inventario),
+               ripetizioni, n_scatole),
+        misura("cerca_scatola", lambda: [db.cerca_scatola(t) for t in termini], ripetizioni, len(termini)),
+        misura("trova_per_codice", lambda: [db.trova_per_codice(f"BOX-{i:05d}") for i in range(1, 101)],
+               ripetizioni, 100),
+        misura("statistiche_magazzino (database)", db.statistiche_magazzino, ripetizioni,
+               prima=svuota_memoria),
+        misura("statistiche_magazzino (snapshot)", db.statistiche_magazzino, ripetizioni,
+               prima=lambda: (db.visualizza_inventario(), db.visualizza_posizioni())),
+        misura("sposta_scatole (1, con flusso modifiche)",
+               lambda: db.sposta_scatole([(inventario[0]["id"], None, NON_ALLOCATA)]), ripetizioni),
+        misura("scatole_in (zona e corsia)", lambda: [db.scatole_in(z, 1) for z in ZONE], ripetizioni, len(ZONE)),
+        misura("posti_liberi (zona)", lambda: [db.posti_liberi(z) for z in ZONE], ripetizioni, len(ZONE)),
+        misura("import_posizioni_da_df", lambda: db.import_posizioni_da_df(df_posizioni.copy()),
+               ripetizioni, n_ubicazioni),
+        misura("importa_posizioni (xlsx a blocchi)", lambda: db.importa_posizioni(xlsx_posizioni),
+               ripetizioni, n_ubicazioni),
+        misura("mappa: calcola_occupazione", lambda: mappa_magazzino.calcola_occupazione(inventario, posizioni),
+               ripetizioni, n_ubicazioni),
+        misura("mappa: html_mappa", lambda: mappa_magazzino.html_mappa(mappa), ripetizioni, n_ubicazioni),
+        misura("export Excel", lambda: db.esporta_inventario("xlsx"), ripetizioni, n_scatole,
+               prima=lambda: esportazione._cache_export.invalida()),
+        misura("export CSV", lambda: db.esporta_inventario("csv"), ripetizioni, n_scatole,
+               prima=lambda: esportazione._cache_export.invalida()),
+        misura("PDF etichette scatole (20)", lambda: etichette.pdf_etichette_scatole(inventario[:20]),
+               ripetizioni, 20),
+        misura("PDF etichette ubicazioni (64)", lambda: etichette.pdf_etichette_ubicazioni(posizioni[:64]),
+               ripetizioni, 64),
+    ]
+    if percorso is None:
+        shutil.rmtree(cartella, ignore_errors=True)
+    return risultati
+
+
+def stampa_tabella(risultati):
+    larghezza = max(len(r["caso"]) for r in risultati)
+    print(f"{'caso':<{larghezza}}  {'p50 ms':>10}  {'p95 ms':>10}  {'elementi/s':>12}")
+    for r in risultati:
+        print(f"{r['caso']:<{larghezza}}  {r['p50_ms']:>10.3f}  {r['p95_ms']:>10.3f}  "
+              f"{r['elementi_al_secondo'] or 0:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scatole", type=int, default=5000)
+    parser.add_argument("--ubicazioni", type=int, default=1000)
+    parser.add_argument("--ripetizioni", type=int, default=20)
+    parser.add_argument("--seme", type=int, default=42, help="stesso seme, stesso magazzino")
+    parser.add_argument("--json", help="salva i risultati anche in questo file")
+    args = parser.parse_args()
+
+    risultati = esegui(args.scatole, args.ubicazioni, args.ripetizioni, args.seme)
+    print(f"Magazzino sintetico: {args.scatole} scatole, {args.ubicazioni} ubicazioni, "
+          f"{args.ripetizioni} ripetizioni per caso\n")
+    stampa_tabella(risultati)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"scatole": args.scatole, "ubicazioni": args.ubicazioni, "risultati": risultati}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import threading
+import time
+
+# --- VERSIONE DATI (CONDIVISA TRA TUTTE LE SESSIONI DEL PROCESSO) ---
+# Ogni scrittura sul database incrementa questo contatore: le cache delle
+# altre sessioni lo confrontano e scartano le copie diventate vecchie.
+_lock_versione = threading.Lock()
+_versione = 0
+
+
+def versione_dati():
+    return _versione
+
+
+def incrementa_versione():
+    global _versione
+    with _lock_versione:
+        _versione += 1
+        return _versione
+
+
+class CacheDati:
+    """Copia in memoria delle tabelle lette, con scadenza (TTL) e invalidazione esplicita."""
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self.hit = 0
+        self.miss = 0
+        self._voci = {}  # chiave -> (istante lettura, versione dati, righe)
+        self._lock = threading.Lock()
+
+    def leggi(self, chiave):
+        with self._lock:
+            voce = self._voci.get(chiave)
+            if voce is not None:
+                istante, versione, righe = voce
+                if versione == versione_dati() and time.monotonic() - istante < self.ttl:
+                    self.hit += 1
+                    return righe
+                del self._voci[chiave]
+            self.miss += 1
+            return None
+
+    def contiene(self, chiave):
+        """Come leggi() ma senza contare hit/miss: serve solo a scegliere la strada."""
+        voce = self._voci.get(chiave)
+        return (voce is not None and voce[1] == versione_dati()
+                and time.monotonic() - voce[0] < self.ttl)
+
+    def scrivi(self, chiave, righe, versione=None):
+        # La versione va letta PRIMA della query: se nel frattempo qualcuno
+        # scrive, la voce nasce già scaduta invece di restare vecchia per un TTL.
+        if versione is None:
+            versione = versione_dati()
+        with self._lock:
+            self._voci[chiave] = (time.monotonic(), versione, righe)
+
+    def invalida(self, *chiavi):
+        with self._lock:
+            if not chiavi:
+                self._voci.clear()
+                return
+            for chiave in chiavi:
+                self._voci.pop(chiave, None)
+
+    def statistiche(self):
+        totale = self.hit + self.miss
+        return {
+            "hit": self.hit,
+            "miss": self.miss,
+            "hit_ratio": round(self.hit / totale, 3) if totale else 0.0,
+            "voci": len(self._voci),
+            "versione": versione_dati(),
+        }
@@ -0,0 +1,114 @@
+import time
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import strumentazione
+
+logger = logging.getLogger(__name__)
+
+# --- PARAMETRI PIPELINE ---
+MAX_THREAD = 4        # una scatola ha al massimo 4 foto: main, cima, centro, fondo
+TIMEOUT_FOTO = 45     # secondi concessi a ogni singolo file (tentativi compresi)
+TENTATIVI = 3
+ATTESA_RIPROVA = 0.5  # secondi, raddoppia a ogni tentativo fallito
+
+# Pool condiviso da tutte le sessioni: limita i caricamenti contemporanei del processo
+_pool = ThreadPoolExecutor(max_workers=MAX_THREAD * 2, thread_name_prefix="upload_foto")
+
+# --- VARIANTI (MINIATURE) ---
+# Trasformazione Cloudinary per le anteprime: lato max 320 px, qualità e formato automatici
+VARIANTE_MINIATURA = "c_limit,w_320,q_auto,f_auto"
+
+# hash: impronta percettiva della foto caricata (None se non richiesta)
+EsitoUpload = namedtuple("EsitoUpload", "chiave url errore tentativi secondi hash", defaults=(None,))
+
+
+def _uploader_cloudinary(file, **opzioni):
+    import cloudinary.uploader
+    opzioni.setdefault("timeout", TIMEOUT_FOTO)
+    # La miniatura viene generata subito (in background su Cloudinary), non alla prima visita
+    opzioni.setdefault("eager", [{"raw_transformation": VARIANTE_MINIATURA}])
+    opzioni.setdefault("eager_async", True)
+    return cloudinary.uploader.upload(file, **opzioni)
+
+
+def url_miniatura(url, variante=VARIANTE_MINIATURA):
+    """URL dell'anteprima di una foto Cloudinary; gli altri percorsi restano invariati."""
+    if not url or "res.cloudinary.com" not in url or "/upload/" not in url:
+        return url
+    testa, coda = url.split("/upload/", 1)
+    if coda.startswith(variante + "/"):
+        return url
+    return f"{testa}/upload/{variante}/{coda}"
+
+
+def _prepara_predefinita(file):
+    from preparazione_foto import prepara_foto
+    return prepara_foto(file)
+
+
+@strumentazione.misurata("upload", "cloudinary.upload", conta=lambda esito: (1, None))
+def _carica_uno(chiave, file, opzioni, uploader, tentativi, timeout, prepara, impronta=None):
+    inizio = time.monotonic()
+    scadenza = inizio + timeout  # il tempo di ogni file parte quando il pool lo prende in carico
+    errore = None
+    if prepara:
+        # Ridimensionamento nel thread del pool: anche questo lavoro avviene in parallelo
+        file = prepara(file)
+    h = impronta(file) if impronta else None
+    for n in range(1, tentativi + 1):
+        try:
+            if hasattr(file, "seek"):
+                file.seek(0)  # ogni tentativo deve rileggere il file dall'inizio
+            # Il timeout della richiesta non supera il tempo rimasto al file: un upload già
+            # avviato non si può interrompere dall'esterno, solo lui può arrendersi in tempo
+            residuo = max(1.0, scadenza - time.monotonic())
+            ris = uploader(file, **dict(opzioni, timeout=min(opzioni.get("timeout", residuo), residuo)))
+            return EsitoUpload(chiave, ris.get("secure_url"), None, n, time.monotonic() - inizio, h)
+        except Exception as e:
+            errore = e
+            logger.warning("Upload %s fallito (tentativo %d/%d): %s", chiave, n, tentativi, e)
+            pausa = ATTESA_RIPROVA * 2 ** (n - 1)
+            if n == tentativi or time.monotonic() + pausa >= scadenza:
+                break
+            time.sleep(pausa)
+    return EsitoUpload(chiave, None, str(errore), n, time.monotonic() - inizio)
+
+
+@strumentazione.misurata("upload", "carica_foto", conta=lambda esiti: (len(esiti), None))
+def carica_foto(richieste, uploader=None, timeout=TIMEOUT_FOTO, tentativi=TENTATIVI, prepara=True, impronta=None):
+    """Carica più foto in parallelo e restituisce {chiave: EsitoUpload}.
+
+    `richieste` è {chiave: (file, opzioni_upload)}; i file None vengono saltati.
+    `uploader(file, **opzioni)` deve restituire un dict con 'secure_url'
+    (di default cloudinary.uploader.upload; nei test basta una funzione finta).
+    `prepara` ridimensiona/ricomprime ogni file prima dell'invio: True usa
+    preparazione_foto.prepara_foto, una funzione la sostituisce, False la salta.
+    `impronta(file)`, se indicata, calcola nel pool l'hash della foto preparata
+    (es. indice_foto.hash_percettivo) e lo riporta in EsitoUpload.hash.
+
+    `timeout` arriva all'uploader come opzione `timeout` (il tempo rimasto al
+    file): è l'unico modo di fermare un invio già partito, perché un thread
+    del pool non si può interrompere. Un uploader che la ignora può restare
+    appeso oltre il timeout e tenere occupato un thread del pool."""
+    uploader = uploader or _uploader_cloudinary
+    if prepara is True:
+        prepara = _prepara_predefinita
+    futuri = {
+        chiave: _pool.submit(strumentazione.nel_contesto(_carica_uno), chiave, file, dict(opzioni), uploader, tentativi, timeout, prepara, impronta)
+        for chiave, (file, opzioni) in richieste.items() if file is not None
+    }
+    # Margine doppio: con più sessioni insieme un file può attendere in coda nel pool
+    wait(futuri.values(), timeout=timeout * 2)
+    esiti = {}
+    for chiave, futuro in futuri.items():
+        if futuro.done():
+            esiti[chiave] = futuro.result()
+        else:
+            # cancel() toglie dalla coda solo i file non ancora partiti: un upload in corso
+            # resta nel pool (occupando un thread) finché il suo timeout non lo chiude.
+            # La pagina comunque non lo aspetta oltre e la foto risulta non caricata.
+            futuro.cancel()
+            esiti[chiave] = EsitoUpload(chiave, None, f"timeout dopo {timeout}s", 0, float(timeout))
+    return esiti
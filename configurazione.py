@@ -0,0 +1,21 @@
+import os
+
+import streamlit as st
+
+
+def config(nome, predefinito=None):
+    """Valore da st.secrets, in mancanza dalla variabile d'ambiente VHD_<nome>."""
+    try:
+        if nome in st.secrets:
+            return st.secrets[nome]
+    except Exception:
+        pass  # nessun secrets.toml (script, test)
+    return os.environ.get(f"VHD_{nome}", predefinito)
+
+
+def attivo(nome, predefinito=False):
+    """Interruttore sì/no: accetta 1/true/si/sì (e i booleani di secrets.toml)."""
+    valore = config(nome)
+    if valore is None:
+        return predefinito
+    return str(valore).strip().lower() in ("1", "true", "si", "sì")
@@ -1,60 +1,564 @@
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 from supabase import create_client, Client
 import streamlit as st
 import cloudinary
-import cloudinary.uploader
+from cache_dati import CacheDati, versione_dati, incrementa_versione
+from ricerca import IndiceRicerca
+from indice_foto import IndiceFoto, hash_percettivo, in_firmato, SOGLIA_DOPPIONE
+from caricamento_foto import carica_foto, url_miniatura, EsitoUpload
+from backend import BackendSupabase, BackendSQLite
+from replica_locale import ReplicaLocale, SincronizzatoreCloud
+import esportazione
+import strumentazione
+from configurazione import config
+from flusso_modifiche import BusModifiche, SnapshotCondiviso, AscoltatoreRealtime, ORDINE, con_flusso
+from ubicazioni import IndiceUbicazioni, CAPIENZA_PREDEFINITA, NON_ALLOCATA, ZONA_DA_DEFINIRE
+from importazione import (DIMENSIONE_BLOCCO, leggi_blocchi, normalizza_posizioni, normalizza_scatole,
+                          in_righe, importa_a_blocchi)
 
 # --- CONFIGURAZIONE CLOUDINARY ---
-cloudinary.config(
-    cloud_name = st.secrets["CLOUDINARY_CLOUD_NAME"],
-    api_key = st.secrets["CLOUDINARY_API_KEY"],
-    api_secret = st.secrets["CLOUDINARY_API_SECRET"],
-    secure = True
-)
+# Il modulo viene importato una sola volta per processo: la configurazione
+# vale per tutte le sessioni e tutti i rerun (app_inventario.py non la ripete).
+try:
+    if "CLOUDINARY_CLOUD_NAME" in st.secrets:
+        cloudinary.config(
+            cloud_name = st.secrets["CLOUDINARY_CLOUD_NAME"],
+            api_key = st.secrets["CLOUDINARY_API_KEY"],
+            api_secret = st.secrets["CLOUDINARY_API_SECRET"],
+            secure = True
+        )
+except:
+    pass
 
+# --- CLIENT SUPABASE CONDIVISO ---
+@st.cache_resource(show_spinner=False)
+def client_supabase(url, key) -> Client:
+    """Un solo client per processo: le connessioni HTTP (TLS compreso) restano
+    aperte nel pool e vengono riusate da tutte le sessioni e da tutti i rerun."""
+    return create_client(url, key)
+
+# --- SCELTA DEL BACKEND ---
+# BACKEND nei secrets (o variabile d'ambiente VHD_BACKEND):
+#   "supabase" (predefinito) -> tutto direttamente sul cloud
+#   "sqlite"                 -> solo file locale SQLITE_PATH, nessuna rete (LAN, test)
+#   "replica"                -> offline-first: SQLite locale + sincronizzazione con Supabase
+
+@st.cache_resource(show_spinner=False)
+def backend_sqlite(percorso):
+    return BackendSQLite(percorso)
+
+def backend_configurato():
+    tipo = str(config("BACKEND", "supabase")).strip().lower()
+    if tipo == "sqlite":
+        # Ogni scrittura passa da questo processo: il bus locale vede tutto
+        _snapshot.completo = True
+        return backend_sqlite(config("SQLITE_PATH", "vhd_locale.db"))
+    url, key = config("SUPABASE_URL"), config("SUPABASE_KEY")
+    if tipo == "replica":
+        _snapshot.completo = True  # le novità dal cloud arrivano con al_cambio
+        return replica_locale(config("REPLICA_PATH", "vhd_replica.db"), url, key)
+    if str(config("REALTIME", "si")).strip().lower() not in ("no", "0", "false"):
+        ascoltatore_realtime(url, key)
+    return BackendSupabase(client_supabase(url, key))
+
+# --- FLUSSO DELLE MODIFICHE (uno per processo, condiviso da tutte le sessioni) ---
+# Le scritture di ogni sessione (e di Supabase Realtime) arrivano come eventi di
+# riga allo snapshot condiviso: chi legge dopo una modifica non rilegge la tabella.
+SNAPSHOT_TTL = 900  # secondi: con il flusso completo, rilettura solo di sicurezza
+_bus = BusModifiche()
+_snapshot = SnapshotCondiviso()
+
+def _applica_eventi(eventi):
+    """Snapshot e indice di ricerca aggiornati riga per riga.
+
+    Le modifiche arrivate da fuori (Realtime, altri processi) cambiano anche la
+    versione dei dati: cache delle sessioni, export e risultati di Cerca non le
+    hanno viste. Per le scritture di questo processo lo fa già _dati_modificati."""
+    if any(not ev.locale for ev in eventi):
+        incrementa_versione()
+    for ev in _snapshot.applica(eventi):
+        if ev.tabella != "inventario" or not _indice_ricerca.pronto:
+            continue
+        if ev.tipo == "RESET":
+            _indice_ricerca.pronto = False
+        elif ev.tipo == "DELETE":
+            _indice_ricerca.rimuovi(ev.riga.get("id"))
+        else:
+            _indice_ricerca.aggiorna(ev.riga)
+
+@st.cache_resource(show_spinner=False)
+def ascoltatore_realtime(url, key):
+    ascoltatore = AscoltatoreRealtime(url, key, _bus, _snapshot)
+    ascoltatore.start()
+    return ascoltatore
+
+# --- REPLICA LOCALE (modalità offline-first) ---
+def _dati_cambiati_altrove():
+    """Il sincronizzatore ha portato dati nuovi dal cloud: le copie in memoria vanno rifatte."""
+    incrementa_versione()
+    _snapshot.invalida()
+    _indice_ricerca.pronto = False
+    _indice_foto.pronto = False
+
+@st.cache_resource(show_spinner=False)
+def replica_locale(percorso, url, key):
+    replica = ReplicaLocale(percorso)
+    replica.sincronizzatore = SincronizzatoreCloud(replica, BackendSupabase(client_supabase(url, key)))
+    replica.al_cambio.append(_dati_cambiati_altrove)
+    replica.sincronizzatore.start()
+    # Al primo avvio la replica è vuota: aspettiamo (poco) il primo scaricamento
+    replica.sincronizzatore.primo_allineamento.wait(timeout=10)
+    return replica
+
+# --- IMPRONTE DELLE FOTO GIÀ CARICATE ---
+TIMEOUT_DOWNLOAD = 20  # secondi per scaricare una foto da cui calcolare l'impronta
+
+def _scarica_foto(url):
+    with urllib.request.urlopen(url_miniatura(url), timeout=TIMEOUT_DOWNLOAD) as risposta:
+        return risposta.read()
+
+# --- CACHE LETTURE (per sessione) ---
+CACHE_TTL = 60  # secondi prima di rileggere comunque dal cloud
+
+def _cache_sessione():
+    """Restituisce la cache della sessione Streamlit corrente (creata al primo uso)."""
+    try:
+        if "_cache_dati" not in st.session_state:
+            st.session_state["_cache_dati"] = CacheDati(ttl=CACHE_TTL)
+        return st.session_state["_cache_dati"]
+    except Exception:
+        # Fuori da Streamlit (script, console) niente session_state
+        return CacheDati(ttl=CACHE_TTL)
+
+# --- PAGINAZIONE E PROIEZIONE ---
+COLONNE_ELENCO = ("id", "nome", "proprietario")  # quanto basta per menu e liste di scelta
+DIMENSIONE_PAGINA = 20
+PAGINA_MASSIMA = 1000  # limite righe per risposta di PostgREST su Supabase
+
+def _proiezione(colonne):
+    """Trasforma una tupla di colonne nella stringa per select(); l'id serve sempre al cursore."""
+    if not colonne or colonne == "*":
+        return "*"
+    if isinstance(colonne, str):
+        colonne = [c.strip() for c in colonne.split(",")]
+    if "id" not in colonne:
+        colonne = ["id"] + list(colonne)
+    return ",".join(colonne)
+
+# --- LETTURE IN PARALLELO ---
+# Nome della lettura -> metodo di InventarioDB; il pool è condiviso da tutte le sessioni
+LETTURE_BUNDLE = {"inventario": "visualizza_inventario", "posizioni": "visualizza_posizioni",
+                  "elenco_scatole": "elenco_scatole", "statistiche": "statistiche_magazzino",
+                  "occupazione": "elenco_occupazione"}
+# Tabelle dello snapshot da cui si ricava ogni lettura
+TABELLE_LETTURE = {"statistiche": ("inventario", "posizioni"), "occupazione": ("inventario",),
+                   "elenco_scatole": ("inventario",)}
+_pool_letture = ThreadPoolExecutor(max_workers=8, thread_name_prefix="letture")
+
+# --- INDICE DI RICERCA (uno per processo, condiviso da tutte le sessioni) ---
+INDICE_TTL = 900  # secondi: oltre, l'indice si ricostruisce per raccogliere modifiche esterne
+_indice_ricerca = IndiceRicerca()
+_indice_foto = IndiceFoto()  # hash percettivi delle foto, stesso TTL dell'indice di ricerca
+_bus.iscrivi(_applica_eventi)
+CAMPI_FOTO = ("foto_main", "cima_foto", "centro_foto", "fondo_foto")
+
+def normalizza_codice(codice):
+    """Forma canonica dei codici letti dai QR (nomi scatola e ID ubicazione)."""
+    return str(codice or "").strip().upper()
+
+_statistiche_in_sql = True  # False dopo che Supabase ha risposto che la funzione non esiste
+
+def funzione_mancante(errore):
+    """La funzione di sql/ non è installata (PGRST202 da PostgREST, 42883 da Postgres)."""
+    return str(getattr(errore, "code", "") or "") in ("PGRST202", "42883")
+
+def _statistiche_da_righe(inventario, posizioni):
+    """Stessi aggregati di statistiche_magazzino, calcolati in Python dalle tabelle intere."""
+    inv = pd.DataFrame(inventario)
+    conteggi = lambda campo: {k: int(n) for k, n in inv[campo].value_counts().items()} if campo in inv else {}
+    ubi = inv["ubi"].fillna("").astype(str).str.strip().str.upper() if "ubi" in inv else pd.Series(dtype=str)
+    colonne = [c for c in ("id", "nome", "zon", "ubi", "proprietario") if c in inv]
+    return {
+        "scatole": len(inv),
+        "zone": len({p.get("zona") for p in posizioni if p.get("zona")}),
+        "ubicazioni": len(posizioni),
+        "da_allocare": int(ubi.isin(["", NON_ALLOCATA]).sum()),
+        "per_proprietario": conteggi("proprietario"),
+        "per_zona": conteggi("zon"),
+        "ultime": in_righe(inv[colonne].tail(5)) if colonne else [],
+    }
+
+@strumentazione.misura_metodi("db")
 class InventarioDB:
-    def __init__(self):
-        self.url = st.secrets["SUPABASE_URL"]
-        self.key = st.secrets["SUPABASE_KEY"]
-        self.supabase: Client = create_client(self.url, self.key)
+    def __init__(self, backend=None, cache=None):
+        # backend esplicito per test e benchmark, altrimenti quello scelto nella configurazione
+        self.backend = strumentazione.misura_backend(con_flusso(backend or backend_configurato(), _bus))
+        self.cache = cache or _cache_sessione()
 
-    def sveglia_database(self):
+    def stato_sincronizzazione(self):
+        """Modifiche in attesa di arrivare al cloud (None se il backend non sincronizza)."""
+        return self.backend.stato()
+
+    def _dati_modificati(self, *tabelle):
+        """Da chiamare dopo ogni scrittura riuscita: scarta le copie in cache."""
+        self.cache.invalida(*tabelle)
+        incrementa_versione()
+
+    def statistiche_cache(self):
+        return self.cache.statistiche()
+
+    def _in_memoria(self, tabella):
+        """Tabella servita dallo snapshot condiviso (senza flusso completo vale il TTL della cache)."""
+        return _snapshot.pronta(tabella, SNAPSHOT_TTL if _snapshot.completo else CACHE_TTL)
+
+    def _snapshot_pronto(self, *tabelle):
+        """Con il flusso completo conviene una lettura intera, poi bastano gli eventi."""
+        if _snapshot.completo:
+            for tabella in tabelle:
+                self._leggi_tabella(tabella, ORDINE[tabella])
+        return all(self._in_memoria(t) for t in tabelle)
+
+    def _disponibile(self, lettura):
+        """La lettura si serve dalla memoria (snapshot o cache della sessione), senza query."""
+        tabelle = TABELLE_LETTURE.get(lettura, (lettura,))
+        return all(self._in_memoria(t) for t in tabelle) or self.cache.contiene(lettura)
+
+    def modifiche_in_diretta(self):
+        """True se le modifiche di tutti (altre sessioni, altri dispositivi) arrivano da sole."""
+        return _snapshot.completo
+
+    def _leggi_tabella(self, tabella, ordine):
+        """Snapshot condiviso se pronto, altrimenti query (e lo snapshot riparte da qui)."""
+        if self._in_memoria(tabella):
+            return _snapshot.righe(tabella)
+        dati = self.cache.leggi(tabella)
+        if dati is not None:
+            return dati
         try:
-            self.supabase.table("inventario").select("id").limit(1).execute()
-            return True, "Online"
+            versione, generazione = versione_dati(), _snapshot.generazione
+            righe = self.backend.seleziona(tabella, ordine=ordine)
+            self.cache.scrivi(tabella, righe, versione)
+            _snapshot.carica(tabella, righe, generazione)
+            return righe
         except:
-            return False, "Offline"
+            return []
+
+    def _indice_pronto(self):
+        """Indice di ricerca aggiornato; lo ricostruisce dallo snapshot se manca o è vecchio."""
+        scaduto = time.monotonic() - _indice_ricerca.costruito_alle > INDICE_TTL
+        if not _indice_ricerca.pronto or scaduto:
+            righe = self.visualizza_inventario()
+            if righe or not _indice_ricerca.pronto:
+                _indice_ricerca.ricostruisci(righe)
+        return _indice_ricerca
+
+    def versione_dati(self):
+        """Numero che cambia a ogni scrittura: utile per capire se una copia è vecchia."""
+        return versione_dati()
+
+    def sveglia_database(self):
+        return self.backend.sveglia()
 
     def visualizza_inventario(self):
+        return self._leggi_tabella("inventario", ORDINE["inventario"])
+
+    def visualizza_posizioni(self):
+        return self._leggi_tabella("posizioni", ORDINE["posizioni"])
+
+    def carica_bundle(self, *letture):
+        """Più letture indipendenti in parallelo, es. carica_bundle("inventario", "posizioni").
+
+        Restituisce i risultati nello stesso ordine: il caricamento di una pagina
+        dura quanto la query più lenta, non quanto la somma. Quello che è già
+        in cache si legge subito, senza passare dal pool."""
+        funzioni = [getattr(self, LETTURE_BUNDLE[n]) for n in letture]
+        da_scaricare = [i for i, n in enumerate(letture) if not self._disponibile(n)]
+        if len(da_scaricare) < 2:
+            return tuple(f() for f in funzioni)
+        futuri = {i: _pool_letture.submit(strumentazione.nel_contesto(funzioni[i])) for i in da_scaricare}
+        return tuple(futuri[i].result() if i in futuri else f() for i, f in enumerate(funzioni))
+
+    # --- AGGREGATI PER LA HOME ---
+    def statistiche_magazzino(self):
+        """Contatori e conteggi per la Home, calcolati dal database (funzione sql/statistiche.sql).
+
+        Restituisce scatole, zone, ubicazioni, da_allocare, per_proprietario,
+        per_zona (dict valore -> numero) e ultime (le 5 scatole più recenti).
+        Con il flusso delle modifiche attivo arrivano dai contatori dello snapshot."""
+        if self._snapshot_pronto("inventario", "posizioni"):
+            return _snapshot.statistiche()
+        dati = self.cache.leggi("statistiche")
+        if dati is not None:
+            return dati
+        global _statistiche_in_sql
+        versione = versione_dati()
+        dati = None
+        if _statistiche_in_sql:
+            try:
+                dati = self.backend.rpc("statistiche_magazzino")
+            except Exception as e:
+                if not funzione_mancante(e):
+                    # Errore di rete o del database: meglio dirlo che mostrare conteggi rifatti a metà
+                    st.error(f"Errore statistiche: {e}")
+                    return _statistiche_da_righe([], [])
+                # Funzione non ancora installata su Supabase: da qui in poi si calcola dalle righe
+                _statistiche_in_sql = False
+        if dati is None:
+            dati = _statistiche_da_righe(self.visualizza_inventario(), self.visualizza_posizioni())
+        self.cache.scrivi("statistiche", dati, versione)
+        return dati
+
+    def elenco_occupazione(self):
+        """Nome e ubicazione di ogni scatola: quanto serve alla mappa del magazzino."""
+        if self._snapshot_pronto("inventario"):
+            return _snapshot.occupazione()
+        return self.elenco_scatole(("nome", "ubi"))
+
+    # --- RICERCA PER CODICE (SCANNER QR) ---
+    def _indice_codici(self, tabella, campo):
+        """Dizionario codice normalizzato -> riga, costruito una volta per snapshot."""
+        chiave = f"indice_{tabella}"
+        indice = self.cache.leggi(chiave)
+        if indice is None:
+            versione = versione_dati()
+            righe = self.visualizza_inventario() if tabella == "inventario" else self.visualizza_posizioni()
+            indice = {}
+            for r in righe:
+                # In caso di nomi doppi vince la prima riga (id più basso), come prima
+                indice.setdefault(normalizza_codice(r.get(campo)), r)
+            if righe:
+                self.cache.scrivi(chiave, indice, versione)
+        return indice
+
+    def trova_per_codice(self, codice):
+        """Restituisce la scatola il cui nome corrisponde al codice scansionato (o None).
+
+        Con lo snapshot in memoria è un accesso diretto al dizionario; altrimenti
+        una sola query di uguaglianza su `nome`, senza scaricare l'inventario."""
+        chiave = normalizza_codice(codice)
+        if not chiave:
+            return None
+        if self._disponibile("inventario"):
+            return self._indice_codici("inventario", "nome").get(chiave)
+        try:
+            righe = self.backend.seleziona("inventario", filtri=[("nome", "eq", str(codice).strip())], ordine="id", limite=1)
+            if not righe:
+                # Maiuscole/minuscole diverse: ILIKE senza jolly (escape di _ e %)
+                esatto = chiave.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+                righe = self.backend.seleziona("inventario", filtri=[("nome", "ilike", esatto)], ordine="id", limite=1)
+            return righe[0] if righe else None
+        except:
+            return None
+
+    def trova_posizione(self, codice):
+        """Restituisce l'ubicazione con quell'ID (o None), tramite l'indice dei codici."""
+        chiave = normalizza_codice(codice)
+        if not chiave:
+            return None
+        return self._indice_codici("posizioni", "id_ubicazione").get(chiave)
+
+    # --- LETTURE PAGINATE ---
+    def pagina_inventario(self, colonne=COLONNE_ELENCO, limite=DIMENSIONE_PAGINA, dopo_id=None):
+        """Una pagina di scatole ordinate per id, con le sole colonne richieste.
+
+        Paginazione a cursore: `dopo_id` è l'ultimo id della pagina precedente.
+        Restituisce (righe, cursore_successivo); il cursore è None all'ultima pagina."""
         try:
-            res = self.supabase.table("inventario").select("*").order("id").execute()
-            return res.data
+            filtri = [("id", "gt", dopo_id)] if dopo_id is not None else []
+            righe = self.backend.seleziona("inventario", _proiezione(colonne), filtri, "id", limite)
+            cursore = righe[-1]["id"] if len(righe) == limite else None
+            return righe, cursore
         except:
+            return [], None
+
+    def elenco_scatole(self, colonne=COLONNE_ELENCO):
+        """Tutte le scatole, ma solo con le colonne indicate (per menu e checkbox)."""
+        proiezione = _proiezione(colonne)
+        if self._disponibile("inventario"):
+            # Lo snapshot completo è già in memoria: proiettiamo senza query
+            if proiezione == "*":
+                return self.visualizza_inventario()
+            campi = proiezione.split(",")
+            return [{c: r.get(c) for c in campi} for r in self.visualizza_inventario()]
+        chiave = f"inventario[{proiezione}]"
+        dati = self.cache.leggi(chiave)
+        if dati is not None:
+            return dati
+        versione = versione_dati()
+        try:
+            # pagine_inventario non nasconde gli errori: in cache va solo un elenco letto fino in fondo
+            dati = [r for righe in self.pagine_inventario(colonne, PAGINA_MASSIMA) for r in righe]
+        except Exception as e:
+            st.error(f"Errore lettura elenco scatole: {e}")
             return []
+        self.cache.scrivi(chiave, dati, versione)
+        return dati
 
-    def visualizza_posizioni(self):
+    def leggi_scatole(self, ids):
+        """Righe complete delle sole scatole indicate (una query con IN)."""
+        ids = list(ids)
+        if not ids:
+            return []
+        if self._in_memoria("inventario"):
+            return sorted(_snapshot.righe_per_chiave("inventario", set(ids)), key=lambda r: r["id"])
+        if self._disponibile("inventario"):
+            richiesti = set(ids)
+            return [r for r in self.visualizza_inventario() if r.get("id") in richiesti]
         try:
-            res = self.supabase.table("posizioni").select("*").order("zona").execute()
-            return res.data
+            return self.backend.seleziona("inventario", filtri=[("id", "in", ids)], ordine="id")
         except:
             return []
 
-    def upload_foto(self, file, nome_scatola, posizione):
+    def leggi_scatola(self, id_scatola):
+        righe = self.leggi_scatole([id_scatola])
+        return righe[0] if righe else None
+
+    def pagine_inventario(self, colonne="*", dimensione=PAGINA_MASSIMA):
+        """Tutto l'inventario, una pagina alla volta (generatore): per export e elaborazioni lunghe.
+
+        A differenza di pagina_inventario un errore non viene nascosto: un
+        export troncato a metà sarebbe peggio di nessun export."""
+        cursore = None
+        while True:
+            filtri = [("id", "gt", cursore)] if cursore is not None else []
+            righe = self.backend.seleziona("inventario", _proiezione(colonne), filtri, "id", dimensione)
+            if righe:
+                yield righe
+            if len(righe) < dimensione:
+                return
+            cursore = righe[-1]["id"]
+
+    def esporta_inventario(self, formato="xlsx"):
+        """File di export (bytes) costruito pagina per pagina; None in caso di errore.
+
+        Finché i dati non cambiano il file resta in cache e i download successivi non costano nulla."""
         try:
-            if file is None:
-                return None
-            folder_path = f"vhd_wms/{nome_scatola}"
-            upload_result = cloudinary.uploader.upload(
-                file,
-                folder=folder_path,
-                public_id=f"{nome_scatola}_{posizione}",
-                overwrite=True,
-                resource_type="image"
-            )
-            return upload_result.get('secure_url')
+            return esportazione.esporta(self.pagine_inventario(), formato)
         except Exception as e:
-            st.error(f"Errore caricamento Cloudinary ({posizione}): {e}")
+            st.error(f"Errore export: {e}")
+            return None
+
+    def upload_foto(self, file, nome_scatola, posizione):
+        if file is None:
             return None
+        return self.upload_foto_scatola({posizione: file}, nome_scatola).get(posizione)
+
+    def upload_foto_scatola(self, foto, nome_scatola):
+        """Carica in parallelo le foto di una scatola ({posizione: file}) -> {posizione: url}."""
+        richieste = {
+            posizione: (file, {
+                "folder": f"vhd_wms/{nome_scatola}",
+                "public_id": f"{nome_scatola}_{posizione}",
+                "overwrite": True,
+                "resource_type": "image",
+            })
+            for posizione, file in foto.items()
+        }
+        url = {}
+        esiti = carica_foto(richieste, impronta=hash_percettivo)
+        for posizione, esito in esiti.items():
+            if esito.errore:
+                st.error(f"Errore caricamento Cloudinary ({posizione}): {esito.errore}")
+            url[posizione] = esito.url
+        self.registra_impronte(esiti.values())
+        return url
+
+    # --- RICERCA PER IMMAGINE (hash percettivi) ---
+    def registra_impronte(self, esiti):
+        """Salva gli hash delle foto appena caricate (EsitoUpload con url e hash)."""
+        righe = [{"url": e.url, "hash": in_firmato(e.hash)} for e in esiti if e.url and e.hash is not None]
+        if not righe:
+            return
+        try:
+            self.backend.upsert("foto_hash", righe, on_conflict="url")
+        except Exception as e:
+            # La foto è comunque caricata: senza impronta non comparirà solo tra le simili
+            st.warning(f"Impronta foto non salvata: {e}")
+            return
+        if _indice_foto.pronto:
+            for r in righe:
+                _indice_foto.aggiungi(r["url"], r["hash"])
+
+    def calcola_impronte_mancanti(self, scarica=None, progresso=None):
+        """Impronte delle foto caricate prima di foto_hash: scarica ogni foto senza hash e lo registra.
+
+        `scarica(url)` restituisce i bytes della foto (di default la miniatura
+        Cloudinary: per il pHash basta). Restituisce (calcolate, fallite)."""
+        scarica = scarica or _scarica_foto
+        try:
+            note = {r["url"] for r in self.backend.seleziona("foto_hash", "url")}
+        except Exception as e:
+            st.error(f"Impronte non disponibili (eseguire sql/foto_hash.sql): {e}")
+            return 0, 0
+        mancanti = sorted({r[c] for r in self.visualizza_inventario() for c in CAMPI_FOTO if r.get(c)} - note)
+
+        def impronta(url):
+            try:
+                return EsitoUpload(url, url, None, 1, 0.0, hash_percettivo(scarica(url)))
+            except Exception as e:
+                return EsitoUpload(url, url, str(e), 1, 0.0)
+
+        calcolate = fallite = 0
+        for inizio in range(0, len(mancanti), DIMENSIONE_BLOCCO):
+            esiti = list(_pool_letture.map(impronta, mancanti[inizio:inizio + DIMENSIONE_BLOCCO]))
+            valide = [e for e in esiti if e.hash is not None]
+            self.registra_impronte(valide)
+            calcolate += len(valide)
+            fallite += len(esiti) - len(valide)
+            if progresso:
+                progresso(calcolate + fallite, len(mancanti))
+        return calcolate, fallite
+
+    def _indice_foto_pronto(self):
+        scaduto = time.monotonic() - _indice_foto.costruito_alle > INDICE_TTL
+        if not _indice_foto.pronto or scaduto:
+            _indice_foto.ricostruisci(self.backend.seleziona("foto_hash"))
+        return _indice_foto
+
+    def _scatole_per_foto(self):
+        """URL foto -> scatola, dallo snapshot dell'inventario."""
+        return {r[c]: r for r in self.visualizza_inventario() for c in CAMPI_FOTO if r.get(c)}
+
+    def _scatole_vicine(self, hash_foto, limite, soglia, escludi_id=None):
+        per_foto = self._scatole_per_foto()
+        indice = self._indice_foto_pronto()
+        trovate = {}
+        for h in hash_foto:
+            # Più candidati del necessario: foto orfane o della stessa scatola vengono scartate
+            for url, distanza in indice.vicini(h, limite * 4 + 4, soglia):
+                scatola = per_foto.get(url)
+                if not scatola or scatola.get("id") == escludi_id:
+                    continue
+                if scatola["id"] not in trovate or distanza < trovate[scatola["id"]][1]:
+                    trovate[scatola["id"]] = (scatola, distanza, url)
+        return sorted(trovate.values(), key=lambda t: t[1])[:limite]
+
+    def scatole_simili(self, file, limite=5, soglia=None):
+        """Scatole con foto simili a quella indicata: [(scatola, distanza, url_foto)].
+
+        Distanza = bit diversi su 64; sotto SOGLIA_DOPPIONE è quasi certamente la stessa scatola."""
+        h = hash_percettivo(file)
+        if h is None:
+            return []
+        try:
+            return self._scatole_vicine([h], limite, soglia)
+        except Exception:
+            return []
+
+    def possibili_doppioni(self, file):
+        return self.scatole_simili(file, limite=3, soglia=SOGLIA_DOPPIONE)
+
+    def scatole_simili_a(self, scatola, limite=5, soglia=None):
+        """Le scatole che somigliano a una già registrata (usa gli hash delle sue foto)."""
+        try:
+            indice = self._indice_foto_pronto()
+            hash_foto = [h for h in (indice.hash_di(scatola.get(c)) for c in CAMPI_FOTO if scatola.get(c)) if h is not None]
+            return self._scatole_vicine(hash_foto, limite, soglia, escludi_id=scatola.get("id"))
+        except Exception:
+            return []
 
     def aggiungi_scatola(self, **kwargs):
         try:
@@ -69,10 +573,11 @@ class InventarioDB:
                 "fondo_testo": kwargs.get("bt"),
                 "fondo_foto": kwargs.get("bf"),
                 "proprietario": kwargs.get("prop"),
-                "ubi": kwargs.get("ubi", "NON ALLOCATA"),
-                "zon": kwargs.get("zona", "DA DEFINIRE")
+                "ubi": kwargs.get("ubi", NON_ALLOCATA),
+                "zon": kwargs.get("zona", ZONA_DA_DEFINIRE)
             }
-            self.supabase.table("inventario").insert(dati).execute()
+            self.backend.inserisci("inventario", dati)
+            self._dati_modificati("inventario")
             return True
         except Exception as e:
             st.error(f"Errore inserimento: {e}")
@@ -92,7 +597,8 @@ class InventarioDB:
             if f_cima: dati["cima_foto"] = f_cima
             if f_cent: dati["centro_foto"] = f_cent
             if f_fond: dati["fondo_foto"] = f_fond
-            self.supabase.table("inventario").update(dati).eq("id", id_scatola).execute()
+            self.backend.aggiorna("inventario", dati, [("id", "eq", id_scatola)])
+            self._dati_modificati("inventario")
             return True
         except Exception as e:
             st.error(f"Errore aggiornamento: {e}")
@@ -100,70 +606,221 @@ class InventarioDB:
 
     # --- FUNZIONE AGGIORNATA PER LO SMART SCAN ---
     def aggiorna_posizione_scatola(self, id_scatola, zona, ubi):
-        """Aggiorna zona e ubicazione di una scatola nel database"""
+        """Aggiorna zona e ubicazione di una scatola nel database (False se la scatola non esiste più)"""
         try:
             # Puliamo i testi per evitare errori di spazi bianchi
             nuova_zona = str(zona).strip()
             nuova_ubi = str(ubi).strip()
             
-            self.supabase.table("inventario").update({
+            righe = self.backend.aggiorna("inventario", {
                 "zon": nuova_zona, 
                 "ubi": nuova_ubi
-            }).eq("id", id_scatola).execute()
+            }, [("id", "eq", id_scatola)])
+            if not righe:
+                st.error(f"Errore DB Spostamento: la scatola {id_scatola} non esiste più")
+                return False
+            self._dati_modificati("inventario")
             return True
         except Exception as e:
             st.error(f"Errore DB Spostamento: {e}")
             return False
 
-    def cerca_scatola(self, termine):
+    def sposta_scatole(self, spostamenti):
+        """Sposta più scatole in una volta: `spostamenti` è una lista di (id_scatola, zona, ubi).
+
+        Le ubicazioni vengono verificate su `posizioni` con una sola query (se
+        la zona è vuota si usa quella dell'ubicazione, "NON ALLOCATA" è sempre
+        ammessa); poi un aggiornamento per destinazione, su `id in (...)`: una
+        scatola eliminata nel frattempo non viene ricreata ma finisce tra gli
+        errori. Restituisce (spostate, errori), errori = lista di messaggi: niente
+        st.error, perché la chiama anche il thread dello stoccaggio continuo."""
+        richiesti = {}
+        for id_scatola, zona, ubi in spostamenti:
+            # Stessa scatola indicata due volte: vale l'ultima destinazione
+            richiesti[int(id_scatola)] = (str(zona or "").strip(), normalizza_codice(ubi))
+        if not richiesti:
+            return 0, []
+        try:
+            codici = sorted({ubi for _, ubi in richiesti.values() if ubi != NON_ALLOCATA})
+            zone = {normalizza_codice(p["id_ubicazione"]): p.get("zona")
+                    for p in (self.backend.seleziona("posizioni", filtri=[("id_ubicazione", "in", codici)]) if codici else [])}
+        except Exception as e:
+            return 0, [f"Errore DB Spostamento: {e}"]
+
+        destinazioni, errori = {}, []
+        for id_scatola, (zona, ubi) in richiesti.items():
+            if ubi != NON_ALLOCATA and ubi not in zone:
+                errori.append(f"Scatola {id_scatola}: ubicazione '{ubi}' non configurata")
+                continue
+            zona_ubi = ZONA_DA_DEFINIRE if ubi == NON_ALLOCATA else zone[ubi]
+            destinazioni.setdefault((zona or zona_ubi or "VARIE", ubi), []).append(id_scatola)
+
+        spostate = set()
+        for (zona, ubi), ids in destinazioni.items():
+            try:
+                righe = self.backend.aggiorna("inventario", {"zon": zona, "ubi": ubi}, [("id", "in", ids)])
+            except Exception as e:
+                errori.extend(f"Scatola {i}: {e}" for i in ids)
+                continue
+            aggiornate = {r["id"] for r in righe or ()}
+            spostate |= aggiornate
+            errori.extend(f"Scatola {i}: non esiste più" for i in ids if i not in aggiornate)
+        if spostate:
+            self._dati_modificati("inventario")
+        return len(spostate), errori
+
+    # --- UBICAZIONI IN GERARCHIA (zona -> corsia -> ripiano, dai codici GAR.1.3) ---
+    def _ubicazioni(self, funzione):
+        """funzione(IndiceUbicazioni) sull'indice dello snapshot, o su uno costruito una volta per versione dei dati."""
+        if self._snapshot_pronto("inventario", "posizioni"):
+            return _snapshot.leggi_ubicazioni(funzione)
+        indice = self.cache.leggi("indice_ubicazioni")
+        if indice is None:
+            versione = versione_dati()
+            inventario, posizioni = self.visualizza_inventario(), self.visualizza_posizioni()
+            indice = IndiceUbicazioni.da_righe(posizioni, inventario)
+            if inventario or posizioni:
+                self.cache.scrivi("indice_ubicazioni", indice, versione)
+        return funzione(indice)
+
+    def zone_magazzino(self):
+        return self._ubicazioni(lambda indice: indice.zone())
+
+    def corsie_zona(self, zona):
+        return self._ubicazioni(lambda indice: indice.corsie(zona))
+
+    def posti_zona(self, zona, corsia=None, ripiano=None):
+        """Ubicazioni di una zona (nome o sigla): codice, corsia, ripiano, capienza, occupati, liberi."""
+        return self._ubicazioni(lambda indice: indice.posti(zona, corsia, ripiano))
+
+    def posti_liberi(self, zona, corsia=None):
+        return self._ubicazioni(lambda indice: indice.posti_liberi(zona, corsia))
+
+    def scatole_in(self, zona, corsia=None, ripiano=None):
+        """Cosa c'è in una zona, corsia o ripiano: [(posto, [righe delle scatole])], per corsia e ripiano."""
+        rami = self._ubicazioni(lambda indice: indice.scatole_in(zona, corsia, ripiano))
+        righe = {r["id"]: r for r in self.leggi_scatole([i for _, scatole in rami for i in scatole])}
+        return [(posto, [righe[i] for i in scatole if i in righe]) for posto, scatole in rami]
+
+    def cerca_scatola(self, termine, limite=None):
+        """Ricerca a testo libero su tutti i campi (anche i testi degli strati).
+
+        Usa l'indice locale: accenti ignorati, prefissi ('cacc' trova 'cacciavite'),
+        risultati ordinati per rilevanza. Nessuna query per ogni ricerca."""
         try:
-            filtro = f"nome.ilike.%{termine}%,descrizione.ilike.%{termine}%,proprietario.ilike.%{termine}%"
-            res = self.supabase.table("inventario").select("*").or_(filtro).execute()
-            return res.data
+            return self._indice_pronto().cerca(termine, limite)
         except:
             return []
 
     def elimina_scatola(self, id_scatola):
         try:
-            self.supabase.table("inventario").delete().eq("id", id_scatola).execute()
+            self.backend.elimina("inventario", [("id", "eq", id_scatola)])
+            self._dati_modificati("inventario")
             return True
         except:
             return False
 
-    def aggiungi_posizione(self, id_u, zona):
+    def aggiungi_posizione(self, id_u, zona, capienza=None):
         try:
-            self.supabase.table("posizioni").upsert({"id_ubicazione": id_u, "zona": zona}).execute()
+            riga = {"id_ubicazione": id_u, "zona": zona}
+            if capienza and capienza != CAPIENZA_PREDEFINITA:
+                riga["capienza"] = int(capienza)  # la colonna serve solo a chi la usa (sql/ubicazioni.sql)
+            self.backend.upsert("posizioni", riga)
+            self._dati_modificati("posizioni")
             return True
         except:
             return False
 
+    # --- IMPORTAZIONE MASSIVA (file letti a blocchi, upsert per blocco) ---
+    def _importa(self, blocchi, scrivi, tabella, progresso=None):
+        """Scrive i blocchi con `scrivi`; restituisce un EsitoImport (None se il file è illeggibile)."""
+        try:
+            return importa_a_blocchi(blocchi, scrivi, progresso=progresso)
+        except Exception as e:
+            st.error(f"Errore lettura file: {e}")
+            return None
+        finally:
+            # Anche un import interrotto può aver già scritto qualche blocco
+            self._dati_modificati(tabella)
+
+    def _scrivi_posizioni(self, righe):
+        self.backend.upsert("posizioni", righe, on_conflict="id_ubicazione")
+
+    def _nomi_scatole(self):
+        """Nome normalizzato (maiuscolo, senza spazi ai lati) -> id, letto una volta per import."""
+        nomi = {}
+        for righe in self.pagine_inventario(("id", "nome")):
+            for r in righe:
+                nomi.setdefault(normalizza_codice(r.get("nome")), r["id"])  # nomi doppi: vale la prima scatola
+        return nomi
+
+    def _scrivi_scatole(self, righe, gia_presenti):
+        """Le scatole con un nome già presente (anche in un blocco precedente) vengono aggiornate,
+        le altre inserite. `gia_presenti` (nome normalizzato -> id) si aggiorna con quelle inserite."""
+        nuove, modificate = [], {}
+        for r in righe:
+            id_scatola = gia_presenti.get(normalizza_codice(r["nome"]))
+            if id_scatola is not None:
+                # Una cella vuota non cancella quanto già salvato (ubicazione compresa);
+                # il nome resta scritto come nel database, solo maiuscole e minuscole potevano differire
+                piene = {c: v for c, v in r.items() if c != "nome" and v is not None and v != ""}
+                riga = dict(piene, id=id_scatola)
+                # Un upsert per ogni insieme di colonne: in blocco tutte le righe devono avere gli stessi campi
+                modificate.setdefault(tuple(sorted(riga)), []).append(riga)
+            else:
+                nuove.append(dict(r, zon=r.get("zon") or ZONA_DA_DEFINIRE, ubi=r.get("ubi") or NON_ALLOCATA))
+        for gruppo in modificate.values():
+            self.backend.upsert("inventario", gruppo, on_conflict="id")
+        if nuove:
+            for r in self.backend.inserisci("inventario", nuove) or ():
+                gia_presenti.setdefault(normalizza_codice(r.get("nome")), r.get("id"))
+
+    def importa_posizioni(self, file, dimensione_blocco=DIMENSIONE_BLOCCO, progresso=None):
+        """Importa ubicazioni da .xlsx/.csv senza caricare tutto il file in memoria."""
+        blocchi = (in_righe(normalizza_posizioni(df)) for df in leggi_blocchi(file, dimensione_blocco))
+        return self._importa(blocchi, self._scrivi_posizioni, "posizioni", progresso)
+
+    def importa_scatole(self, file, dimensione_blocco=DIMENSIONE_BLOCCO, progresso=None):
+        """Importa scatole da .xlsx/.csv; il nome (maiuscole e minuscole non contano) fa da chiave
+        per riconoscere quelle già presenti, anche ripetute in blocchi diversi del file."""
+        try:
+            gia_presenti = self._nomi_scatole()
+        except Exception as e:
+            st.error(f"Errore lettura inventario: {e}")
+            return None
+        blocchi = (in_righe(normalizza_scatole(df)) for df in leggi_blocchi(file, dimensione_blocco))
+        return self._importa(blocchi, lambda righe: self._scrivi_scatole(righe, gia_presenti), "inventario", progresso)
+
     def import_posizioni_da_df(self, df):
         try:
-            df.columns = [str(c).lower().strip() for c in df.columns]
-            df = df.rename(columns={'id scaffale': 'id_ubicazione', 'id': 'id_ubicazione', 'zona': 'zona'})
-            lista_finale = []
-            for _, r in df.iterrows():
-                lista_finale.append({
-                    "id_ubicazione": str(r['id_ubicazione']).strip().upper(),
-                    "zona": str(r['zona']).strip()
-                })
-            self.supabase.table("posizioni").upsert(lista_finale, on_conflict="id_ubicazione").execute()
-            return True, len(lista_finale)
+            righe = in_righe(normalizza_posizioni(df))
+            blocchi = (righe[i:i + DIMENSIONE_BLOCCO] for i in range(0, len(righe), DIMENSIONE_BLOCCO))
+            esito = self._importa(blocchi, self._scrivi_posizioni, "posizioni")
+            return esito is not None and not esito.errori, esito.righe if esito else 0
         except Exception as e:
             st.error(f"Errore tecnico import: {e}")
             return False, 0
 
     def reset_totale_inventario(self):
         try:
-            self.supabase.table("inventario").delete().neq("id", -1).execute()
+            self.backend.svuota("inventario")
+            self._dati_modificati("inventario")
             return True
         except:
             return False
 
     def reset_totale_posizioni(self):
         try:
-            self.supabase.table("posizioni").delete().neq("id_ubicazione", "NONE_XYZ").execute()
+            self.backend.svuota("posizioni")
+            self._dati_modificati("posizioni")
             return True
         except:
             return False
-        
\ No newline at end of file
+
+
+# --- ISTANZA DI PROCESSO (thread in background) ---
+@st.cache_resource(show_spinner=False)
+def db_condiviso():
+    """InventarioDB non legato a una sessione, con una cache sua: per i thread che
+    sopravvivono ai rerun (es. il salvataggio dello stoccaggio continuo)."""
+    return InventarioDB(cache=CacheDati(ttl=CACHE_TTL))
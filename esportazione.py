@@ -0,0 +1,80 @@
+import csv
+import io
+
+import xlsxwriter
+
+from backend import COLONNE
+from cache_dati import CacheDati, versione_dati
+
+# --- FORMATI DISPONIBILI: estensione -> (etichetta, tipo MIME) ---
+FORMATI = {
+    "xlsx": ("Excel", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "csv": ("CSV", "text/csv"),
+    "parquet": ("Parquet", "application/vnd.apache.parquet"),
+}
+TTL_EXPORT = 60  # secondi: oltre, l'export si rifà anche senza scritture locali (modifiche da altri dispositivi)
+
+# File già pronti, condivisi da tutte le sessioni; scartati a ogni cambio di versione dei dati
+_cache_export = CacheDati(ttl=TTL_EXPORT)
+
+
+def _valore(v):
+    # xlsxwriter e csv non accettano dict/list (es. colonne JSON di Supabase)
+    return v if v is None or isinstance(v, (str, int, float, bool)) else str(v)
+
+
+def scrivi_xlsx(pagine, colonne):
+    """Workbook in modalità constant_memory: ogni riga va su disco appena scritta."""
+    uscita = io.BytesIO()
+    wb = xlsxwriter.Workbook(uscita, {"constant_memory": True})
+    ws = wb.add_worksheet("Inventario")
+    ws.write_row(0, 0, colonne)
+    n = 1
+    for righe in pagine:
+        for r in righe:
+            ws.write_row(n, 0, [_valore(r.get(c)) for c in colonne])
+            n += 1
+    wb.close()
+    return uscita.getvalue()
+
+
+def scrivi_csv(pagine, colonne):
+    """CSV separato da ';' con BOM, come lo apre Excel in italiano."""
+    uscita = io.StringIO()
+    scrittore = csv.writer(uscita, delimiter=";")
+    scrittore.writerow(colonne)
+    for righe in pagine:
+        scrittore.writerows([_valore(r.get(c)) for c in colonne] for r in righe)
+    return uscita.getvalue().encode("utf-8-sig")
+
+
+def scrivi_parquet(pagine, colonne):
+    """Parquet con un row group per pagina; id intero, tutto il resto testo."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = pa.schema([(c, pa.int64() if c == "id" else pa.string()) for c in colonne])
+    uscita = io.BytesIO()
+    with pq.ParquetWriter(uscita, schema) as scrittore:
+        for righe in pagine:
+            if not righe:
+                continue
+            dati = {c: [r.get(c) if c == "id" or r.get(c) is None else str(r.get(c)) for r in righe]
+                    for c in colonne}
+            scrittore.write_table(pa.table(dati, schema=schema))
+    return uscita.getvalue()
+
+
+SCRITTORI = {"xlsx": scrivi_xlsx, "csv": scrivi_csv, "parquet": scrivi_parquet}
+
+
+def esporta(pagine, formato, tabella="inventario"):
+    """File dell'export nel formato richiesto, rifatto solo se la versione dei dati è cambiata.
+
+    `pagine` è un iterabile di liste di righe, consumato solo in caso di cache miss."""
+    chiave = f"{tabella}.{formato}"
+    dati = _cache_export.leggi(chiave)
+    if dati is None:
+        versione = versione_dati()  # prima di leggere le pagine, come per le altre cache
+        dati = SCRITTORI[formato](pagine, list(COLONNE[tabella]))
+        _cache_export.scrivi(chiave, dati, versione)
+    return dati
@@ -0,0 +1,67 @@
+import io
+from datetime import datetime
+from functools import lru_cache
+
+from fpdf import FPDF
+from qrcode import QRCode
+
+# --- IMPAGINAZIONE (millimetri, foglio A4) ---
+SCATOLE_PER_PAGINA = 2
+Y_SCATOLE = (10, 145)          # etichetta sopra e sotto
+COLONNE_UBI, RIGHE_UBI = 4, 4  # 16 ubicazioni per foglio
+CELLA_UBI = (48, 68)           # spazio per cella (larghezza, altezza)
+
+
+@lru_cache(maxsize=4096)
+def qr_png(codice, box_size=5):
+    """PNG del QR per un codice, generato in memoria e riusato tra una stampa e l'altra."""
+    qr = QRCode(box_size=box_size)
+    qr.add_data(codice)
+    qr.make()
+    buffer = io.BytesIO()
+    qr.make_image().save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _pdf_in_bytes(pdf):
+    return bytes(pdf.output())
+
+
+def pdf_etichette_scatole(scatole):
+    """PDF con 2 etichette scatola per foglio A4 (proprietario, nome, data e QR del nome)."""
+    pdf = FPDF()
+    for idx, s in enumerate(scatole):
+        pos = idx % SCATOLE_PER_PAGINA
+        if pos == 0:
+            pdf.add_page()
+        y_start = Y_SCATOLE[pos]
+        nome_e = str(s.get('nome', 'N/A'))
+        prop_e = str(s.get('proprietario', 'N/A')).upper()
+        data_e = str(s.get('data_inserimento') or datetime.now().strftime("%d/%m/%Y"))
+
+        pdf.rect(10, y_start, 190, 125)
+        pdf.set_font("Helvetica", 'B', 40); pdf.set_xy(15, y_start + 15); pdf.cell(110, 20, prop_e)
+        pdf.set_font("Helvetica", 'B', 25); pdf.set_xy(15, y_start + 45); pdf.multi_cell(110, 12, nome_e)
+        pdf.set_font("Helvetica", '', 10); pdf.set_xy(15, y_start + 115); pdf.cell(100, 10, f"Data: {data_e}")
+        pdf.image(io.BytesIO(qr_png(nome_e, 5)), x=125, y=y_start + 25, w=60)
+    return _pdf_in_bytes(pdf)
+
+
+def pdf_etichette_ubicazioni(posizioni):
+    """PDF con 16 etichette ubicazione per foglio A4 (griglia 4x4: QR, codice e zona)."""
+    pdf = FPDF()
+    per_pagina = COLONNE_UBI * RIGHE_UBI
+    w_area, h_area = CELLA_UBI
+    for idx, p in enumerate(posizioni):
+        cella = idx % per_pagina
+        if cella == 0:
+            pdf.add_page()
+        x_off = 10 + (cella % COLONNE_UBI) * w_area
+        y_off = 10 + (cella // COLONNE_UBI) * h_area
+
+        codice_u = str(p.get('id_ubicazione') or p.get('id'))
+        pdf.rect(x_off, y_off, 42, 60)
+        pdf.image(io.BytesIO(qr_png(codice_u, 2)), x_off + 6, y_off + 5, w=30)
+        pdf.set_font("Helvetica", 'B', 12); pdf.set_xy(x_off, y_off + 38); pdf.cell(42, 10, codice_u, align='C')
+        pdf.set_font("Helvetica", '', 7); pdf.set_xy(x_off, y_off + 48); pdf.cell(42, 5, str(p.get('zona')).upper(), align='C')
+    return _pdf_in_bytes(pdf)
@@ -0,0 +1,332 @@
+import asyncio
+import heapq
+import logging
+import threading
+import time
+from collections import Counter, namedtuple
+
+from backend import CHIAVI
+from ubicazioni import IndiceUbicazioni, NON_ALLOCATA
+
+logger = logging.getLogger(__name__)
+
+# --- PARAMETRI ---
+TABELLE = ("inventario", "posizioni")  # tabelle tenute nello snapshot condiviso
+ORDINE = {"inventario": "id", "posizioni": "zona"}  # stesso ordine delle letture di InventarioDB
+ULTIME = 5  # scatole più recenti mostrate in Home
+
+# tipo: INSERT, UPDATE (anche upsert: se la riga manca viene aggiunta), DELETE,
+# RESET (la tabella va riletta per intero, es. dopo uno svuota o eventi persi).
+# locale: scrittura fatta da questo processo (chi l'ha fatta ha già invalidato le
+# cache); gli eventi di Realtime o di altri processi arrivano con locale=False
+Evento = namedtuple("Evento", "tabella tipo riga locale", defaults=(False,))
+
+
+def _codice(ubi):
+    return str(ubi or "").strip().upper()
+
+
+# --- PUBLISH/SUBSCRIBE NEL PROCESSO ---
+class BusModifiche:
+    """Canale degli eventi di riga: chi scrive pubblica, snapshot e indici si iscrivono.
+
+    Con SQLite e replica è l'unica sorgente (tutte le scritture passano dal
+    processo); con Supabase si aggiungono gli eventi di Realtime."""
+
+    def __init__(self):
+        self._iscritti = []
+        self._lock = threading.Lock()
+
+    def iscrivi(self, funzione):
+        with self._lock:
+            self._iscritti.append(funzione)
+
+    def pubblica(self, eventi):
+        eventi = list(eventi)
+        if not eventi:
+            return
+        with self._lock:
+            iscritti = list(self._iscritti)
+        for funzione in iscritti:
+            try:
+                funzione(eventi)
+            except Exception as e:
+                logger.warning("Evento di modifica non applicato: %s", e)
+
+
+class BackendConFlusso:
+    """Proxy del backend: ogni scrittura riuscita diventa eventi di riga sul bus."""
+
+    def __init__(self, backend, bus):
+        self._backend = backend
+        self._bus = bus
+
+    def __getattr__(self, nome):
+        return getattr(self._backend, nome)
+
+    def _pubblica(self, tabella, tipo, righe):
+        if isinstance(righe, dict):
+            righe = [righe]
+        self._bus.pubblica(Evento(tabella, tipo, r, True) for r in righe or ())
+
+    def inserisci(self, tabella, righe):
+        inserite = self._backend.inserisci(tabella, righe)
+        self._pubblica(tabella, "INSERT", inserite)
+        return inserite
+
+    def aggiorna(self, tabella, dati, filtri):
+        righe = self._backend.aggiorna(tabella, dati, filtri)
+        self._pubblica(tabella, "UPDATE", righe)
+        return righe
+
+    def upsert(self, tabella, righe, on_conflict=None):
+        scritte = self._backend.upsert(tabella, righe, on_conflict)
+        self._pubblica(tabella, "UPDATE", scritte)
+        return scritte
+
+    def elimina(self, tabella, filtri):
+        chiave = CHIAVI[tabella]
+        chiavi = self._chiavi(tabella, filtri)
+        esito = self._backend.elimina(tabella, filtri)
+        # Supabase restituisce le righe eliminate, SQLite solo quante sono
+        righe = esito if isinstance(esito, list) else [{chiave: k} for k in chiavi]
+        self._pubblica(tabella, "DELETE", righe)
+        return esito
+
+    def svuota(self, tabella):
+        esito = self._backend.svuota(tabella)
+        self._bus.pubblica([Evento(tabella, "RESET", {}, True)])
+        return esito
+
+    def _chiavi(self, tabella, filtri):
+        """Chiavi delle righe che un filtro colpisce: dai filtri stessi se sono sulla chiave."""
+        chiave = CHIAVI[tabella]
+        if filtri and all(c == chiave and op in ("eq", "in") for c, op, _ in filtri):
+            insiemi = [set(v) if op == "in" else {v} for _, op, v in filtri]
+            return set.intersection(*insiemi)
+        return [r[chiave] for r in self._backend.seleziona(tabella, chiave, filtri)]
+
+
+def con_flusso(backend, bus):
+    return BackendConFlusso(backend, bus)
+
+
+# --- SNAPSHOT CONDIVISO ---
+class SnapshotCondiviso:
+    """Le tabelle in memoria, una copia per processo, aggiornate riga per riga dagli eventi.
+
+    Oltre alle righe tiene i contatori della Home (per proprietario, per zona,
+    da allocare) e l'indice delle ubicazioni con le loro scatole: un evento li
+    sposta di una unità invece di ricalcolarli da tutta la tabella."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.completo = False  # True se ogni modifica, anche di altri processi, arriva come evento
+        self.generazione = 0   # cresce a ogni evento: una lettura iniziata prima è da scartare
+        self.ubicazioni = IndiceUbicazioni()  # da interrogare con leggi_ubicazioni()
+        self.invalida()
+
+    def invalida(self, *tabelle):
+        """Le tabelle (tutte, se nessuna) vanno rilette dal database."""
+        with self._lock:
+            self.generazione += 1
+            for tabella in tabelle or TABELLE:
+                self._svuota(tabella)
+
+    def _svuota(self, tabella):
+        if tabella == "inventario":
+            self._per_proprietario = Counter()
+            self._per_zona = Counter()
+            self._da_allocare = 0
+            self.ubicazioni.svuota_scatole()
+        else:
+            self._zone = Counter()  # zona -> ubicazioni
+            self.ubicazioni.svuota_posizioni()
+        setattr(self, f"_righe_{tabella}", None)
+        setattr(self, f"_lista_{tabella}", None)
+        setattr(self, f"_caricata_{tabella}", 0.0)
+
+    def pronta(self, tabella, ttl=None):
+        caricata = getattr(self, f"_caricata_{tabella}")
+        if getattr(self, f"_righe_{tabella}") is None:
+            return False
+        return ttl is None or time.monotonic() - caricata < ttl
+
+    def carica(self, tabella, righe, generazione):
+        """Adotta le righe lette dal database se nel frattempo non sono arrivati eventi."""
+        chiave = CHIAVI[tabella]
+        with self._lock:
+            if generazione != self.generazione:
+                return False
+            self._svuota(tabella)
+            setattr(self, f"_righe_{tabella}", {})
+            for r in righe:
+                self._metti(tabella, r[chiave], r)
+            setattr(self, f"_caricata_{tabella}", time.monotonic())
+            return True
+
+    def applica(self, eventi):
+        """Applica gli eventi; restituisce gli eventi con la riga completa dopo la modifica."""
+        applicati = []
+        eventi = [ev for ev in eventi if ev.tabella in TABELLE]
+        if not eventi:
+            return applicati
+        with self._lock:
+            self.generazione += 1
+            for ev in eventi:
+                if ev.tipo == "RESET":
+                    self._svuota(ev.tabella)
+                    applicati.append(ev)
+                    continue
+                chiave = ev.riga.get(CHIAVI[ev.tabella])
+                if chiave is None:
+                    continue
+                righe = getattr(self, f"_righe_{ev.tabella}")
+                vecchia = righe.get(chiave) if righe is not None else None
+                if ev.tipo == "DELETE":
+                    if righe is not None:
+                        self._togli(ev.tabella, chiave)
+                    applicati.append(ev._replace(riga=vecchia or ev.riga))
+                    continue
+                # Gli upsert parziali (es. solo zon e ubi) si fondono con la riga che c'era
+                nuova = {**vecchia, **ev.riga} if vecchia else dict(ev.riga)
+                if righe is not None:
+                    self._togli(ev.tabella, chiave)
+                    self._metti(ev.tabella, chiave, nuova)
+                applicati.append(ev._replace(riga=nuova))
+        return applicati
+
+    # --- contributi di una riga ai contatori ---
+    def _metti(self, tabella, chiave, riga):
+        getattr(self, f"_righe_{tabella}")[chiave] = riga
+        setattr(self, f"_lista_{tabella}", None)
+        if tabella == "posizioni":
+            if riga.get("zona"):
+                self._zone[riga["zona"]] += 1
+            self.ubicazioni.metti_posizione(riga)
+            return
+        if riga.get("proprietario") is not None:
+            self._per_proprietario[riga["proprietario"]] += 1
+        if riga.get("zon") is not None:
+            self._per_zona[riga["zon"]] += 1
+        if _codice(riga.get("ubi")) in ("", NON_ALLOCATA):
+            self._da_allocare += 1
+        self.ubicazioni.metti_scatola(chiave, riga)
+
+    def _togli(self, tabella, chiave):
+        riga = getattr(self, f"_righe_{tabella}").pop(chiave, None)
+        if riga is None:
+            return
+        setattr(self, f"_lista_{tabella}", None)
+        if tabella == "posizioni":
+            if riga.get("zona"):
+                self._zone[riga["zona"]] -= 1
+                if self._zone[riga["zona"]] <= 0:
+                    del self._zone[riga["zona"]]
+            self.ubicazioni.togli_posizione(riga)
+            return
+        for contatore, campo in ((self._per_proprietario, "proprietario"), (self._per_zona, "zon")):
+            valore = riga.get(campo)
+            if valore is not None:
+                contatore[valore] -= 1
+                if contatore[valore] <= 0:
+                    del contatore[valore]
+        if _codice(riga.get("ubi")) in ("", NON_ALLOCATA):
+            self._da_allocare -= 1
+        self.ubicazioni.togli_scatola(chiave, riga)
+
+    # --- letture ---
+    def righe(self, tabella):
+        """Lista delle righe nell'ordine di sempre, rifatta solo dopo una modifica."""
+        with self._lock:
+            lista = getattr(self, f"_lista_{tabella}")
+            if lista is None:
+                campo = ORDINE[tabella]
+                lista = sorted(getattr(self, f"_righe_{tabella}").values(),
+                               key=lambda r: (r.get(campo) is None, r.get(campo)))
+                setattr(self, f"_lista_{tabella}", lista)
+            return lista
+
+    def statistiche(self):
+        """Stessi aggregati di InventarioDB.statistiche_magazzino, dai contatori."""
+        with self._lock:
+            righe = self._righe_inventario
+            ultime = heapq.nlargest(ULTIME, righe)
+            return {
+                "scatole": len(righe),
+                "zone": len(self._zone),
+                "ubicazioni": len(self._righe_posizioni),
+                "da_allocare": self._da_allocare,
+                "per_proprietario": dict(self._per_proprietario.most_common()),
+                "per_zona": dict(self._per_zona.most_common()),
+                "ultime": [{c: righe[i].get(c) for c in ("id", "nome", "zon", "ubi", "proprietario")}
+                           for i in reversed(ultime)],
+            }
+
+    def occupazione(self):
+        with self._lock:
+            return self.ubicazioni.occupazione()
+
+    def righe_per_chiave(self, tabella, chiavi):
+        """Le righe con quelle chiavi, nell'ordine dato (senza scorrere la tabella)."""
+        with self._lock:
+            righe = getattr(self, f"_righe_{tabella}")
+            return [righe[k] for k in chiavi if k in righe]
+
+    def leggi_ubicazioni(self, funzione):
+        """Esegue funzione(indice) sotto il lock: l'indice non cambia a metà lettura."""
+        with self._lock:
+            return funzione(self.ubicazioni)
+
+
+# --- SUPABASE REALTIME ---
+class AscoltatoreRealtime(threading.Thread):
+    """Thread con un proprio event loop: riceve le modifiche di Postgres da Supabase
+    Realtime e le pubblica sul bus, come se le avesse scritte questo processo.
+
+    Le tabelle devono essere nella publication `supabase_realtime` (sql/realtime.sql).
+    A ogni (ri)connessione lo snapshot viene riletto: gli eventi persi mentre il
+    canale era giù non arriveranno più."""
+
+    def __init__(self, url, key, bus, snapshot, tabelle=TABELLE):
+        super().__init__(name="ascoltatore_realtime", daemon=True)
+        self.url = url
+        self.key = key
+        self.bus = bus
+        self.snapshot = snapshot
+        self.tabelle = tabelle
+        self.ultimo_errore = None
+
+    def run(self):
+        try:
+            asyncio.run(self._ascolta())
+        except Exception as e:
+            self.ultimo_errore = str(e)
+            self.snapshot.completo = False
+            logger.warning("Realtime non disponibile, si torna alle riletture periodiche: %s", e)
+
+    async def _ascolta(self):
+        from supabase import acreate_client
+        client = await acreate_client(self.url, self.key)
+        canale = client.channel("vhd_modifiche")
+        for tabella in self.tabelle:
+            canale.on_postgres_changes("*", schema="public", table=tabella, callback=self._ricevi)
+        await canale.subscribe(self._stato)
+        await asyncio.Event().wait()  # il client ascolta in un task suo: qui si resta in vita
+
+    def _stato(self, stato, errore=None):
+        stato = getattr(stato, "value", stato)
+        if stato == "SUBSCRIBED":
+            self.ultimo_errore = None
+            self.bus.pubblica(Evento(t, "RESET", {}) for t in self.tabelle)
+            self.snapshot.completo = True
+        else:
+            self.ultimo_errore = str(errore or stato)
+            self.snapshot.completo = False
+
+    def _ricevi(self, payload):
+        dati = payload.get("data", payload)
+        tipo = getattr(dati.get("type"), "value", dati.get("type"))
+        # Nelle DELETE arriva solo old_record, con la chiave primaria
+        riga = dati.get("old_record") if tipo == "DELETE" else dati.get("record")
+        self.bus.pubblica([Evento(dati.get("table"), str(tipo), riga or {})])
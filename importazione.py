@@ -0,0 +1,153 @@
+import logging
+import time
+from collections import namedtuple
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# --- PARAMETRI ---
+DIMENSIONE_BLOCCO = 500  # righe per upsert
+TENTATIVI = 3
+ATTESA_RIPROVA = 1.0     # secondi, raddoppia a ogni tentativo
+
+# Nomi di colonna accettati nei file -> colonne delle tabelle
+ALIAS_POSIZIONI = {"id scaffale": "id_ubicazione", "id": "id_ubicazione", "id_ubicazione": "id_ubicazione",
+                   "ubicazione": "id_ubicazione", "zona": "zona", "capienza": "capienza", "posti": "capienza"}
+ALIAS_SCATOLE = {"nome": "nome", "codice": "nome", "descrizione": "descrizione", "proprietario": "proprietario",
+                 "cima": "cima_testo", "cima_testo": "cima_testo", "centro": "centro_testo",
+                 "centro_testo": "centro_testo", "fondo": "fondo_testo", "fondo_testo": "fondo_testo",
+                 "zona": "zon", "zon": "zon", "ubicazione": "ubi", "ubi": "ubi"}
+
+EsitoImport = namedtuple("EsitoImport", "righe blocchi_ok blocchi_falliti errori")
+
+
+# --- LETTURA A BLOCCHI ---
+def leggi_blocchi(file, dimensione=DIMENSIONE_BLOCCO):
+    """Legge un .xlsx o .csv un blocco di righe alla volta (DataFrame), senza caricarlo tutto.
+
+    Per gli xlsx usa openpyxl in sola lettura: le righe arrivano in streaming."""
+    nome = str(getattr(file, "name", file)).lower()
+    if hasattr(file, "seek"):
+        file.seek(0)
+    if nome.endswith(".csv"):
+        # sep=None: riconosce da solo ',' o ';' (Excel italiano salva con ';')
+        yield from pd.read_csv(file, chunksize=dimensione, dtype=str, sep=None, engine="python")
+        return
+    from openpyxl import load_workbook
+    wb = load_workbook(file, read_only=True, data_only=True)
+    try:
+        righe = wb.active.iter_rows(values_only=True)
+        intestazione = [str(c) if c is not None else f"colonna_{i}" for i, c in enumerate(next(righe, ()))]
+        blocco = []
+        for r in righe:
+            blocco.append(r)
+            if len(blocco) == dimensione:
+                yield pd.DataFrame(blocco, columns=intestazione)
+                blocco = []
+        if blocco:
+            yield pd.DataFrame(blocco, columns=intestazione)
+    finally:
+        wb.close()
+
+
+def conta_righe(file):
+    """Numero (stimato) di righe dati, per la barra di avanzamento; None se non ricavabile.
+
+    Per gli xlsx legge la dimensione dichiarata nel foglio, senza scorrere le righe."""
+    nome = str(getattr(file, "name", file)).lower()
+    try:
+        file.seek(0)
+        if nome.endswith(".csv"):
+            righe = sum(blocco.count(b"\n") for blocco in iter(lambda: file.read(1 << 20), b""))
+            return max(righe - 1, 0)
+        from openpyxl import load_workbook
+        wb = load_workbook(file, read_only=True)
+        try:
+            return max((wb.active.max_row or 1) - 1, 0) or None
+        finally:
+            wb.close()
+    except Exception:
+        return None
+    finally:
+        file.seek(0)
+
+
+def anteprima(file, n=10):
+    """Prime n righe del file, per mostrarle prima di importare."""
+    for blocco in leggi_blocchi(file, n):
+        return blocco
+    return pd.DataFrame()
+
+
+# --- NORMALIZZAZIONE (vettoriale, su tutto il blocco) ---
+def _rinomina(df, alias):
+    df = df.rename(columns=lambda c: str(c).lower().strip())
+    return df.rename(columns={c: alias[c] for c in df.columns if c in alias})
+
+
+def _testo(serie):
+    return serie.astype("string").str.strip()
+
+
+def normalizza_posizioni(df):
+    df = _rinomina(df, ALIAS_POSIZIONI)
+    if "id_ubicazione" not in df or "zona" not in df:
+        raise ValueError("Servono le colonne 'id' e 'zona'")
+    out = pd.DataFrame({
+        "id_ubicazione": _testo(df["id_ubicazione"]).str.upper(),
+        "zona": _testo(df["zona"]).fillna(""),
+    })
+    if "capienza" in df:
+        # Facoltativa: scatole per ripiano, vuota = valore predefinito
+        out["capienza"] = pd.to_numeric(df["capienza"], errors="coerce").astype("Int64")
+    out = out[out["id_ubicazione"].notna() & (out["id_ubicazione"] != "")]
+    # Nello stesso upsert un ID non può comparire due volte: vale l'ultima riga del file
+    return out.drop_duplicates("id_ubicazione", keep="last")
+
+
+def normalizza_scatole(df):
+    df = _rinomina(df, ALIAS_SCATOLE)
+    if "nome" not in df:
+        raise ValueError("Serve almeno la colonna 'nome'")
+    out = pd.DataFrame({c: _testo(df[c]) for c in set(ALIAS_SCATOLE.values()) if c in df})
+    out = out[out["nome"].notna() & (out["nome"] != "")]
+    if "ubi" in out:
+        out["ubi"] = out["ubi"].str.upper()
+    out = out.assign(_codice=out["nome"].str.upper()).drop_duplicates("_codice", keep="last")
+    return out.drop(columns="_codice")
+
+
+def in_righe(df):
+    """DataFrame -> lista di dict, con None al posto dei valori mancanti."""
+    return df.astype(object).where(df.notna(), None).to_dict("records")
+
+
+# --- SCRITTURA A BLOCCHI ---
+def importa_a_blocchi(blocchi, scrivi, tentativi=TENTATIVI, progresso=None):
+    """Passa ogni blocco (lista di dict) a `scrivi`, riprovando i blocchi falliti.
+
+    Un blocco che fallisce dopo tutti i tentativi non ferma gli altri: viene
+    riportato in `errori`. `progresso(righe_fatte, blocchi_fatti)` è chiamato
+    dopo ogni blocco (per la barra di avanzamento)."""
+    righe_ok = blocchi_ok = blocchi_ko = 0
+    errori = []
+    for n, blocco in enumerate(blocchi, start=1):
+        if not blocco:
+            continue
+        for t in range(1, tentativi + 1):
+            try:
+                scrivi(blocco)
+                righe_ok += len(blocco)
+                blocchi_ok += 1
+                break
+            except Exception as e:
+                logger.warning("Blocco %d fallito (tentativo %d/%d): %s", n, t, tentativi, e)
+                if t == tentativi:
+                    blocchi_ko += 1
+                    errori.append(f"Blocco {n} ({len(blocco)} righe): {e}")
+                else:
+                    time.sleep(ATTESA_RIPROVA * 2 ** (t - 1))
+        if progresso:
+            progresso(righe_ok, n)
+    return EsitoImport(righe_ok, blocchi_ok, blocchi_ko, errori)
@@ -0,0 +1,108 @@
+import threading
+import time
+
+import cv2
+import numpy as np
+
+# --- PARAMETRI ---
+LATO_DCT = 32           # l'immagine viene ridotta a 32x32 in scala di grigi
+LATO_HASH = 8           # dei coefficienti DCT si tengono gli 8x8 a bassa frequenza -> 64 bit
+SOGLIA_DOPPIONE = 10    # bit diversi (su 64) sotto cui due foto sono "la stessa scatola"
+_MEZZO = 1 << 63
+
+
+def hash_percettivo(file):
+    """pHash a 64 bit di una foto (file o bytes), None se non è un'immagine leggibile.
+
+    Foto ridimensionate, ricompresse o leggermente diverse hanno hash vicini:
+    la distanza di Hamming misura quanto si somigliano."""
+    try:
+        if hasattr(file, "read"):
+            file.seek(0)
+            dati = file.read()
+            file.seek(0)
+        else:
+            dati = file
+        img = cv2.imdecode(np.frombuffer(dati, np.uint8), cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            return None
+        piccola = cv2.resize(img, (LATO_DCT, LATO_DCT), interpolation=cv2.INTER_AREA).astype(np.float32)
+        basse = cv2.dct(piccola)[:LATO_HASH, :LATO_HASH].flatten()
+        bit = basse > np.median(basse)
+        return int.from_bytes(np.packbits(bit).tobytes(), "big")
+    except Exception:
+        return None
+
+
+def in_firmato(h):
+    """64 bit senza segno -> intero con segno (bigint di Postgres, INTEGER di SQLite)."""
+    return h - (1 << 64) if h >= _MEZZO else h
+
+
+def distanze(hash_archivio, h):
+    """Distanza di Hamming di `h` da ogni hash dell'array (uint64), in un'unica passata."""
+    diversi = np.bitwise_xor(hash_archivio, np.uint64(h & ((1 << 64) - 1)))
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(diversi).astype(np.int64)
+    return np.unpackbits(diversi.view(np.uint8)).reshape(-1, 64).sum(axis=1)
+
+
+class IndiceFoto:
+    """Gli hash di tutte le foto in un array NumPy, con gli URL nella stessa posizione."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.svuota()
+
+    def svuota(self):
+        with self._lock:
+            self._hash = np.empty(0, dtype=np.uint64)
+            self._url = []
+            self._posizione = {}
+            self.pronto = False
+            self.costruito_alle = 0.0
+
+    def ricostruisci(self, righe):
+        """Righe della tabella foto_hash: {'url': ..., 'hash': intero con segno}."""
+        righe = [r for r in righe if r.get("url") and r.get("hash") is not None]
+        with self._lock:
+            self._hash = np.array([r["hash"] for r in righe], dtype=np.int64).view(np.uint64)
+            self._url = [r["url"] for r in righe]
+            self._posizione = {u: i for i, u in enumerate(self._url)}
+            self.pronto = True
+            self.costruito_alle = time.monotonic()
+
+    def aggiungi(self, url, h):
+        valore = np.array([in_firmato(h)], dtype=np.int64).view(np.uint64)
+        with self._lock:
+            i = self._posizione.get(url)
+            if i is not None:
+                self._hash[i] = valore[0]
+                return
+            self._posizione[url] = len(self._url)
+            self._url.append(url)
+            self._hash = np.concatenate([self._hash, valore])
+
+    def vicini(self, h, limite=5, soglia=None, escludi=()):
+        """[(url, distanza)] delle foto più simili, dalla più vicina."""
+        with self._lock:
+            if not self._url:
+                return []
+            d = distanze(self._hash, h)
+            ordine = np.argsort(d, kind="stable")
+            url = self._url
+        risultati = []
+        for i in ordine:
+            if soglia is not None and d[i] > soglia:
+                break
+            if url[i] in escludi:
+                continue
+            risultati.append((url[i], int(d[i])))
+            if len(risultati) == limite:
+                break
+        return risultati
+
+    def hash_di(self, url):
+        with self._lock:
+            i = self._posizione.get(url)
+            return None if i is None else int(self._hash[i])
@@ -0,0 +1,76 @@
+import html
+
+import pandas as pd
+
+from ubicazioni import CAPIENZA_PREDEFINITA, NON_ALLOCATA
+
+# --- COLORI MAPPA ---
+COLORE_PIENA = "#FF4B4B"     # rosso: ubicazione piena
+COLORE_PARZIALE = "#FFA500"  # arancione: occupata ma con posti ancora liberi
+COLORE_LIBERA = "#28A745"    # verde: ubicazione libera
+
+
+def _codici(serie):
+    return serie.fillna("").astype(str).str.strip().str.upper()
+
+
+def calcola_occupazione(inventario, posizioni):
+    """Unisce posizioni e inventario (posizioni.id_ubicazione = inventario.ubi) con un solo merge.
+
+    Restituisce un DataFrame con una riga per ubicazione, nell'ordine di
+    `posizioni`: codice, zona, capienza, n_scatole, contenuto (nomi separati da ' / ')."""
+    pos = pd.DataFrame(posizioni)
+    if pos.empty:
+        return pd.DataFrame(columns=["codice", "zona", "capienza", "n_scatole", "contenuto"])
+    if "id_ubicazione" in pos:
+        id_col = pos["id_ubicazione"].fillna(pos["id"]) if "id" in pos else pos["id_ubicazione"]
+    else:
+        id_col = pos.get("id", pd.Series(index=pos.index, dtype=object))
+    mappa = pd.DataFrame({
+        "codice": _codici(id_col).replace("", "N/D"),
+        "zona": pos["zona"].fillna("N/D").astype(str) if "zona" in pos else "N/D",
+        "capienza": (pd.to_numeric(pos["capienza"], errors="coerce").fillna(CAPIENZA_PREDEFINITA).astype(int)
+                     if "capienza" in pos else CAPIENZA_PREDEFINITA),
+    })
+
+    inv = pd.DataFrame(inventario)
+    if inv.empty or "ubi" not in inv:
+        occupanti = pd.DataFrame(columns=["codice", "n_scatole", "contenuto"])
+    else:
+        nomi = inv["nome"] if "nome" in inv else pd.Series(index=inv.index, dtype=object)
+        inv = inv.assign(codice=_codici(inv["ubi"]), nome=nomi.fillna("Senza Nome").astype(str))
+        inv = inv[(inv["codice"] != "") & (inv["codice"] != NON_ALLOCATA)]
+        occupanti = inv.groupby("codice", sort=False).agg(
+            n_scatole=("nome", "size"), contenuto=("nome", " / ".join)).reset_index()
+
+    mappa = mappa.merge(occupanti, on="codice", how="left")
+    mappa["n_scatole"] = mappa["n_scatole"].fillna(0).astype(int)
+    mappa["contenuto"] = mappa["contenuto"].fillna("Libera")
+    return mappa
+
+
+def html_mappa(mappa):
+    """Tutta la griglia in un unico blocco HTML, divisa per zona (un solo elemento Streamlit)."""
+    blocchi = []
+    for zona, gruppo in mappa.groupby("zona", sort=False):
+        celle = []
+        for codice, n, capienza, contenuto in zip(gruppo["codice"], gruppo["n_scatole"], gruppo["capienza"],
+                                                  gruppo["contenuto"]):
+            piena = n > 0
+            colore = COLORE_LIBERA if not piena else COLORE_PIENA if n >= capienza else COLORE_PARZIALE
+            icona = "📦" if piena else "✅"
+            # Il tooltip (attributo title) mostra codice, posti occupati e contenuto
+            titolo = html.escape(f"Ubicazione: {codice} ({n}/{capienza})\nContenuto: {contenuto}").replace("\n", "&#10;")
+            celle.append(
+                f'<div title="{titolo}" style="background-color:{colore}; padding:5px; border-radius:3px; '
+                f'text-align:center; line-height:1.2; min-height:45px; border:1px solid rgba(255,255,255,0.2); cursor:help;">'
+                f'<span style="color:white !important; font-size:8px;">{icona}</span><br>'
+                f'<span style="color:white !important; font-weight:bold; font-size:7px;">{html.escape(codice)}</span></div>'
+            )
+        occupate = int((gruppo["n_scatole"] > 0).sum())
+        blocchi.append(
+            f'<p style="margin:10px 0 4px 0; font-weight:bold;">📍 {html.escape(zona)} '
+            f'<span style="font-weight:normal; font-size:0.8rem;">({occupate}/{len(gruppo)} occupate)</span></p>'
+            f'<div style="display:grid; grid-template-columns:repeat(12, 1fr); gap:4px;">{"".join(celle)}</div>'
+        )
+    return "".join(blocchi)
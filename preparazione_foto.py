@@ -0,0 +1,65 @@
+import io
+import logging
+
+from PIL import Image, ImageOps
+
+import strumentazione
+
+logger = logging.getLogger(__name__)
+
+# --- PARAMETRI (valori pensati per foto da telefono viste su telefono) ---
+LATO_MASSIMO = 1600   # pixel sul lato più lungo
+QUALITA = 80          # qualità JPEG/WebP
+FORMATO = "JPEG"      # oppure "WEBP"
+
+
+def _su_fondo_bianco(img):
+    """RGB per il JPEG: le parti trasparenti (PNG, GIF) diventano bianche, non nere."""
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        img = img.convert("RGBA")
+        fondo = Image.new("RGB", img.size, (255, 255, 255))
+        fondo.paste(img, mask=img.getchannel("A"))
+        return fondo
+    return img if img.mode in ("RGB", "L") else img.convert("RGB")
+
+
+def _copia(file, dati, nome=None):
+    uscita = io.BytesIO(dati)
+    uscita.name = nome or getattr(file, "name", "foto")
+    return uscita
+
+
+@strumentazione.misurata("upload", "prepara_foto", conta=lambda f: (1, f.getbuffer().nbytes if isinstance(f, io.BytesIO) else None))
+def prepara_foto(file, lato_massimo=LATO_MASSIMO, qualita=QUALITA, formato=FORMATO):
+    """Ridimensiona e ricomprime una foto prima dell'upload.
+
+    Applica la rotazione indicata dall'EXIF e poi lo elimina (posizione GPS
+    compresa). Restituisce un BytesIO pronto per l'uploader, con l'attributo
+    `byte_risparmiati`. Se il risultato non è più piccolo dell'originale (foto
+    piccole o già ottimizzate) si carica l'originale; se il file non è
+    un'immagine leggibile restituisce il file com'è."""
+    try:
+        file.seek(0)
+        originale = file.read()
+        with Image.open(io.BytesIO(originale)) as img:
+            img = _su_fondo_bianco(ImageOps.exif_transpose(img))
+            img.thumbnail((lato_massimo, lato_massimo), Image.LANCZOS)
+            uscita = io.BytesIO()
+            # Nessun parametro exif: l'immagine salvata non porta metadati
+            img.save(uscita, format=formato, quality=qualita, optimize=True)
+    except Exception as e:
+        logger.warning("Foto non ricompressa, verrà caricata com'è: %s", e)
+        file.seek(0)
+        return file
+    prima, dopo = len(originale), uscita.tell()
+    if dopo >= prima:
+        logger.debug("Foto già compatta (%d byte, ricompressa %d): caricata com'è", prima, dopo)
+        uscita = _copia(file, originale)
+        uscita.byte_risparmiati = 0
+        return uscita
+    logger.debug("Foto ridotta da %d a %d byte (risparmiati %d, %.0f%%)",
+                 prima, dopo, prima - dopo, 100 * (prima - dopo) / prima)
+    uscita = _copia(file, uscita.getvalue(),
+                    f"{getattr(file, 'name', 'foto').rsplit('.', 1)[0]}.{formato.lower().replace('jpeg', 'jpg')}")
+    uscita.byte_risparmiati = prima - dopo
+    return uscita
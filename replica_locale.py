@@ -0,0 +1,342 @@
+import json
+import logging
+import threading
+import time
+
+from backend import BackendSQLite, CHIAVI
+
+logger = logging.getLogger(__name__)
+
+# --- PARAMETRI ---
+TABELLE_REPLICATE = ("inventario", "posizioni")  # riallineate dal cloud a ogni giro
+# foto_hash esiste solo se è stato eseguito sql/foto_hash.sql, e cambia soltanto
+# quando si caricano foto: basta riallinearla di rado, e se manca si va avanti
+TABELLE_FACOLTATIVE = ("foto_hash",)
+INTERVALLO_FACOLTATIVE = 900  # secondi
+
+SCHEMA_JOURNAL = """
+CREATE TABLE IF NOT EXISTS journal (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    tabella TEXT NOT NULL,
+    operazione TEXT NOT NULL,
+    dati TEXT,
+    filtri TEXT,
+    opzioni TEXT,
+    creato_il REAL NOT NULL,
+    tentativi INTEGER NOT NULL DEFAULT 0,
+    errore TEXT
+);
+CREATE TABLE IF NOT EXISTS conflitti (
+    seq INTEGER PRIMARY KEY,
+    tabella TEXT, operazione TEXT, dati TEXT, filtri TEXT,
+    motivo TEXT, registrato_il REAL
+);
+"""
+
+
+class ConflittoSync(Exception):
+    """Modifica locale che il cloud non può più accettare (es. riga eliminata altrove)."""
+
+
+def tabella_mancante(errore):
+    """La tabella non esiste nel cloud (42P01 da Postgres, PGRST205 da PostgREST)."""
+    return str(getattr(errore, "code", "") or "") in ("42P01", "PGRST205")
+
+
+def conflitto_definitivo(errore):
+    """Errori del cloud per cui ritentare non serve: vincoli violati (classe SQL 23,
+    es. 23505 duplicato, 23503 chiave esterna) o conflitto HTTP 409. Tutto il resto
+    (rete, timeout, 5xx, permessi, limiti) è transitorio e la voce resta in coda."""
+    if isinstance(errore, ConflittoSync):
+        return True
+    codice = str(getattr(errore, "code", "") or "")
+    return codice == "409" or codice.startswith("23")
+
+
+# --- REPLICA CON JOURNAL ---
+class ReplicaLocale(BackendSQLite):
+    """Archivio SQLite che registra ogni scrittura in un journal da inviare al cloud.
+
+    Dato e voce di journal vengono scritti nella stessa transazione; le scatole
+    create offline ricevono un id negativo provvisorio, sostituito da quello
+    vero di Supabase quando l'inserimento viene sincronizzato."""
+
+    def __init__(self, percorso):
+        super().__init__(percorso)
+        with self._lock:
+            self._conn.executescript(SCHEMA_JOURNAL)
+        self.sincronizzatore = None
+        self.al_cambio = []  # funzioni chiamate quando i dati cambiano per effetto del cloud
+
+    def _annota(self, conn, tabella, operazione, dati=None, filtri=None, opzioni=None):
+        conn.execute(
+            "INSERT INTO journal (tabella, operazione, dati, filtri, opzioni, creato_il) VALUES (?, ?, ?, ?, ?, ?)",
+            (tabella, operazione, json.dumps(dati), json.dumps(filtri), json.dumps(opzioni), time.time()))
+
+    def _dopo_scrittura(self):
+        if self.sincronizzatore:
+            self.sincronizzatore.sveglia()
+
+    def inserisci(self, tabella, righe):
+        righe = self._righe_valide(tabella, righe)
+        chiave = CHIAVI[tabella]
+        with self._transazione() as conn:
+            inserite = []
+            for r in righe:
+                if tabella == "inventario" and r.get(chiave) is None:
+                    minimo = conn.execute("SELECT MIN(id) FROM inventario").fetchone()[0] or 0
+                    r = dict(r, id=min(minimo, 0) - 1)  # id provvisorio
+                    payload = {c: v for c, v in r.items() if c != chiave}
+                else:
+                    payload = r
+                inserite.extend(self._inserisci_righe(conn, tabella, [r]))
+                self._annota(conn, tabella, "insert", payload, [[chiave, "eq", r.get(chiave)]])
+        self._dopo_scrittura()
+        return inserite
+
+    def aggiorna(self, tabella, dati, filtri):
+        with self._transazione() as conn:
+            righe = super().aggiorna(tabella, dati, filtri)
+            if righe:
+                self._annota(conn, tabella, "update", self._righe_valide(tabella, dati)[0], filtri)
+        self._dopo_scrittura()
+        return righe
+
+    def elimina(self, tabella, filtri):
+        with self._transazione() as conn:
+            n = super().elimina(tabella, filtri)
+            if n:
+                # Nessuna riga colpita in locale: nulla da cancellare nemmeno nel cloud
+                self._annota(conn, tabella, "delete", None, filtri)
+        self._dopo_scrittura()
+        return n
+
+    def upsert(self, tabella, righe, on_conflict=None):
+        with self._transazione() as conn:
+            righe = super().upsert(tabella, righe, on_conflict)
+            if righe:
+                self._annota(conn, tabella, "upsert", righe, None, on_conflict)
+        self._dopo_scrittura()
+        return righe
+
+    def svuota(self, tabella):
+        with self._transazione() as conn:
+            super().svuota(tabella)
+            # Le modifiche ancora in coda per questa tabella non servono più
+            conn.execute("DELETE FROM journal WHERE tabella = ?", (tabella,))
+            self._annota(conn, tabella, "svuota")
+        self._dopo_scrittura()
+
+    # --- journal ---
+    def prossima_voce(self):
+        with self._lock:
+            r = self._conn.execute("SELECT * FROM journal ORDER BY seq LIMIT 1").fetchone()
+            return dict(r) if r else None
+
+    def completa_voce(self, voce, riga_remota=None):
+        """Toglie la voce dal journal; per gli inserimenti adotta l'id assegnato dal cloud."""
+        with self._transazione() as conn:
+            conn.execute("DELETE FROM journal WHERE seq = ?", (voce["seq"],))
+            if voce["operazione"] != "insert" or voce["tabella"] != "inventario" or not riga_remota:
+                return None
+            provvisorio = json.loads(voce["filtri"])[0][2]
+            definitivo = riga_remota["id"]
+            if provvisorio == definitivo:
+                return None
+            conn.execute("DELETE FROM inventario WHERE id = ?", (definitivo,))
+            conn.execute("UPDATE inventario SET id = ? WHERE id = ?", (definitivo, provvisorio))
+            # Le modifiche successive alla stessa scatola puntano ora all'id definitivo
+            for seq, operazione, dati, filtri in conn.execute(
+                    "SELECT seq, operazione, dati, filtri FROM journal WHERE tabella = 'inventario'").fetchall():
+                lista = json.loads(filtri) or []
+                nuova = [[c, op, (definitivo if c == "id" and v == provvisorio else
+                                  [definitivo if x == provvisorio else x for x in v] if op == "in" else v)]
+                         for c, op, v in lista]
+                if nuova != lista:
+                    conn.execute("UPDATE journal SET filtri = ? WHERE seq = ?", (json.dumps(nuova), seq))
+                if operazione == "upsert":
+                    # Gli upsert in blocco (spostamenti, import) portano l'id dentro le righe
+                    righe = json.loads(dati) or []
+                    nuove = [dict(r, id=definitivo) if r.get("id") == provvisorio else r for r in righe]
+                    if nuove != righe:
+                        conn.execute("UPDATE journal SET dati = ? WHERE seq = ?", (json.dumps(nuove), seq))
+        return provvisorio, definitivo
+
+    def segna_errore(self, voce, errore):
+        with self._transazione() as conn:
+            conn.execute("UPDATE journal SET tentativi = tentativi + 1, errore = ? WHERE seq = ?",
+                         (str(errore), voce["seq"]))
+
+    def scarta_voce(self, voce, motivo):
+        """La voce non è applicabile nel cloud: la spostiamo tra i conflitti e andiamo avanti."""
+        with self._transazione() as conn:
+            conn.execute("DELETE FROM journal WHERE seq = ?", (voce["seq"],))
+            conn.execute(
+                "INSERT OR REPLACE INTO conflitti (seq, tabella, operazione, dati, filtri, motivo, registrato_il) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (voce["seq"], voce["tabella"], voce["operazione"], voce["dati"], voce["filtri"], str(motivo), time.time()))
+        logger.warning("Modifica locale scartata (%s %s): %s", voce["operazione"], voce["tabella"], motivo)
+
+    def sostituisci_se_allineata(self, tabella, righe):
+        """Applica lo stato del cloud solo se nel frattempo non ci sono nuove modifiche locali."""
+        with self._transazione() as conn:
+            if conn.execute("SELECT COUNT(*) FROM journal").fetchone()[0]:
+                return False
+            return self.sostituisci(tabella, righe)
+
+    def notifica_cambio(self):
+        for funzione in self.al_cambio:
+            try:
+                funzione()
+            except Exception as e:
+                logger.warning("Notifica cambio dati fallita: %s", e)
+
+    def sveglia(self):
+        # Giro di sincronizzazione immediato, ma nel suo thread: il rerun non lo aspetta.
+        # L'esito è quello dell'ultimo giro concluso
+        if not self.sincronizzatore:
+            return False, "Offline"
+        self.sincronizzatore.sveglia()
+        ok = self.sincronizzatore.ultimo_errore is None
+        return ok, "Online" if ok else "Offline"
+
+    def stato(self):
+        with self._lock:
+            in_attesa = self._conn.execute("SELECT COUNT(*), MIN(creato_il), MAX(errore) FROM journal").fetchone()
+            conflitti = self._conn.execute("SELECT COUNT(*) FROM conflitti").fetchone()[0]
+        sinc = self.sincronizzatore
+        return {
+            "in_attesa": in_attesa[0],
+            "piu_vecchia": in_attesa[1],
+            "ultimo_errore": sinc.ultimo_errore if sinc else in_attesa[2],
+            "ultima_sincronizzazione": sinc.ultima_sincronizzazione if sinc else None,
+            "conflitti": conflitti,
+        }
+
+
+# --- SINCRONIZZAZIONE IN BACKGROUND ---
+class SincronizzatoreCloud(threading.Thread):
+    """Thread che invia il journal a Supabase e poi riallinea la replica con il cloud.
+
+    Conflitti: le modifiche inviano solo i campi cambiati (modifiche diverse
+    sulla stessa scatola si sommano, sullo stesso campo vince l'ultima); un
+    aggiornamento di una riga eliminata altrove viene scartato e registrato
+    nella tabella `conflitti`. Finché il journal non è vuoto i dati locali
+    hanno la precedenza e la replica non viene sovrascritta."""
+
+    def __init__(self, replica, remoto, intervallo=30, intervallo_massimo=300):
+        super().__init__(name="sincronizzatore_cloud", daemon=True)
+        self.replica = replica
+        self.remoto = remoto  # BackendSupabase
+        self.intervallo = intervallo
+        self.intervallo_massimo = intervallo_massimo
+        self.ultimo_errore = None
+        self.ultima_sincronizzazione = None
+        self.primo_allineamento = threading.Event()
+        self._sveglia = threading.Event()
+        self._giro = threading.Lock()
+        self._facoltative_alle = {}  # tabella -> istante dell'ultimo riallineamento
+
+    def sveglia(self):
+        self._sveglia.set()
+
+    def run(self):
+        attesa = self.intervallo
+        while True:
+            ok = self.sincronizza()
+            attesa = self.intervallo if ok else min(attesa * 2, self.intervallo_massimo)
+            self._sveglia.wait(attesa)
+            self._sveglia.clear()
+
+    def sincronizza(self):
+        """Un giro completo: invio del journal e, se riuscito, scaricamento dal cloud."""
+        with self._giro:
+            try:
+                cambiato = self._invia_journal()
+                for tabella in TABELLE_REPLICATE:
+                    cambiato = self.replica.sostituisci_se_allineata(tabella, self._scarica(tabella)) or cambiato
+                for tabella in TABELLE_FACOLTATIVE:
+                    cambiato = self._riallinea_facoltativa(tabella) or cambiato
+                self.ultimo_errore = None
+                self.ultima_sincronizzazione = time.time()
+                ok = True
+            except Exception as e:
+                self.ultimo_errore = str(e)
+                logger.info("Cloud non raggiungibile, si riprova più tardi: %s", e)
+                cambiato, ok = False, False
+            self.primo_allineamento.set()
+        if cambiato:
+            self.replica.notifica_cambio()
+        return ok
+
+    def _invia_journal(self):
+        cambiato = False
+        # Una voce alla volta, riletta ogni giro: un inserimento sincronizzato
+        # può cambiare l'id a cui puntano le voci successive
+        while (voce := self.replica.prossima_voce()) is not None:
+            try:
+                righe = self._esegui_remoto(voce)
+            except Exception as e:
+                if voce["tabella"] in TABELLE_FACOLTATIVE and tabella_mancante(e):
+                    # Senza la tabella nel cloud la voce non passerà mai: non blocca le altre
+                    self.replica.scarta_voce(voce, e)
+                    continue
+                if not conflitto_definitivo(e):
+                    # Ritentata al prossimo giro, con l'attesa che raddoppia
+                    self.replica.segna_errore(voce, e)
+                    raise
+                self.replica.scarta_voce(voce, e)
+                cambiato = True
+                continue
+            if self.replica.completa_voce(voce, righe[0] if righe else None):
+                cambiato = True
+        return cambiato
+
+    def _riallinea_facoltativa(self, tabella):
+        if time.monotonic() - self._facoltative_alle.get(tabella, float("-inf")) < INTERVALLO_FACOLTATIVE:
+            return False
+        try:
+            righe = self._scarica(tabella)
+        except Exception as e:
+            if not tabella_mancante(e):
+                raise
+            logger.info("Tabella %s assente nel cloud, non viene replicata: %s", tabella, e)
+            self._facoltative_alle[tabella] = time.monotonic()
+            return False
+        cambiato = self.replica.sostituisci_se_allineata(tabella, righe)
+        if not self.replica.stato()["in_attesa"]:
+            # Con modifiche locali in coda la sostituzione è rimandata al prossimo giro
+            self._facoltative_alle[tabella] = time.monotonic()
+        return cambiato
+
+    def _esegui_remoto(self, voce):
+        tabella = voce["tabella"]
+        dati = json.loads(voce["dati"]) if voce["dati"] else None
+        filtri = json.loads(voce["filtri"]) if voce["filtri"] else None
+        operazione = voce["operazione"]
+        if operazione == "insert":
+            return self.remoto.inserisci(tabella, dati)
+        if operazione == "update":
+            righe = self.remoto.aggiorna(tabella, dati, filtri)
+            if not righe:
+                raise ConflittoSync("riga non più presente nel cloud")
+            return righe
+        if operazione == "delete":
+            return self.remoto.elimina(tabella, filtri)
+        if operazione == "upsert":
+            return self.remoto.upsert(tabella, dati, json.loads(voce["opzioni"]) if voce["opzioni"] else None)
+        if operazione == "svuota":
+            return self.remoto.svuota(tabella)
+        raise ConflittoSync(f"operazione sconosciuta: {operazione}")
+
+    def _scarica(self, tabella, pagina=1000):
+        """Tutte le righe della tabella dal cloud, a pagine ordinate per chiave."""
+        chiave = CHIAVI[tabella]
+        righe, ultimo = [], None
+        while True:
+            filtri = [(chiave, "gt", ultimo)] if ultimo is not None else []
+            blocco = self.remoto.seleziona(tabella, filtri=filtri, ordine=chiave, limite=pagina)
+            righe.extend(blocco)
+            if len(blocco) < pagina:
+                return righe
+            ultimo = blocco[-1][chiave]
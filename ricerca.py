@@ -0,0 +1,161 @@
+import bisect
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+
+# --- CAMPI INDICIZZATI E PESI ---
+# Il nome e il proprietario contano più del contenuto dei singoli strati.
+PESI_CAMPI = {
+    "nome": 3.0,
+    "proprietario": 2.0,
+    "descrizione": 1.0,
+    "cima_testo": 1.0,
+    "centro_testo": 1.0,
+    "fondo_testo": 1.0,
+    "zon": 1.0,
+    "ubi": 1.0,
+}
+
+# Parole troppo comuni per distinguere una scatola dall'altra
+PAROLE_VUOTE = {
+    "a", "ad", "al", "alla", "alle", "con", "da", "dal", "dalla", "dei", "del", "della",
+    "delle", "di", "e", "ed", "gli", "i", "il", "in", "la", "le", "lo", "nel", "nella",
+    "per", "su", "sul", "sulla", "tra", "un", "una", "uno",
+}
+
+# Parametri BM25 (valori standard)
+K1 = 1.2
+B = 0.75
+PESO_PREFISSO = 0.7  # una parola trovata solo come prefisso vale un po' meno
+
+_RE_PAROLE = re.compile(r"[a-z0-9]+")
+
+
+def piega_testo(testo):
+    """Minuscole e senza accenti: 'Perché Città' -> 'perche citta'."""
+    testo = unicodedata.normalize("NFKD", str(testo or ""))
+    return "".join(c for c in testo if not unicodedata.combining(c)).lower()
+
+
+def parole(testo):
+    return [p for p in _RE_PAROLE.findall(piega_testo(testo)) if p not in PAROLE_VUOTE]
+
+
+class IndiceRicerca:
+    """Indice invertito in memoria sui campi di testo di `inventario`.
+
+    Si costruisce una volta dallo snapshot e poi si aggiorna riga per riga
+    (aggiungi/aggiorna/rimuovi), così la ricerca non tocca mai la rete."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.svuota()
+
+    def svuota(self):
+        with self._lock:
+            self._postings = defaultdict(dict)  # parola -> {id scatola: frequenza pesata}
+            self._vocabolario = []              # parole ordinate, per i prefissi con bisect
+            self._lunghezze = {}                # id -> lunghezza pesata del documento
+            self._parole_doc = {}               # id -> parole del documento (per rimuoverlo)
+            self._documenti = {}                # id -> riga originale
+            self._lunghezza_totale = 0.0
+            self.costruito_alle = time.monotonic()
+            self.pronto = False
+
+    def ricostruisci(self, righe):
+        with self._lock:
+            self.svuota()
+            for r in righe:
+                self._aggiungi(r)
+            self.pronto = True
+
+    def aggiungi(self, riga):
+        with self._lock:
+            self._rimuovi(riga.get("id"))
+            self._aggiungi(riga)
+
+    aggiorna = aggiungi
+
+    def rimuovi(self, id_scatola):
+        with self._lock:
+            self._rimuovi(id_scatola)
+
+    def __len__(self):
+        return len(self._documenti)
+
+    def _aggiungi(self, riga):
+        id_s = riga.get("id")
+        if id_s is None:
+            return
+        frequenze = defaultdict(float)
+        for campo, peso in PESI_CAMPI.items():
+            for p in parole(riga.get(campo)):
+                frequenze[p] += peso
+        for p, f in frequenze.items():
+            if p not in self._postings:
+                bisect.insort(self._vocabolario, p)
+            self._postings[p][id_s] = f
+        lunghezza = sum(frequenze.values())
+        self._lunghezze[id_s] = lunghezza
+        self._lunghezza_totale += lunghezza
+        self._parole_doc[id_s] = list(frequenze)
+        self._documenti[id_s] = riga
+
+    def _rimuovi(self, id_s):
+        if id_s not in self._documenti:
+            return
+        for p in self._parole_doc.pop(id_s):
+            docs = self._postings.get(p)
+            if docs is None:
+                continue
+            docs.pop(id_s, None)
+            if not docs:
+                del self._postings[p]
+                i = bisect.bisect_left(self._vocabolario, p)
+                if i < len(self._vocabolario) and self._vocabolario[i] == p:
+                    del self._vocabolario[i]
+        self._lunghezza_totale -= self._lunghezze.pop(id_s)
+        del self._documenti[id_s]
+
+    def _espandi(self, termine):
+        """Parole dell'indice che iniziano con `termine` (ricerca binaria sul vocabolario)."""
+        i = bisect.bisect_left(self._vocabolario, termine)
+        trovate = []
+        while i < len(self._vocabolario) and self._vocabolario[i].startswith(termine):
+            trovate.append(self._vocabolario[i])
+            i += 1
+        return trovate
+
+    def cerca(self, testo, limite=None):
+        """Righe che contengono TUTTE le parole cercate (anche come prefisso), ordinate per rilevanza."""
+        termini = parole(testo)
+        if not termini:
+            return []
+        with self._lock:
+            n_doc = len(self._documenti)
+            if not n_doc:
+                return []
+            media = self._lunghezza_totale / n_doc or 1.0
+            punteggi = None
+            for termine in termini:
+                parziali = defaultdict(float)
+                for p in self._espandi(termine):
+                    docs = self._postings[p]
+                    idf = math.log(1 + (n_doc - len(docs) + 0.5) / (len(docs) + 0.5))
+                    fattore = 1.0 if p == termine else PESO_PREFISSO
+                    for id_s, f in docs.items():
+                        norma = K1 * (1 - B + B * self._lunghezze[id_s] / media)
+                        parziali[id_s] = max(parziali[id_s], fattore * idf * f * (K1 + 1) / (f + norma))
+                if punteggi is None:
+                    punteggi = parziali
+                else:
+                    punteggi = {i: v + parziali[i] for i, v in punteggi.items() if i in parziali}
+                if not punteggi:
+                    return []
+            ordinati = sorted(punteggi, key=lambda i: (-punteggi[i], i))
+            if limite:
+                ordinati = ordinati[:limite]
+            return [self._documenti[i] for i in ordinati]
@@ -0,0 +1,8 @@
+-- Impronte percettive delle foto (eseguire una volta dall'SQL editor di Supabase)
+-- Una riga per foto: l'URL Cloudinary e il pHash a 64 bit (bigint con segno).
+-- La scatola a cui appartiene la foto si ricava dalle colonne *_foto di inventario.
+
+create table if not exists foto_hash (
+  url text primary key,
+  hash bigint not null
+);
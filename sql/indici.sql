@@ -0,0 +1,4 @@
+-- Indici Supabase per le ricerche dell'app (eseguire una volta dall'SQL editor)
+
+-- Scanner QR / Alloca-Sposta: trova_per_codice filtra per uguaglianza su nome
+create index if not exists inventario_nome_idx on inventario (nome);
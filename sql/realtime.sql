@@ -0,0 +1,6 @@
+-- Flusso delle modifiche (eseguire una volta dall'SQL editor di Supabase)
+-- Le scritture su inventario e posizioni arrivano all'app come eventi di riga
+-- (flusso_modifiche.AscoltatoreRealtime) e aggiornano lo snapshot in memoria.
+-- Senza questa publication l'app funziona lo stesso, rileggendo le tabelle ogni minuto.
+
+alter publication supabase_realtime add table inventario, posizioni;
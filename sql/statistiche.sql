@@ -0,0 +1,27 @@
+-- Aggregati per la Home (eseguire una volta dall'SQL editor di Supabase)
+-- L'app li legge con db.statistiche_magazzino(): pochi numeri invece di tutto l'inventario.
+
+create or replace function statistiche_magazzino()
+returns json
+language sql
+stable
+as $$
+  select json_build_object(
+    'scatole', (select count(*) from inventario),
+    'zone', (select count(distinct zona) from posizioni where coalesce(zona, '') <> ''),
+    'ubicazioni', (select count(*) from posizioni),
+    'da_allocare', (select count(*) from inventario
+                    where upper(trim(coalesce(ubi, ''))) in ('', 'NON ALLOCATA')),
+    'per_proprietario', coalesce((select json_object_agg(proprietario, n order by n desc)
+                                  from (select proprietario, count(*) as n from inventario
+                                        where proprietario is not null group by proprietario) t), '{}'::json),
+    'per_zona', coalesce((select json_object_agg(zon, n order by n desc)
+                          from (select zon, count(*) as n from inventario
+                                where zon is not null group by zon) t), '{}'::json),
+    'ultime', coalesce((select json_agg(t order by t.id)
+                        from (select id, nome, zon, ubi, proprietario from inventario
+                              order by id desc limit 5) t), '[]'::json)
+  );
+$$;
+
+grant execute on function statistiche_magazzino() to anon, authenticated;
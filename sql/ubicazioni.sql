@@ -0,0 +1,5 @@
+-- Capienza delle ubicazioni (eseguire una volta dall'SQL editor di Supabase)
+-- Quante scatole stanno su ogni ripiano; vuota = 1, come nella mappa della Home.
+-- La gerarchia zona/corsia/ripiano si ricava dal codice (GAR.1.3) in ubicazioni.py.
+
+alter table posizioni add column if not exists capienza integer check (capienza > 0);
@@ -0,0 +1,105 @@
+import queue
+import threading
+from datetime import datetime
+
+# --- PARAMETRI ---
+LOTTO_MASSIMO = 50   # spostamenti salvati insieme se il salvataggio resta indietro
+ATTESA_INATTIVO = 30  # secondi senza lavoro prima che il thread si fermi
+VOCI_REGISTRO = 200   # voci tenute nel registro della sessione
+
+
+class SessioneStoccaggio:
+    """Sessione di stoccaggio continuo: scatola, ubicazione, scatola, ubicazione...
+
+    Ogni coppia confermata va in coda e viene salvata da un thread in
+    background con `sposta` (InventarioDB.sposta_scatole): l'operatore può
+    scansionare la scatola successiva senza aspettare il database. Se il
+    salvataggio resta indietro, gli spostamenti in coda partono in un unico lotto."""
+
+    def __init__(self, sposta):
+        self._sposta = sposta
+        self.scatola = None         # scatola scansionata, in attesa dell'ubicazione
+        self.ultimo_codice = None   # lo scanner ripete l'ultimo valore a ogni rerun
+        self.registro = []          # voci: ora, id, nome, ubi, stato ("in coda", "salvato", "errore"), errore
+        self._coda = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def attende(self):
+        return "ubicazione" if self.scatola else "scatola"
+
+    def codice_nuovo(self, codice):
+        """True se il codice non è quello appena letto (lo stesso QR davanti alla camera)."""
+        codice = str(codice or "").strip()
+        if not codice or codice == self.ultimo_codice:
+            return False
+        self.ultimo_codice = codice
+        return True
+
+    def scegli_scatola(self, scatola):
+        self.scatola = scatola
+
+    def conferma(self, ubi):
+        """Mette in coda lo spostamento della scatola scelta e torna in attesa di una scatola."""
+        voce = {"ora": datetime.now().strftime("%H:%M:%S"), "id": self.scatola.get("id"),
+                "nome": self.scatola.get("nome"), "ubi": ubi, "stato": "in coda", "errore": None}
+        with self._lock:
+            self.registro.append(voce)
+            del self.registro[:-VOCI_REGISTRO]
+        self.scatola = None
+        self._accoda(voce)
+        return voce
+
+    def riprova_errori(self):
+        with self._lock:
+            falliti = [v for v in self.registro if v["stato"] == "errore"]
+            for v in falliti:
+                v["stato"], v["errore"] = "in coda", None
+        for v in falliti:
+            self._accoda(v)
+        return len(falliti)
+
+    def in_coda(self):
+        with self._lock:
+            return sum(v["stato"] == "in coda" for v in self.registro)
+
+    def voci(self):
+        """Copia del registro, le più recenti per prime."""
+        with self._lock:
+            return [dict(v) for v in reversed(self.registro)]
+
+    # --- salvataggio in background ---
+    def _accoda(self, voce):
+        self._coda.put(voce)
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._lavora, name="stoccaggio", daemon=True)
+                self._thread.start()
+
+    def _lavora(self):
+        while True:
+            try:
+                lotto = [self._coda.get(timeout=ATTESA_INATTIVO)]
+            except queue.Empty:
+                return
+            while len(lotto) < LOTTO_MASSIMO:
+                try:
+                    lotto.append(self._coda.get_nowait())
+                except queue.Empty:
+                    break
+            self._salva(lotto)
+
+    def _salva(self, lotto):
+        try:
+            _, errori = self._sposta([(v["id"], None, v["ubi"]) for v in lotto])
+        except Exception as e:
+            errori = [str(e)]
+        with self._lock:
+            for v in lotto:
+                # sposta_scatole riporta gli errori come "Scatola <id>: motivo"
+                propri = [e for e in errori if e.startswith(f"Scatola {v['id']}:")]
+                generali = [e for e in errori if not e.startswith("Scatola ")]
+                problema = propri or generali
+                v["stato"] = "errore" if problema else "salvato"
+                v["errore"] = "; ".join(problema) or None
@@ -0,0 +1,243 @@
+import contextvars
+import functools
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+import pandas as pd
+
+from configurazione import attivo
+
+logger = logging.getLogger(__name__)
+
+# Letta una volta all'import (STRUMENTAZIONE nei secrets o VHD_STRUMENTAZIONE): da
+# spenta, decoratori e proxy restituiscono le funzioni e gli oggetti originali,
+# senza alcun costo a ogni chiamata.
+ATTIVA = attivo("STRUMENTAZIONE")
+MISURE_MASSIME = 20000  # misure tenute in memoria (le più vecchie escono)
+
+_misure = deque(maxlen=MISURE_MASSIME)
+_lock = threading.Lock()
+_reruns = {}  # sessione -> numero dell'ultimo rerun
+_aperti = {}  # sessione -> contesto del rerun iniziato e non ancora chiuso
+_ultima = {}  # sessione -> istante (perf_counter) dell'ultima misura registrata
+# Rerun in corso (sessione, numero, pagina, inizio) e profondità delle chiamate annidate
+_contesto = contextvars.ContextVar("contesto_strumentazione", default=None)
+_profondita = contextvars.ContextVar("profondita_strumentazione", default=0)
+
+
+# --- RACCOLTA ---
+def _dimensione(risultato):
+    """(righe, byte) di un risultato: liste di righe, coppie (righe, cursore), bytes, dict."""
+    if isinstance(risultato, tuple) and risultato and isinstance(risultato[0], list):
+        risultato = risultato[0]
+    if isinstance(risultato, (bytes, bytearray)):
+        return None, len(risultato)
+    if isinstance(risultato, (list, dict)):
+        try:
+            byte = len(json.dumps(risultato, default=str))
+        except Exception:
+            byte = None
+        return (len(risultato) if isinstance(risultato, list) else 1), byte
+    return None, None
+
+
+def registra(tipo, operazione, secondi, righe=None, byte=None, errore=None, livello=0, risparmiati=None):
+    """byte = dati letti o prodotti; risparmiati = byte evitati (es. foto ricompressa prima dell'upload)."""
+    contesto = _contesto.get() or (None, None, None, None)
+    misura = {
+        "istante": time.time(), "sessione": contesto[0], "rerun": contesto[1], "pagina": contesto[2],
+        "tipo": tipo, "operazione": operazione, "livello": livello,
+        "ms": round(secondi * 1000, 3), "righe": righe, "byte": byte, "errore": errore,
+        "risparmiati": risparmiati,
+    }
+    with _lock:
+        _misure.append(misura)
+        if contesto[0] is not None:
+            _ultima[contesto[0]] = time.perf_counter()
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(json.dumps(misura, default=str))
+
+
+def misurata(tipo, nome=None, conta=_dimensione):
+    """Decoratore: durata, righe, byte ed errore di ogni chiamata della funzione.
+
+    `conta(risultato)` restituisce (righe, byte); se il risultato ha un attributo
+    `errore` valorizzato (es. EsitoUpload) conta come chiamata fallita, se ha
+    `byte_risparmiati` (es. prepara_foto) finisce nella colonna risparmiati."""
+    def decoratore(funzione):
+        if not ATTIVA:
+            return funzione
+        operazione = nome or funzione.__qualname__
+
+        @functools.wraps(funzione)
+        def misurando(*args, **kwargs):
+            livello = _profondita.get()
+            gettone = _profondita.set(livello + 1)
+            inizio = time.perf_counter()
+            try:
+                risultato = funzione(*args, **kwargs)
+            except Exception as e:
+                registra(tipo, operazione, time.perf_counter() - inizio, errore=repr(e), livello=livello)
+                raise
+            finally:
+                _profondita.reset(gettone)
+            righe, byte = conta(risultato)
+            registra(tipo, operazione, time.perf_counter() - inizio, righe, byte,
+                     getattr(risultato, "errore", None), livello, getattr(risultato, "byte_risparmiati", None))
+            return risultato
+        return misurando
+    return decoratore
+
+
+def misura_metodi(tipo):
+    """Decoratore di classe: misura tutti i metodi pubblici (InventarioDB)."""
+    def decoratore(classe):
+        if not ATTIVA:
+            return classe
+        for nome, valore in list(vars(classe).items()):
+            if callable(valore) and not nome.startswith("_"):
+                setattr(classe, nome, misurata(tipo, f"{classe.__name__}.{nome}")(valore))
+        return classe
+    return decoratore
+
+
+class _BackendMisurato:
+    """Proxy del backend: ogni chiamata viene misurata, gli errori restano visibili
+    anche quando InventarioDB li nasconde restituendo [] o False."""
+
+    def __init__(self, backend):
+        self._backend = backend
+
+    def __getattr__(self, nome):
+        valore = getattr(self._backend, nome)
+        if not callable(valore) or nome.startswith("_"):
+            return valore
+        return misurata("backend", f"{type(self._backend).__name__}.{nome}")(valore)
+
+
+def misura_backend(backend):
+    return _BackendMisurato(backend) if ATTIVA else backend
+
+
+def nel_contesto(funzione):
+    """Per i thread dei pool: la funzione gira nel contesto (rerun, pagina) di chi la invia."""
+    if not ATTIVA:
+        return funzione
+    return functools.partial(contextvars.copy_context().run, funzione)
+
+
+# --- RERUN ---
+def _chiudi(contesto, fine, errore=None):
+    gettone = _contesto.set(contesto)
+    try:
+        registra("script", contesto[2], fine - contesto[3], errore=errore)
+    finally:
+        _contesto.reset(gettone)
+
+
+def inizia_rerun(pagina, sessione):
+    if not ATTIVA:
+        return
+    with _lock:
+        interrotto = _aperti.pop(sessione, None)
+        ultima = _ultima.get(sessione, 0.0)
+        _reruns[sessione] = numero = _reruns.get(sessione, 0) + 1
+        _aperti[sessione] = contesto = (sessione, numero, pagina, time.perf_counter())
+    if interrotto:
+        # st.rerun e st.stop escono dallo script senza arrivare a fine_rerun: il rerun
+        # si chiude qui, col tempo fino alla sua ultima misura (l'attesa dopo non conta)
+        _chiudi(interrotto, max(ultima, interrotto[3]), "interrotto")
+    _contesto.set(contesto)
+
+
+def fine_rerun():
+    """Tempo totale dello script: la parte non coperta da db e upload è rendering Streamlit."""
+    contesto = _contesto.get() if ATTIVA else None
+    if not contesto:
+        return
+    with _lock:
+        aperto = _aperti.get(contesto[0]) is contesto
+        if aperto:
+            del _aperti[contesto[0]]
+    if aperto:
+        _chiudi(contesto, time.perf_counter())
+    _contesto.set(None)  # i rerun dei frammenti che seguono non sono più di questo rerun
+
+
+def frammento(nome, sessione):
+    """Decoratore per le funzioni @st.fragment: i loro rerun parziali non passano
+    dall'inizio e dalla fine dello script, quindi si misurano da soli (try/finally)."""
+    def decoratore(funzione):
+        if not ATTIVA:
+            return funzione
+
+        @functools.wraps(funzione)
+        def eseguendo(*args, **kwargs):
+            contesto = _contesto.get()
+            with _lock:
+                nel_rerun = contesto is not None and _aperti.get(sessione) is contesto
+                if not nel_rerun:
+                    _reruns[sessione] = numero = _reruns.get(sessione, 0) + 1
+            if nel_rerun:
+                # Primo disegno, dentro il rerun completo: il tempo è già suo
+                return funzione(*args, **kwargs)
+            contesto = (sessione, numero, nome, time.perf_counter())
+            gettone = _contesto.set(contesto)
+            try:
+                return funzione(*args, **kwargs)
+            finally:
+                _chiudi(contesto, time.perf_counter())
+                _contesto.reset(gettone)
+        return eseguendo
+    return decoratore
+
+
+# --- LETTURA ---
+def misure():
+    with _lock:
+        return list(_misure)
+
+
+def riepilogo(per=("pagina", "tipo", "operazione")):
+    """Chiamate, tempi (totale, p50, p95), righe, byte ed errori raggruppati."""
+    df = pd.DataFrame(misure())
+    if df.empty:
+        return df
+    df["pagina"] = df["pagina"].fillna("-")
+    gruppi = df.groupby(list(per), dropna=False)
+    return gruppi.agg(
+        chiamate=("ms", "size"), totale_ms=("ms", "sum"),
+        p50_ms=("ms", "median"), p95_ms=("ms", lambda s: s.quantile(0.95)),
+        righe=("righe", "sum"), byte=("byte", "sum"), risparmiati=("risparmiati", "sum"),
+        errori=("errore", "count"),
+    ).round(2).sort_values("totale_ms", ascending=False).reset_index()
+
+
+def ultimi_rerun(sessione, n=10):
+    """Per ogni rerun della sessione: tempo totale diviso tra database, upload e il resto."""
+    df = pd.DataFrame([m for m in misure() if m["sessione"] == sessione])
+    if df.empty:
+        return df
+    esterne = df[df["livello"] == 0]  # le chiamate annidate sono già nel tempo di chi le ha fatte
+    tabella = esterne.pivot_table(index=["rerun", "pagina"], columns="tipo", values="ms",
+                                  aggfunc="sum", fill_value=0).reset_index()
+    for colonna in ("script", "db", "upload"):
+        if colonna not in tabella:
+            tabella[colonna] = 0.0
+    tabella["altro_ms"] = (tabella["script"] - tabella["db"] - tabella["upload"]).clip(lower=0)
+    tabella = tabella.rename(columns={"script": "totale_ms", "db": "db_ms", "upload": "upload_ms"})
+    colonne = ["rerun", "pagina", "totale_ms", "db_ms", "upload_ms", "altro_ms"]
+    return tabella[colonne].sort_values("rerun", ascending=False).head(n).round(1)
+
+
+def esporta_jsonl():
+    """Tutte le misure, una riga JSON ciascuna (log strutturato da scaricare)."""
+    return "".join(json.dumps(m, default=str) + "\n" for m in misure()).encode("utf-8")
+
+
+def svuota():
+    with _lock:
+        _misure.clear()
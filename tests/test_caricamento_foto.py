@@ -0,0 +1,110 @@
+import threading
+import time
+
+import pytest
+
+import caricamento_foto
+from caricamento_foto import carica_foto
+
+
+class UploaderFinto:
+    """Al posto di cloudinary.uploader.upload: fallisce le prime `errori` volte per chiave."""
+
+    def __init__(self, errori=None, attesa=None):
+        self.errori = dict(errori or {})
+        self.attesa = attesa or {}
+        self.chiamate = []
+        self._lock = threading.Lock()
+
+    def __call__(self, file, **opzioni):
+        chiave = opzioni["public_id"]
+        with self._lock:
+            self.chiamate.append(chiave)
+            da_fallire = self.errori.get(chiave, 0)
+            if da_fallire:
+                self.errori[chiave] = da_fallire - 1
+        if chiave in self.attesa:
+            self.attesa[chiave].wait(5)
+        if da_fallire:
+            raise ConnectionError(f"rete giù per {chiave}")
+        return {"secure_url": f"https://cdn.test/{chiave}.jpg"}
+
+
+def richieste(*chiavi):
+    return {c: (b"jpeg", {"public_id": c}) for c in chiavi}
+
+
+@pytest.fixture(autouse=True)
+def riprova_subito(monkeypatch):
+    monkeypatch.setattr(caricamento_foto, "ATTESA_RIPROVA", 0)
+
+
+def test_carica_tutte_le_foto_in_parallelo():
+    uploader = UploaderFinto()
+    esiti = carica_foto(richieste("main", "cima", "centro", "fondo"), uploader=uploader, prepara=False)
+    assert sorted(esiti) == ["centro", "cima", "fondo", "main"]
+    for chiave, esito in esiti.items():
+        assert esito.url == f"https://cdn.test/{chiave}.jpg"
+        assert esito.errore is None
+        assert esito.tentativi == 1
+
+
+def test_file_mancanti_saltati():
+    esiti = carica_foto({"main": (b"jpeg", {"public_id": "main"}), "cima": (None, {"public_id": "cima"})},
+                        uploader=UploaderFinto(), prepara=False)
+    assert list(esiti) == ["main"]
+
+
+def test_riprova_dopo_un_errore_transitorio():
+    uploader = UploaderFinto(errori={"main": 2})
+    esito = carica_foto(richieste("main"), uploader=uploader, prepara=False)["main"]
+    assert esito.url == "https://cdn.test/main.jpg"
+    assert esito.tentativi == 3
+    assert uploader.chiamate == ["main"] * 3
+
+
+def test_errore_di_un_file_non_ferma_gli_altri():
+    uploader = UploaderFinto(errori={"cima": 99})
+    esiti = carica_foto(richieste("main", "cima"), uploader=uploader, prepara=False, tentativi=2)
+    assert esiti["main"].url and esiti["main"].errore is None
+    assert esiti["cima"].url is None
+    assert "rete giù per cima" in esiti["cima"].errore
+    assert esiti["cima"].tentativi == 2
+
+
+def test_timeout_del_singolo_file():
+    sblocca = threading.Event()
+    uploader = UploaderFinto(attesa={"fondo": sblocca})
+    inizio = time.monotonic()
+    try:
+        esiti = carica_foto(richieste("main", "fondo"), uploader=uploader, prepara=False, timeout=0.2)
+    finally:
+        sblocca.set()
+    assert time.monotonic() - inizio < 2
+    assert esiti["main"].url == "https://cdn.test/main.jpg"
+    assert esiti["fondo"].url is None
+    assert "timeout" in esiti["fondo"].errore
+
+
+def test_prepara_e_impronta_sul_file_inviato():
+    inviati = []
+
+    def uploader(file, **opzioni):
+        inviati.append(file)
+        return {"secure_url": "https://cdn.test/x.jpg"}
+
+    esito = carica_foto(richieste("main"), uploader=uploader, prepara=lambda f: f + b"-ridotta",
+                        impronta=len)["main"]
+    assert inviati == [b"jpeg-ridotta"]
+    assert esito.hash == len(b"jpeg-ridotta")
+
+
+def test_uploader_riceve_il_tempo_rimasto():
+    timeout_ricevuti = []
+
+    def uploader(file, **opzioni):
+        timeout_ricevuti.append(opzioni["timeout"])
+        return {"secure_url": "https://cdn.test/x.jpg"}
+
+    carica_foto(richieste("main"), uploader=uploader, timeout=10, prepara=False)
+    assert 1 <= timeout_ricevuti[0] <= 10
@@ -0,0 +1,71 @@
+import pytest
+
+import db_manager
+from backend import BackendSQLite
+from cache_dati import versione_dati
+from flusso_modifiche import BusModifiche, Evento, SnapshotCondiviso, con_flusso
+
+CONTATORI = ("scatole", "zone", "ubicazioni", "da_allocare", "per_proprietario", "per_zona")
+
+
+@pytest.fixture
+def flusso():
+    """Backend SQLite dietro il proxy del flusso, con uno snapshot già caricato."""
+    bus, snapshot = BusModifiche(), SnapshotCondiviso()
+    bus.iscrivi(snapshot.applica)
+    backend = con_flusso(BackendSQLite(":memory:"), bus)
+    for tabella in ("inventario", "posizioni"):
+        assert snapshot.carica(tabella, [], snapshot.generazione)
+    return backend, bus, snapshot
+
+
+def contatori(stats):
+    return {k: stats[k] for k in CONTATORI}
+
+
+def test_snapshot_segue_ogni_scrittura(flusso):
+    backend, _, snapshot = flusso
+    backend.inserisci("posizioni", [{"id_ubicazione": "GAR.1.1", "zona": "Garage"},
+                                    {"id_ubicazione": "CANT.1.1", "zona": "Cantina"}])
+    backend.inserisci("inventario", [{"nome": f"S{i}", "ubi": "NON ALLOCATA", "proprietario": "Victor"} for i in range(4)])
+    backend.aggiorna("inventario", {"zon": "Garage", "ubi": "GAR.1.1"}, [("id", "in", [1, 2])])
+    backend.upsert("inventario", [{"id": 3, "proprietario": "Evelyn"}], on_conflict="id")  # upsert parziale
+    backend.elimina("inventario", [("id", "eq", 4)])
+    backend.elimina("posizioni", [("id_ubicazione", "eq", "CANT.1.1")])
+
+    assert contatori(snapshot.statistiche()) == contatori(backend.rpc("statistiche_magazzino"))
+    assert snapshot.righe_per_chiave("inventario", [3])[0]["nome"] == "S2"  # i campi non inviati restano
+    assert sorted(o["nome"] for o in snapshot.occupazione()) == ["S0", "S1"]
+
+    backend.svuota("inventario")
+    assert not snapshot.pronta("inventario")  # dopo un RESET la tabella va riletta
+
+
+def test_lettura_vecchia_scartata_se_arrivano_eventi(flusso):
+    backend, _, snapshot = flusso
+    snapshot.invalida("inventario")
+    generazione = snapshot.generazione
+    righe_lette = backend.seleziona("inventario")
+    backend.inserisci("inventario", {"nome": "arrivata durante la lettura"})
+    assert not snapshot.carica("inventario", righe_lette, generazione)
+    assert not snapshot.pronta("inventario")
+
+
+def test_iscritto_che_fallisce_non_ferma_gli_altri():
+    bus, ricevuti = BusModifiche(), []
+    bus.iscrivi(lambda eventi: 1 / 0)
+    bus.iscrivi(ricevuti.extend)
+    bus.pubblica([Evento("inventario", "INSERT", {"id": 1})])
+    assert [e.riga["id"] for e in ricevuti] == [1]
+
+
+def test_solo_gli_eventi_esterni_cambiano_la_versione():
+    db = db_manager.InventarioDB(backend=BackendSQLite(":memory:"))
+    prima = versione_dati()
+    db.backend.inserisci("inventario", {"nome": "scritta da questo processo"})
+    assert versione_dati() == prima  # la invalida chi scrive, con _dati_modificati
+
+    db_manager._bus.pubblica([Evento("inventario", "UPDATE", {"id": 1, "nome": "da un altro dispositivo"})])
+    assert versione_dati() == prima + 1
+    db_manager._bus.pubblica([Evento("inventario", "RESET", {})])
+    assert versione_dati() == prima + 2
@@ -0,0 +1,159 @@
+import io
+
+import pandas as pd
+import pytest
+
+import db_manager
+import esportazione
+from backend import BackendSQLite
+from db_manager import InventarioDB
+from ubicazioni import NON_ALLOCATA, ZONA_DA_DEFINIRE
+
+
+@pytest.fixture
+def db():
+    # Snapshot, indici ed export sono condivisi dal processo: ogni test riparte da zero
+    db_manager._snapshot.invalida()
+    db_manager._snapshot.completo = True  # come con BACKEND=sqlite: tutte le scritture passano da qui
+    db_manager._indice_ricerca.pronto = False
+    db_manager._indice_foto.pronto = False
+    esportazione._cache_export.invalida()
+    yield InventarioDB(backend=BackendSQLite(":memory:"))
+    db_manager._snapshot.completo = False
+    db_manager._snapshot.invalida()
+
+
+def scatola(db, nome, **campi):
+    assert db.aggiungi_scatola(nome=nome, **campi)
+    return next(r["id"] for r in db.visualizza_inventario() if r["nome"] == nome)
+
+
+def test_scatola_aggiunta_modificata_ed_eliminata(db):
+    id_scatola = scatola(db, "Attrezzi", desc="cacciavite e pinze", prop="Victor")
+    assert db.leggi_scatola(id_scatola)["ubi"] == NON_ALLOCATA
+
+    assert db.aggiorna_dati_scatola(id_scatola, "Attrezzi garage", "cacciavite", "Daniel", "viti", "", "")
+    riga = db.leggi_scatola(id_scatola)
+    assert (riga["nome"], riga["proprietario"], riga["cima_testo"]) == ("Attrezzi garage", "Daniel", "viti")
+    assert [r["id"] for r in db.cerca_scatola("caccia")] == [id_scatola]
+
+    assert db.elimina_scatola(id_scatola)
+    assert db.visualizza_inventario() == []
+    assert db.cerca_scatola("caccia") == []
+
+
+def test_statistiche_seguono_le_scritture(db):
+    db.aggiungi_posizione("GAR.1.1", "Garage")
+    db.aggiungi_posizione("CANT.1.1", "Cantina")
+    id_a = scatola(db, "A", prop="Victor")
+    scatola(db, "B", prop="Evelyn")
+    assert db.aggiorna_posizione_scatola(id_a, "Garage", "GAR.1.1")
+
+    stats = db.statistiche_magazzino()
+    assert (stats["scatole"], stats["zone"], stats["ubicazioni"], stats["da_allocare"]) == (2, 2, 2, 1)
+    assert stats["per_zona"]["Garage"] == 1
+    # Stessi numeri calcolati dal database, senza snapshot
+    assert {k: stats[k] for k in ("scatole", "zone", "ubicazioni", "da_allocare")} == \
+        {k: db.backend.rpc("statistiche_magazzino")[k] for k in ("scatole", "zone", "ubicazioni", "da_allocare")}
+
+
+def test_sposta_scatole(db):
+    db.aggiungi_posizione("GAR.1.1", "Garage")
+    db.aggiungi_posizione("GAR.1.2", "Garage")
+    id_a, id_b, id_c = scatola(db, "A"), scatola(db, "B"), scatola(db, "C")
+
+    spostate, errori = db.sposta_scatole([(id_a, "", "gar.1.1"), (id_b, None, "GAR.1.2"), (id_c, "", "XYZ.9")])
+    assert spostate == 2
+    assert errori == [f"Scatola {id_c}: ubicazione 'XYZ.9' non configurata"]
+    assert {r["nome"]: (r["zon"], r["ubi"]) for r in db.visualizza_inventario()} == {
+        "A": ("Garage", "GAR.1.1"), "B": ("Garage", "GAR.1.2"), "C": (ZONA_DA_DEFINIRE, NON_ALLOCATA)}
+    assert [r["nome"] for _, righe in db.scatole_in("GAR", 1) for r in righe] == ["A", "B"]
+
+
+def test_sposta_scatola_eliminata_non_la_ricrea(db):
+    db.aggiungi_posizione("GAR.1.1", "Garage")
+    id_a, id_b = scatola(db, "A"), scatola(db, "B")
+    db.elimina_scatola(id_b)
+
+    spostate, errori = db.sposta_scatole([(id_a, "", "GAR.1.1"), (id_b, "", "GAR.1.1")])
+    assert spostate == 1
+    assert len(errori) == 1 and str(id_b) in errori[0]
+    assert [r["nome"] for r in db.backend.seleziona("inventario")] == ["A"]
+    assert not db.aggiorna_posizione_scatola(id_b, "Garage", "GAR.1.1")
+    assert [r["nome"] for r in db.backend.seleziona("inventario")] == ["A"]
+
+
+@pytest.mark.parametrize("formato", ["csv", "xlsx"])
+def test_export_di_tutto_l_inventario(db, formato):
+    for n in range(3):
+        scatola(db, f"Scatola {n}", prop="Carly")
+    file_export = db.esporta_inventario(formato)
+    if formato == "csv":
+        df = pd.read_csv(io.BytesIO(file_export), sep=";", encoding="utf-8-sig")  # CSV all'italiana, per Excel
+    else:
+        df = pd.read_excel(io.BytesIO(file_export))
+    assert list(df["nome"]) == ["Scatola 0", "Scatola 1", "Scatola 2"]
+    assert set(df["proprietario"]) == {"Carly"}
+
+
+def test_export_rifatto_dopo_una_modifica(db):
+    scatola(db, "Prima")
+    assert b"Prima" in db.esporta_inventario("csv")
+    scatola(db, "Seconda")
+    assert b"Seconda" in db.esporta_inventario("csv")
+
+
+def test_import_le_celle_vuote_non_cancellano(db):
+    db.aggiungi_posizione("GAR.1.1", "Garage")
+    id_a = scatola(db, "A", desc="vecchia", prop="Victor", ct="viti")
+    db.aggiorna_posizione_scatola(id_a, "Garage", "GAR.1.1")
+    scatola(db, "B", desc="altra", prop="Rebby")
+
+    file_import = io.BytesIO(b"nome;descrizione;proprietario;cima;ubicazione\nA;nuova;;;\nB;;Daniel;;\nC;;;;\n")
+    file_import.name = "scatole.csv"
+    esito = db.importa_scatole(file_import)
+
+    assert esito.righe == 3 and not esito.errori
+    righe = {r["nome"]: r for r in db.backend.seleziona("inventario")}
+    assert (righe["A"]["descrizione"], righe["A"]["proprietario"], righe["A"]["cima_testo"]) == ("nuova", "Victor", "viti")
+    assert (righe["A"]["zon"], righe["A"]["ubi"]) == ("Garage", "GAR.1.1")
+    assert (righe["B"]["descrizione"], righe["B"]["proprietario"]) == ("altra", "Daniel")
+    assert (righe["C"]["zon"], righe["C"]["ubi"]) == (ZONA_DA_DEFINIRE, NON_ALLOCATA)
+    assert {r["nome"]: r["descrizione"] for r in db.visualizza_inventario()}["A"] == "nuova"
+
+
+def test_scatola_nuova_ha_la_data_di_inserimento(db):
+    id_scatola = scatola(db, "Nuova")
+    assert db.leggi_scatola(id_scatola)["data_inserimento"]
+
+
+def test_import_nomi_ripetuti_in_blocchi_diversi(db):
+    scatola(db, "BOX-1", desc="vecchia")
+
+    file_import = io.BytesIO(b"nome;descrizione\nbox-1;nuova\nBOX-2;prima\nbox-2;seconda\n")
+    file_import.name = "scatole.csv"
+    esito = db.importa_scatole(file_import, dimensione_blocco=1)
+
+    assert not esito.errori
+    righe = db.backend.seleziona("inventario")
+    assert sorted((r["nome"], r["descrizione"]) for r in righe) == [("BOX-1", "nuova"), ("BOX-2", "seconda")]
+
+
+def test_elenco_interrotto_non_resta_in_cache(db, monkeypatch):
+    db_manager._snapshot.completo = False  # senza flusso completo l'elenco passa dalle pagine
+    for n in range(5):
+        scatola(db, f"S{n}")
+    db_manager._snapshot.invalida()
+    monkeypatch.setattr(db_manager, "PAGINA_MASSIMA", 2)
+    seleziona = db.backend.seleziona
+    chiamate = []
+
+    def seconda_pagina_fallisce(*args, **kwargs):
+        chiamate.append(args)
+        if len(chiamate) == 2:
+            raise ConnectionError("timeout")
+        return seleziona(*args, **kwargs)
+
+    monkeypatch.setattr(db.backend, "seleziona", seconda_pagina_fallisce)
+    assert db.elenco_scatole() == []
+    assert [r["nome"] for r in db.elenco_scatole()] == ["S0", "S1", "S2", "S3", "S4"]
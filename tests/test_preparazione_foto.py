@@ -0,0 +1,44 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+from preparazione_foto import prepara_foto
+
+
+def foto(img, formato, nome, **opzioni):
+    file = io.BytesIO()
+    img.save(file, formato, **opzioni)
+    file.seek(0)
+    file.name = nome
+    return file
+
+
+def test_foto_grande_ridotta_in_jpeg():
+    rumore = Image.fromarray((np.random.default_rng(1).random((2000, 1500, 3)) * 255).astype(np.uint8))
+    originale = foto(rumore, "PNG", "scatola.png")
+    pronta = prepara_foto(originale)
+    img = Image.open(pronta)
+    assert (img.format, max(img.size), pronta.name) == ("JPEG", 1600, "scatola.jpg")
+    assert pronta.byte_risparmiati == len(originale.getvalue()) - len(pronta.getvalue()) > 0
+
+
+def test_foto_gia_compatta_caricata_com_e():
+    originale = foto(Image.new("RGB", (40, 40), (10, 200, 30)), "JPEG", "piccola.jpg", quality=60, optimize=True)
+    pronta = prepara_foto(originale)
+    assert pronta.getvalue() == originale.getvalue()
+    assert pronta.byte_risparmiati == 0
+
+
+def test_trasparenza_su_fondo_bianco():
+    pixel = (np.random.default_rng(2).random((800, 800, 4)) * 255).astype(np.uint8)
+    pixel[:100, :100, 3] = 0
+    pronta = prepara_foto(foto(Image.fromarray(pixel, "RGBA"), "PNG", "logo.png"))
+    img = Image.open(pronta)
+    assert img.format == "JPEG"
+    assert all(c > 245 for c in img.getpixel((20, 20)))
+
+
+def test_file_non_immagine_restituito_intatto():
+    file = io.BytesIO(b"non sono una foto")
+    assert prepara_foto(file) is file
@@ -0,0 +1,101 @@
+import pytest
+
+from backend import BackendSQLite
+from replica_locale import ReplicaLocale, SincronizzatoreCloud
+
+
+class Errore(Exception):
+    def __init__(self, code):
+        super().__init__(f"errore {code}")
+        self.code = code
+
+
+class CloudFinto(BackendSQLite):
+    """Il 'cloud' è un altro SQLite in memoria; `guasto` fa fallire le scritture con quel codice."""
+    guasto = None
+
+    def _forse_guasto(self):
+        if self.guasto:
+            raise Errore(self.guasto)
+
+    def inserisci(self, tabella, righe):
+        self._forse_guasto()
+        return super().inserisci(tabella, righe)
+
+    def aggiorna(self, tabella, dati, filtri):
+        self._forse_guasto()
+        return super().aggiorna(tabella, dati, filtri)
+
+
+@pytest.fixture
+def replica():
+    replica = ReplicaLocale(":memory:")
+    cloud = CloudFinto(":memory:")
+    # Il sincronizzatore non parte come thread: i giri si chiamano a mano
+    replica.sincronizzatore = SincronizzatoreCloud(replica, cloud)
+    cloud.inserisci("inventario", [{"nome": "già nel cloud", "ubi": "NON ALLOCATA"}] * 3)
+    assert replica.sincronizzatore.sincronizza()
+    return replica, cloud
+
+
+def nomi(backend):
+    return {r["id"]: r["nome"] for r in backend.seleziona("inventario")}
+
+
+def test_inserimento_offline_prende_l_id_del_cloud(replica):
+    replica, cloud = replica
+    nuova = replica.inserisci("inventario", {"nome": "offline", "ubi": "NON ALLOCATA"})[0]
+    assert nuova["id"] < 0  # provvisorio finché il cloud non risponde
+    replica.aggiorna("inventario", {"descrizione": "modificata offline"}, [("id", "eq", nuova["id"])])
+    replica.aggiorna("inventario", {"ubi": "GAR.1.1"}, [("id", "in", [nuova["id"], 1])])
+
+    assert replica.sincronizzatore.sincronizza()
+
+    assert replica.stato()["in_attesa"] == 0
+    assert nomi(replica) == nomi(cloud) == {1: "già nel cloud", 2: "già nel cloud", 3: "già nel cloud", 4: "offline"}
+    remota = cloud.seleziona("inventario", filtri=[("id", "eq", 4)])[0]
+    assert (remota["descrizione"], remota["ubi"]) == ("modificata offline", "GAR.1.1")
+
+
+def test_modifica_di_riga_eliminata_altrove_va_tra_i_conflitti(replica):
+    replica, cloud = replica
+    replica.aggiorna("inventario", {"nome": "rinominata"}, [("id", "eq", 2)])
+    cloud.elimina("inventario", [("id", "eq", 2)])
+
+    assert replica.sincronizzatore.sincronizza()
+
+    stato = replica.stato()
+    assert (stato["in_attesa"], stato["conflitti"]) == (0, 1)
+    assert 2 not in nomi(replica)  # la replica si riallinea al cloud
+
+
+def test_errore_transitorio_resta_in_coda(replica):
+    replica, cloud = replica
+    replica.aggiorna("inventario", {"nome": "da ritentare"}, [("id", "eq", 1)])
+    cloud.guasto = "503"
+
+    assert not replica.sincronizzatore.sincronizza()
+    voce = replica.prossima_voce()
+    assert (voce["tentativi"], replica.stato()["conflitti"]) == (1, 0)
+    assert nomi(replica)[1] == "da ritentare"  # i dati locali non vengono sovrascritti
+
+    cloud.guasto = None
+    assert replica.sincronizzatore.sincronizza()
+    assert nomi(cloud)[1] == "da ritentare"
+
+
+def test_vincolo_violato_scartato(replica):
+    replica, cloud = replica
+    replica.inserisci("inventario", {"nome": "doppione", "ubi": "NON ALLOCATA"})
+    cloud.guasto = "23505"
+
+    assert replica.sincronizzatore.sincronizza()
+    assert (replica.stato()["in_attesa"], replica.stato()["conflitti"]) == (0, 1)
+
+
+def test_eliminazione_senza_righe_non_va_nel_journal(replica):
+    replica, _ = replica
+    assert replica.elimina("inventario", [("id", "eq", 999)]) == 0
+    assert replica.stato()["in_attesa"] == 0
+    replica.elimina("inventario", [("id", "eq", 3)])
+    assert replica.stato()["in_attesa"] == 1
@@ -0,0 +1,87 @@
+import pytest
+
+import db_manager
+from backend import BackendSQLite
+from db_manager import InventarioDB
+from ubicazioni import CAPIENZA_PREDEFINITA, NON_ALLOCATA, IndiceUbicazioni, Ubicazione, analizza_codice
+
+
+@pytest.mark.parametrize("codice, atteso", [
+    ("GAR.1.3", Ubicazione("GAR.1.3", "GAR", 1, 3)),
+    (" gar.2.10 ", Ubicazione("GAR.2.10", "GAR", 2, 10)),
+    ("A1-01", Ubicazione("A1-01", "A", 1, 1)),
+    ("SCAFFALE 1", Ubicazione("SCAFFALE 1", "SCAFFALE", 1, None)),
+    ("SOTTOSCALA", Ubicazione("SOTTOSCALA", None, None, None)),
+    (None, Ubicazione("", None, None, None)),
+])
+def test_analizza_codice(codice, atteso):
+    assert analizza_codice(codice) == atteso
+
+
+@pytest.fixture
+def indice():
+    posizioni = [
+        {"id_ubicazione": "GAR.1.1", "zona": "Garage", "capienza": 2},
+        {"id_ubicazione": "GAR.1.2", "zona": "Garage"},
+        {"id_ubicazione": "GAR.2.1", "zona": "Garage", "capienza": 3},
+        {"id_ubicazione": "CANT.1.1", "zona": "Cantina"},
+        {"id_ubicazione": "SOTTOSCALA", "zona": "Cantina"},
+    ]
+    inventario = [
+        {"id": 1, "nome": "Attrezzi", "ubi": "GAR.1.1"},
+        {"id": 2, "nome": "Viti", "ubi": "gar.1.1"},
+        {"id": 3, "nome": "Lampadine", "ubi": "GAR.1.2"},
+        {"id": 4, "nome": "Libri", "ubi": "GAR.2.1"},
+        {"id": 5, "nome": "Da sistemare", "ubi": NON_ALLOCATA},
+    ]
+    return IndiceUbicazioni.da_righe(posizioni, inventario)
+
+
+def test_zone_e_corsie(indice):
+    assert indice.zone() == ["Cantina", "Garage"]
+    assert indice.corsie("Garage") == indice.corsie("gar") == [1, 2]
+    assert indice.corsie("Cantina") == [1]  # SOTTOSCALA non ha corsia
+
+
+def test_capienza_occupati_e_liberi(indice):
+    posti = {p["codice"]: (p["capienza"], p["occupati"], p["liberi"]) for p in indice.posti("Garage")}
+    assert posti == {"GAR.1.1": (2, 2, 0), "GAR.1.2": (CAPIENZA_PREDEFINITA, 1, 0), "GAR.2.1": (3, 1, 2)}
+    assert [p["codice"] for p in indice.posti_liberi("Garage")] == ["GAR.2.1"]
+    assert [p["codice"] for p in indice.posti_liberi("Cantina")] == ["CANT.1.1", "SOTTOSCALA"]
+    assert [p["codice"] for p in indice.posti("GAR", corsia=1, ripiano=2)] == ["GAR.1.2"]
+
+
+def test_scatole_in_un_ramo(indice):
+    assert [(p["codice"], scatole) for p, scatole in indice.scatole_in("Garage", 1)] == [
+        ("GAR.1.1", {1: "Attrezzi", 2: "Viti"}), ("GAR.1.2", {3: "Lampadine"})]
+    assert indice.scatole_in("Cantina") == []
+
+
+def test_aggiornamenti_riga_per_riga(indice):
+    indice.togli_scatola(1, {"ubi": "GAR.1.1"})
+    indice.metti_scatola(1, {"ubi": "CANT.1.1", "nome": "Attrezzi"})
+    assert [p["codice"] for p in indice.posti_liberi("GAR", 1)] == ["GAR.1.1"]
+    assert [p["codice"] for p in indice.posti_liberi("Cantina")] == ["SOTTOSCALA"]
+
+    indice.togli_posizione({"id_ubicazione": "CANT.1.1"})
+    indice.togli_posizione({"id_ubicazione": "SOTTOSCALA"})
+    assert indice.zone() == ["Garage"]
+    assert indice.corsie("CANT") == []
+
+
+@pytest.mark.parametrize("completo", [True, False])
+def test_inventario_db_con_e_senza_snapshot(completo):
+    db_manager._snapshot.invalida()
+    db_manager._snapshot.completo = completo
+    try:
+        db = InventarioDB(backend=BackendSQLite(":memory:"))
+        db.aggiungi_posizione("GAR.1.1", "Garage", capienza=2)
+        db.aggiungi_posizione("GAR.1.2", "Garage")
+        db.aggiungi_scatola(nome="A", ubi="GAR.1.1", zona="Garage")
+        assert [p["codice"] for p in db.posti_liberi("Garage")] == ["GAR.1.1", "GAR.1.2"]
+        db.aggiungi_scatola(nome="B", ubi="GAR.1.1", zona="Garage")
+        assert [p["codice"] for p in db.posti_liberi("Garage")] == ["GAR.1.2"]
+        assert [[r["nome"] for r in righe] for _, righe in db.scatole_in("GAR", 1, 1)] == [["A", "B"]]
+    finally:
+        db_manager._snapshot.completo = False
+        db_manager._snapshot.invalida()
@@ -0,0 +1,148 @@
+import re
+from collections import defaultdict, namedtuple
+
+# --- PARAMETRI ---
+CAPIENZA_PREDEFINITA = 1  # scatole per ripiano quando la colonna `capienza` è vuota
+NON_ALLOCATA = "NON ALLOCATA"  # ubi delle scatole che non hanno ancora un posto
+ZONA_DA_DEFINIRE = "DA DEFINIRE"  # zon delle stesse scatole
+
+# Codici stampati sulle etichette: SIGLA.corsia.ripiano (GAR.1.1, CANT.1.5);
+# si accettano anche trattino/spazio e il ripiano mancante (A1-01, SCAFFALE 1)
+_CODICE = re.compile(r"^([A-Z]+)[.\-_ ]*(\d+)(?:[.\-_ ]+(\d+))?$")
+
+Ubicazione = namedtuple("Ubicazione", "codice sigla corsia ripiano")
+
+
+def normalizza(codice):
+    return str(codice or "").strip().upper()
+
+
+def analizza_codice(codice):
+    """'GAR.1.3' -> Ubicazione('GAR.1.3', 'GAR', 1, 3); corsia e ripiano None se il codice è libero."""
+    codice = normalizza(codice)
+    trovato = _CODICE.match(codice)
+    if not trovato:
+        return Ubicazione(codice, None, None, None)
+    sigla, corsia, ripiano = trovato.groups()
+    return Ubicazione(codice, sigla, int(corsia), int(ripiano) if ripiano else None)
+
+
+def _ordine(posto):
+    return (posto["corsia"] is None, posto["corsia"] or 0, posto["ripiano"] or 0, posto["codice"])
+
+
+class IndiceUbicazioni:
+    """Ubicazioni in gerarchia zona -> corsia -> codici, con le scatole di ogni codice.
+
+    "Cosa c'è nella corsia 1 del Garage" e "posti liberi in Cantina" leggono
+    solo i codici di quel ramo, non le tabelle intere. La zona si può indicare
+    per nome ("Garage") o per sigla ("GAR"). Non è thread-safe da solo: lo
+    snapshot condiviso lo usa sotto il proprio lock."""
+
+    def __init__(self):
+        self.svuota_posizioni()
+        self.svuota_scatole()
+
+    @classmethod
+    def da_righe(cls, posizioni, inventario):
+        indice = cls()
+        for p in posizioni:
+            indice.metti_posizione(p)
+        for r in inventario:
+            indice.metti_scatola(r.get("id"), r)
+        return indice
+
+    def svuota_posizioni(self):
+        self._posti = {}                                   # codice -> posto (dict)
+        self._rami = defaultdict(lambda: defaultdict(set))  # ZONA -> corsia -> {codici}
+        self._sigle = defaultdict(set)                      # sigla -> {ZONA}
+        self._nomi_zona = {}                                # ZONA -> nome come scritto in posizioni
+
+    def svuota_scatole(self):
+        self._scatole = {}  # codice -> {id scatola: nome}
+
+    # --- aggiornamento riga per riga ---
+    def metti_posizione(self, riga):
+        u = analizza_codice(riga.get("id_ubicazione"))
+        if not u.codice:
+            return
+        self.togli_posizione(riga)
+        zona = str(riga.get("zona") or "N/D").strip()
+        chiave_zona = zona.upper()
+        self._posti[u.codice] = {
+            "codice": u.codice, "zona": zona, "sigla": u.sigla, "corsia": u.corsia, "ripiano": u.ripiano,
+            "capienza": int(riga.get("capienza") or CAPIENZA_PREDEFINITA),
+        }
+        self._rami[chiave_zona][u.corsia].add(u.codice)
+        self._nomi_zona[chiave_zona] = zona
+        if u.sigla:
+            self._sigle[u.sigla].add(chiave_zona)
+
+    def togli_posizione(self, riga):
+        posto = self._posti.pop(normalizza(riga.get("id_ubicazione")), None)
+        if posto is None:
+            return
+        chiave_zona = posto["zona"].upper()
+        corsie = self._rami[chiave_zona]
+        corsie[posto["corsia"]].discard(posto["codice"])
+        if not corsie[posto["corsia"]]:
+            del corsie[posto["corsia"]]
+        if not corsie:
+            del self._rami[chiave_zona]
+            self._nomi_zona.pop(chiave_zona, None)
+            for zone in self._sigle.values():
+                zone.discard(chiave_zona)
+
+    def metti_scatola(self, id_scatola, riga):
+        codice = normalizza(riga.get("ubi"))
+        if codice and codice != NON_ALLOCATA:
+            self._scatole.setdefault(codice, {})[id_scatola] = riga.get("nome")
+
+    def togli_scatola(self, id_scatola, riga):
+        codice = normalizza(riga.get("ubi"))
+        presenti = self._scatole.get(codice)
+        if presenti is None:
+            return
+        presenti.pop(id_scatola, None)
+        if not presenti:
+            del self._scatole[codice]
+
+    # --- interrogazioni ---
+    def _zone(self, zona):
+        """Nome o sigla -> chiavi delle zone corrispondenti."""
+        chiave = normalizza(zona)
+        if chiave in self._rami:
+            return [chiave]
+        return sorted(self._sigle.get(chiave, ()))
+
+    def zone(self):
+        return sorted(self._nomi_zona.values())
+
+    def corsie(self, zona):
+        return sorted({c for z in self._zone(zona) for c in self._rami[z] if c is not None})
+
+    def posti(self, zona, corsia=None, ripiano=None):
+        """Le ubicazioni del ramo, ordinate per corsia e ripiano, con occupati e liberi."""
+        risultati = []
+        for z in self._zone(zona):
+            corsie = self._rami[z]
+            for c in (corsie if corsia is None else [corsia]):
+                for codice in corsie.get(c, ()):
+                    posto = self._posti[codice]
+                    if ripiano is not None and posto["ripiano"] != ripiano:
+                        continue
+                    occupati = len(self._scatole.get(codice, ()))
+                    risultati.append(dict(posto, occupati=occupati, liberi=max(posto["capienza"] - occupati, 0)))
+        return sorted(risultati, key=_ordine)
+
+    def scatole_in(self, zona, corsia=None, ripiano=None):
+        """[(posto, {id: nome})] delle ubicazioni occupate del ramo."""
+        return [(p, dict(self._scatole[p["codice"]])) for p in self.posti(zona, corsia, ripiano)
+                if p["codice"] in self._scatole]
+
+    def posti_liberi(self, zona, corsia=None):
+        return [p for p in self.posti(zona, corsia) if p["liberi"] > 0]
+
+    def occupazione(self):
+        """Nome e ubicazione delle sole scatole allocate (come elenco_occupazione)."""
+        return [{"nome": nome, "ubi": codice} for codice, scatole in self._scatole.items() for nome in scatole.values()]